@@ -16,11 +16,65 @@
 #   limitations under the License.
 
 from printing import *
-import ast
+from manul_queue import CorpusIndex, pending_batch_size
+from afl_native import load_native_mutator
+import ast  # only to read afl_state_* files of old sessions, see AFLFuzzer.restore_state
+import zlib
 
 #TODO: write unit test for each of this function.
-tokens_list = None
-tokens_list_length = None
+
+
+class MutationDispatcher(object):
+    '''
+    State shared by the AFL mutators of all queue entries of a fuzzer instance. Tokens are kept in a tuple so that
+    every entry (and the native library) sees the same immutable list until the dictionary is replaced.
+    '''
+    def __init__(self):
+        self.tokens = ()
+        self.gui_state = None
+        self.auto_dict = None  # collects tokens from byteflip_1 results, None if disabled
+
+    def setup(self, tokens, gui_state, auto_dict=None):
+        self.set_tokens(tokens)
+        self.gui_state = gui_state
+        self.auto_dict = auto_dict
+
+    def set_tokens(self, tokens):
+        self.tokens = tuple(tokens)
+
+
+dispatcher = MutationDispatcher()
+# effector map of the entry being mutated, None means that every byte is worth mutating
+eff_map = None
+# number of deterministic candidates skipped because an earlier stage already produced them
+redundant_skipped = 0
+# cached queue contents used by splice, shared by all entries of this fuzzer instance
+corpus_index = CorpusIndex()
+# compiled arithmetic, interesting values and havoc stages, None if libaflmutate is not built
+native = load_native_mutator()
+
+
+def next_effective_pos(pos, width, data_len):
+    '''
+    Returns the first position starting from pos where a width bytes long mutation touches at least one block
+    which changed the execution path during byteflip_1, data_len if there are no such positions left.
+    '''
+    if eff_map is None:
+        return pos
+    last = data_len - width
+    while pos <= last:
+        if eff_map[pos >> AFL_EFF_MAP_SCALE2] or eff_map[(pos + width - 1) >> AFL_EFF_MAP_SCALE2]:
+            return pos
+        pos += 1
+    return data_len
+
+
+def native_stage(stage, data, func_state, width):
+    global redundant_skipped
+    func_state, modified_slice, skipped = stage(data, func_state, width, eff_map)
+    redundant_skipped += skipped
+    return data, func_state, modified_slice
+
 
 def bitflip_1bit(data, func_state): # for i in range((len(data)*8)):
     if not func_state:
@@ -74,9 +128,9 @@ def byteflip_1(data, func_state): # for i in range((len(data))):
 
     data[func_state] ^= 0xFF
 
+    modified_offset = func_state
     func_state += 1
 
-    modified_offset = func_state
     return data, func_state, (modified_offset, modified_offset)
 
 
@@ -84,6 +138,7 @@ def byteflip_2(data, func_state): # for i in range(1, ((len(data)))):
     if not func_state:
         func_state = 0
 
+    func_state = next_effective_pos(func_state, 2, len(data))
     if func_state + 1 >= len(data):
         return data, None, None # we are done here, lets switch to the next function
 
@@ -103,6 +158,7 @@ def byteflip_4(data, func_state):
     if not func_state:
         func_state = 0
 
+    func_state = next_effective_pos(func_state, 4, len(data))
     if func_state + 3 >= len(data):
         return data, None, None
 
@@ -121,36 +177,54 @@ def byteflip_4(data, func_state):
 
 
 def mutate_byte_arithmetic(data, func_state):
-    # func_state [index, offset, do_add]
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.arith, data, func_state, 1)
+
+    # func_state [index, offset, do_sub]
     if not func_state:
         func_state = [0, 0, False]
 
-    if func_state[1] > AFL_ARITH_MAX:
-        func_state[0] += 1
-        func_state[1] = 0
+    data_len = len(data)
+    while True:
+        if func_state[1] > AFL_ARITH_MAX:
+            func_state[0] += 1
+            func_state[1] = 0
+
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 1, data_len)
+
+        if func_state[0] >= data_len:
+            if func_state[2] == False:
+                func_state = [next_effective_pos(0, 1, data_len), 0, True]
+                if func_state[0] >= data_len:
+                    return data, None, None
+            else:
+                return data, None, None
 
-    if func_state[0] >= len(data):
+        orig = data[func_state[0]]
         if func_state[2] == False:
-            func_state = [0, 0, True]
+            val = in_range_8(orig + func_state[1])
         else:
-            return data, None, None
-
-    # TODO: we have to check for could_be_bitflip()
+            val = in_range_8(orig - func_state[1])
+        func_state[1] += 1
 
-    if func_state[2] == False:
-        val = data[func_state[0]] + func_state[1]
-    else:
-        val = data[func_state[0]] - func_state[1]
+        # bitflip stages already produced this one
+        if is_not_bitflip(orig ^ val):
+            break
+        redundant_skipped += 1
 
     store_8(data, func_state[0], val)
     modified_offset = func_state[0]
 
-    func_state[1] += 1
-
     return data, func_state, (modified_offset, modified_offset)
 
 
 def mutate_2bytes_arithmetic(data, func_state):
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.arith, data, func_state, 2)
+
     data_len = len(data)
     if data_len < 2:
         return data, None, None
@@ -158,33 +232,47 @@ def mutate_2bytes_arithmetic(data, func_state):
     if not func_state:
         func_state = [0, 0, False]
 
-    if func_state[1] > AFL_ARITH_MAX:
-        func_state[0] += 1
-        func_state[1] = 0
+    while True:
+        if func_state[1] > AFL_ARITH_MAX:
+            func_state[0] += 1
+            func_state[1] = 0
+
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 2, data_len)
 
-    if func_state[0] + 1 >= data_len:
+        if func_state[0] + 1 >= data_len:
+            if func_state[2] == False:
+                func_state = [next_effective_pos(0, 2, data_len), 0, True]
+                if func_state[0] + 1 >= data_len:
+                    return data, None, None
+            else:
+                return data, None, None
+
+        orig = load_16(data, func_state[0])
+        # if the low byte doesn't overflow, 1 byte arithmetic already produced this one
         if func_state[2] == False:
-            func_state = [0, 0, True]
+            val = in_range_16(orig + func_state[1])
+            overflow = (orig & 0xff) + func_state[1] > 0xff
         else:
-            return data, None, None
+            val = in_range_16(orig - func_state[1])
+            overflow = (orig & 0xff) < func_state[1]
+        func_state[1] += 1
 
-    # TODO: we have to check for could_be_bitflip()
-    val = load_16(data, func_state[0])
-
-    if func_state[2] == False:
-        val += func_state[1]
-    else:
-        val -= func_state[1]
+        if overflow and is_not_bitflip(orig ^ val):
+            break
+        redundant_skipped += 1
 
     store_16(data, func_state[0], val)
     modified_slice = (func_state[0], func_state[0] + 1)
 
-    func_state[1] += 1
-
     return data, func_state, modified_slice
 
 
 def mutate_4bytes_arithmetic(data, func_state):
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.arith, data, func_state, 4)
+
     data_len = len(data)
     if data_len < 4:
         return data, None, None
@@ -192,56 +280,82 @@ def mutate_4bytes_arithmetic(data, func_state):
     if not func_state:
         func_state = [0, 0, False]
 
-    if func_state[1] > AFL_ARITH_MAX:
-        func_state[0] += 1
-        func_state[1] = 0
+    while True:
+        if func_state[1] > AFL_ARITH_MAX:
+            func_state[0] += 1
+            func_state[1] = 0
+
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 4, data_len)
+
+        if func_state[0] + 3 >= data_len:
+            if func_state[2] == False:
+                func_state = [next_effective_pos(0, 4, data_len), 0, True]
+                if func_state[0] + 3 >= data_len:
+                    return data, None, None
+            else:
+                return data, None, None
 
-    if func_state[0] + 3 >= len(data):
+        orig = load_32(data, func_state[0])
+        # if the low word doesn't overflow, 2 bytes arithmetic already produced this one
         if func_state[2] == False:
-            func_state = [0, 0, True]
+            val = in_range_32(orig + func_state[1])
+            overflow = (orig & 0xffff) + func_state[1] > 0xffff
         else:
-            return data, None, None
+            val = in_range_32(orig - func_state[1])
+            overflow = (orig & 0xffff) < func_state[1]
+        func_state[1] += 1
 
-    # TODO: we have to check for could_be_bitflip()
-    val = load_32(data, func_state[0])
-
-    if func_state[2] == False:
-        val += func_state[1]
-    else:
-        val -= func_state[1]
+        if overflow and is_not_bitflip(orig ^ val):
+            break
+        redundant_skipped += 1
 
     store_32(data, func_state[0], val)
     modified_slice = (func_state[0], func_state[0] + 3)
 
-    func_state[1] += 1
-
     return data, func_state, modified_slice
 
 
-# TODO: implement is_not_bitflip and is_not_arithmetic
 def mutate_1byte_interesting(data, func_state):
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.interesting, data, func_state, 1)
+
     if not func_state:
         func_state = [0, 0]
 
-    if func_state[1] >= len(interesting_8_Bit):
-        func_state[0] += 1
-        func_state[1] = 0
+    data_len = len(data)
+    while True:
+        if func_state[1] >= len(interesting_8_Bit):
+            func_state[0] += 1
+            func_state[1] = 0
 
-    if func_state[0] >= len(data):
-        return data, None, None
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 1, data_len)
 
-    interesting_value = interesting_8_Bit[func_state[1]]
+        if func_state[0] >= data_len:
+            return data, None, None
 
-    data[func_state[0]] = in_range_8(interesting_value)
+        orig = data[func_state[0]]
+        val = in_range_8(interesting_8_Bit[func_state[1]])
+        func_state[1] += 1
 
-    func_state[1] += 1
+        # skip values already produced by bitflip and arithmetic stages
+        if is_not_bitflip(orig ^ val) and is_not_arithmetic(orig, val, 1):
+            break
+        redundant_skipped += 1
+
+    data[func_state[0]] = val
 
     modified_offset = func_state[0]
     return data, func_state, (modified_offset, modified_offset)
 
 
-# TODO: implement is_not_bitflip and is_not_arithmetic
 def mutate_2bytes_interesting(data, func_state):
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.interesting, data, func_state, 2)
+
     data_len = len(data)
     if data_len < 2:
         return data, None, None
@@ -249,31 +363,45 @@ def mutate_2bytes_interesting(data, func_state):
     if not func_state:
         func_state = [0, 0, False]
 
-    if func_state[1] >= len(interesting_16_Bit):
-        func_state[0] += 1
-        func_state[1] = 0
+    while True:
+        if func_state[1] >= len(interesting_16_Bit):
+            func_state[0] += 1
+            func_state[1] = 0
 
-    if func_state[0] + 1 >= data_len:
-        if func_state[2] == False:
-            func_state = [0, 0, True]
-        else:
-            return data, None, None
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 2, data_len)
 
-    interesting_value = in_range_16(interesting_16_Bit[func_state[1]])
+        if func_state[0] + 1 >= data_len:
+            if func_state[2] == False:
+                func_state = [next_effective_pos(0, 2, data_len), 0, True]
+                if func_state[0] + 1 >= data_len:
+                    return data, None, None
+            else:
+                return data, None, None
 
-    if func_state[2]:
-        interesting_value = swap_16(interesting_value)
+        orig = load_16(data, func_state[0])
+        val = in_range_16(interesting_16_Bit[func_state[1]])
+        if func_state[2]:
+            val = swap_16(val)
+        func_state[1] += 1
 
-    store_16(data, func_state[0], interesting_value)
-    modified_slice = (func_state[0], func_state[0] + 1)
+        # skip values already produced by bitflip, arithmetic and previous interesting stages
+        if is_not_bitflip(orig ^ val) and is_not_arithmetic(orig, val, 2) and \
+           is_not_interesting(orig, val, 2, func_state[2]):
+            break
+        redundant_skipped += 1
 
-    func_state[1] += 1
+    store_16(data, func_state[0], val)
+    modified_slice = (func_state[0], func_state[0] + 1)
 
     return data, func_state, modified_slice
 
 
-# TODO: implement is_not_bitflip and is_not_arithmetic
 def mutate_4bytes_interesting(data, func_state):
+    global redundant_skipped
+    if native is not None:
+        return native_stage(native.interesting, data, func_state, 4)
+
     data_len = len(data)
     if data_len < 4:
         return data, None, None
@@ -281,41 +409,51 @@ def mutate_4bytes_interesting(data, func_state):
     if not func_state:
         func_state = [0, 0, False]
 
-    if func_state[1] >= len(interesting_32_Bit):
-        func_state[0] += 1
-        func_state[1] = 0
+    while True:
+        if func_state[1] >= len(interesting_32_Bit):
+            func_state[0] += 1
+            func_state[1] = 0
 
-    if func_state[0] + 3 >= data_len:
-        if func_state[2] == False:
-            func_state = [0, 0, True]
-        else:
-            return data, None, None
+        if func_state[1] == 0:
+            func_state[0] = next_effective_pos(func_state[0], 4, data_len)
 
-    interesting_value = in_range_32(interesting_32_Bit[func_state[1]])
+        if func_state[0] + 3 >= data_len:
+            if func_state[2] == False:
+                func_state = [next_effective_pos(0, 4, data_len), 0, True]
+                if func_state[0] + 3 >= data_len:
+                    return data, None, None
+            else:
+                return data, None, None
 
-    if func_state[2]:
-        interesting_value = swap_32(interesting_value)
+        orig = load_32(data, func_state[0])
+        val = in_range_32(interesting_32_Bit[func_state[1]])
+        if func_state[2]:
+            val = swap_32(val)
+        func_state[1] += 1
 
-    store_32(data, func_state[0], interesting_value)
-    modified_slice = (func_state[0], func_state[0]+1)
+        # skip values already produced by bitflip, arithmetic and previous interesting stages
+        if is_not_bitflip(orig ^ val) and is_not_arithmetic(orig, val, 4) and \
+           is_not_interesting(orig, val, 4, func_state[2]):
+            break
+        redundant_skipped += 1
 
-    func_state[1] += 1
+    store_32(data, func_state[0], val)
+    modified_slice = (func_state[0], func_state[0] + 3)
 
     return data, func_state, modified_slice
 
 
-#TODO: auto-create dictionary from binary
 #TODO: afl has this also https://github.com/mirrorer/afl/blob/2fb5a3482ec27b593c57258baae7089ebdc89043/afl-fuzz.c#L5123
 def dictionary_overwrite(data, func_state):
-    global tokens_list, tokens_list_length
-    if tokens_list_length <= 0:
+    tokens = dispatcher.tokens
+    if not tokens:
         return data, None, None
 
     if not func_state:
-        func_state = [0, 0] # first is an index in tokens_list, second is an index in data
+        func_state = [0, 0] # first is an index in tokens, second is an index in data
 
     data_len = len(data)
-    token = tokens_list[func_state[0]]
+    token = tokens[func_state[0]]
     place = func_state[1]
 
     if data_len < len(token):
@@ -325,10 +463,10 @@ def dictionary_overwrite(data, func_state):
         func_state[0] += 1 # take the next token
         func_state[1] = 0
 
-        if func_state[0] >= len(tokens_list):
+        if func_state[0] >= len(tokens):
             return data, None, None
 
-    data = data[:place] + bytearray(token) + data[place + len(token):]
+    data[place:place + len(token)] = token
     modified_slice = (place, place + len(token))
     func_state[1] += 1
 
@@ -336,26 +474,26 @@ def dictionary_overwrite(data, func_state):
 
 
 def dictionary_insert(data, func_state):
-    global tokens_list, tokens_list_length
-    if tokens_list_length <= 0:
+    tokens = dispatcher.tokens
+    if not tokens:
         return data, None, None
 
     if not func_state:
-        func_state = [0, 0] # first is an index in tokens_list, second is an index in data
+        func_state = [0, 0] # first is an index in tokens, second is an index in data
 
     data_len = len(data)
 
-    token = tokens_list[func_state[0]]
+    token = tokens[func_state[0]]
     place = func_state[1]
 
     if place >= data_len:
         func_state[0] += 1 # take the next token
         func_state[1] = 0
 
-        if func_state[0] >= len(tokens_list):
+        if func_state[0] >= len(tokens):
             return data, None, None
 
-    data = data[:place] + bytearray(token) + data[place:]
+    data[place:place] = token
     # Technically insertion modifies the position of everything following,
     # but I find that less clear
     modified_slice = (place, place + len(token))
@@ -371,38 +509,33 @@ def havoc_bitflip(data):
 
 
 def havoc_interesting_byte(data):
-    value_to_change = RAND(len(data))
-    interesting_value_index = RAND(len(interesting_8_Bit))
-
-    func_state = [value_to_change, interesting_value_index]
-    data, state, modified = mutate_1byte_interesting(data, func_state)
-    return data, modified
+    pos = RAND(len(data))
+    data[pos] = in_range_8(interesting_8_Bit[RAND(len(interesting_8_Bit))])
+    return data, (pos, pos)
 
 
 def havoc_interesting_2bytes(data):
     data_len = len(data)
     if data_len < 2:
         return data, None
-    value_to_change = RAND(data_len - 1) # substract 1 to make sure we have space for 2 bytes
-    interesting_value_index = RAND(len(interesting_16_Bit))
-    swap = RAND(2) # is swap?
-
-    func_state = [value_to_change, interesting_value_index, swap]
-    data, state, modified = mutate_2bytes_interesting(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 1) # substract 1 to make sure we have space for 2 bytes
+    interesting_value = in_range_16(interesting_16_Bit[RAND(len(interesting_16_Bit))])
+    if RAND(2): # is swap?
+        interesting_value = swap_16(interesting_value)
+    store_16(data, pos, interesting_value)
+    return data, (pos, pos + 1)
 
 
 def havoc_interesting_4bytes(data):
     data_len = len(data)
     if data_len < 4:
         return data, None
-    value_to_change = RAND(len(data) - 3) # substract 1 to make sure we have space for 2 bytes
-    interesting_value_index = RAND(len(interesting_32_Bit))
-    swap = RAND(2) # is swap?
-
-    func_state = [value_to_change, interesting_value_index, swap]
-    data, state, modified = mutate_4bytes_interesting(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 3) # substract 3 to make sure we have space for 4 bytes
+    interesting_value = in_range_32(interesting_32_Bit[RAND(len(interesting_32_Bit))])
+    if RAND(2): # is swap?
+        interesting_value = swap_32(interesting_value)
+    store_32(data, pos, interesting_value)
+    return data, (pos, pos + 3)
 
 
 def havoc_randomly_add(data): # similar to mutate_byte_arithmetic but a bit faster
@@ -419,40 +552,40 @@ def havoc_randomly_substract(data): # similar to mutate_byte_arithmetic but a bi
     return data, (modified_offset, modified_offset)
 
 
-def havoc_randomly_add_2bytes(data): # similar to mutate_byte_arithmetic but a bit faster
+def havoc_randomly_add_2bytes(data): # similar to mutate_2bytes_arithmetic but a bit faster
     data_len = len(data)
     if data_len < 2:
         return data, None
-    func_state = [RAND(data_len - 1), RAND(AFL_ARITH_MAX), True] # pos, value, is_sub
-    data, func_state, modified = mutate_2bytes_arithmetic(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 1)
+    store_16(data, pos, load_16(data, pos) + 1 + RAND(AFL_ARITH_MAX))
+    return data, (pos, pos + 1)
 
 
-def havoc_randomly_substract_2bytes(data): # similar to mutate_byte_arithmetic but a bit faster
+def havoc_randomly_substract_2bytes(data): # similar to mutate_2bytes_arithmetic but a bit faster
     data_len = len(data)
     if data_len < 2:
         return data, None
-    func_state = [RAND(data_len - 1), RAND(AFL_ARITH_MAX), False] # pos, value, is_sub
-    data, func_state, modified = mutate_2bytes_arithmetic(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 1)
+    store_16(data, pos, load_16(data, pos) - (1 + RAND(AFL_ARITH_MAX)))
+    return data, (pos, pos + 1)
 
 
-def havoc_randomly_add_4bytes(data): # similar to mutate_byte_arithmetic but a bit faster
+def havoc_randomly_add_4bytes(data): # similar to mutate_4bytes_arithmetic but a bit faster
     data_len = len(data)
     if data_len < 4:
         return data, None
-    func_state = [RAND(data_len - 3), RAND(AFL_ARITH_MAX), True] # pos, value, is_sub
-    data, func_state, modified = mutate_4bytes_arithmetic(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 3)
+    store_32(data, pos, load_32(data, pos) + 1 + RAND(AFL_ARITH_MAX))
+    return data, (pos, pos + 3)
 
 
-def havoc_randomly_substract_4bytes(data): # similar to mutate_byte_arithmetic but a bit faster
+def havoc_randomly_substract_4bytes(data): # similar to mutate_4bytes_arithmetic but a bit faster
     data_len = len(data)
     if data_len < 4:
         return data, None
-    func_state = [RAND(data_len - 3), RAND(AFL_ARITH_MAX), False] # pos, value, is_sub
-    data, func_state, modified = mutate_4bytes_arithmetic(data, func_state)
-    return data, modified
+    pos = RAND(data_len - 3)
+    store_32(data, pos, load_32(data, pos) - (1 + RAND(AFL_ARITH_MAX)))
+    return data, (pos, pos + 3)
 
 
 def havoc_set_randomly(data):
@@ -469,7 +602,7 @@ def havoc_remove_randomly_block(data):
 
     len_to_remove = AFL_choose_block_len(data_len - 1)
     pos = RAND(data_len - len_to_remove + 1)
-    data = data[:pos] + data[pos+len_to_remove:]
+    del data[pos:pos+len_to_remove]
     # Again, deletion affects bytes after, but that's confusing to show
     # Just mark the byte where the deletion happened
     modified_offset = pos
@@ -496,8 +629,7 @@ def prepare_block(data):
             block_start = RAND(data_len)
             block = data[block_start:block_start+clone_len]
         else:
-            block = [RAND(256)] * clone_len # TODO: check if it is actually correct implementation
-            block = bytearray(block)
+            block = bytearray((RAND(256),)) * clone_len # TODO: check if it is actually correct implementation
     return block, clone_to, clone_len
 
 
@@ -506,7 +638,7 @@ def havoc_clone_randomly_block(data):
     block, clone_to, clone_len = prepare_block(data)
     if clone_len == 0:
         return data, None
-    data = data[:clone_to] + block + data[clone_to:]
+    data[clone_to:clone_to] = block
     # insert/modify will look the same, but oh well
     modified_slice = (clone_to, clone_to + clone_len)
     return data, modified_slice
@@ -517,24 +649,83 @@ def havoc_overwrite_randomly_block(data):
     block, clone_to, clone_len = prepare_block(data)
     if clone_len == 0:
         return data, None
-    data = data[:clone_to] + block + data[clone_to+clone_len:]
+    data[clone_to:clone_to+clone_len] = block
     modified_slice = (clone_to, clone_to + clone_len)
     return data, modified_slice
 
 
 # overwrite from dict
 def havoc_overwrite_with_dict(data):
-    func_state = [RAND(len(tokens_list)), RAND(len(data))]
+    func_state = [RAND(len(dispatcher.tokens)), RAND(len(data))]
     data, func_state, modified = dictionary_overwrite(data, func_state)
     return data, modified
 
 
 # overwrite from dict
 def havoc_insert_with_dict(data):
-    func_state = [RAND(len(tokens_list)), RAND(len(data))]
+    func_state = [RAND(len(dispatcher.tokens)), RAND(len(data))]
     data, func_state, modified = dictionary_insert(data, func_state)
     return data, modified
 
+# havoc_remove_randomly_block used twice to increase chances
+HAVOC_FUNCS = (havoc_bitflip, havoc_interesting_byte, havoc_interesting_2bytes, havoc_interesting_4bytes,
+               havoc_randomly_add, havoc_randomly_substract, havoc_randomly_add_2bytes,
+               havoc_randomly_substract_2bytes, havoc_randomly_add_4bytes, havoc_randomly_substract_4bytes,
+               havoc_set_randomly, havoc_remove_randomly_block, havoc_remove_randomly_block,
+               havoc_clone_randomly_block, havoc_overwrite_randomly_block, havoc_overwrite_with_dict,
+               havoc_insert_with_dict)
+
+
+def draw_havoc_ops(count):
+    # pick stacked operations for count mutants in one go
+    funcs_count = len(HAVOC_FUNCS)
+    return [[HAVOC_FUNCS[RAND(funcs_count)] for i in range(1 << (1 + RAND(AFL_HAVOC_STACK_POW2)))]
+            for j in range(count)]
+
+
+def havoc_stack(data, ops):
+    definitive_slice = None
+    for op in ops:
+        data, modified_slice = op(data)
+        # FUTURE: handle a list of slices here
+        definitive_slice = merge_slices(definitive_slice, modified_slice)
+    # NOTE: definitive slice may still be None
+    return data, definitive_slice
+
+
+def havoc_round(data):
+    # one round of stacked operations, in C if libaflmutate is available
+    if native is not None:
+        return data, native.havoc(data, dispatcher.tokens)
+    return havoc_stack(data, draw_havoc_ops(1)[0])
+
+
+def havoc_batch(data, count, buffers=None):
+    '''
+    Produces count havoc mutants of data in one call, returns a list of (mutant, modified_slice). data itself is
+    not modified. Mutants returned by a previous call can be passed as buffers to reuse their memory.
+    '''
+    if len(data) == 0:
+        return [(bytearray(), None) for i in range(count)]
+
+    if buffers is None:
+        buffers = []
+    # the native library draws its own operations, the Python path draws all of them in one go
+    ops_list = [None] * count if native is not None else draw_havoc_ops(count)
+    mutants = []
+    for i, ops in enumerate(ops_list):
+        if i < len(buffers):
+            buf = buffers[i]
+            buf[:] = data
+        else:
+            buf = bytearray(data)
+        if ops is None:
+            mutants.append((buf, native.havoc(buf, dispatcher.tokens)))
+        else:
+            mutants.append(havoc_stack(buf, ops))
+    return mutants
+
+
 def merge_slices(cur_slice, new_slice):
     """Attempt to merge slices since we can only display one modification.
 
@@ -583,36 +774,19 @@ def havoc(data, func_state, max_havoc_cycles):
     if func_state >= max_havoc_cycles:
         return data, None, None
 
-    # havoc_randomly used twice to increase chances
-    func_to_choose = [havoc_bitflip, havoc_interesting_byte, havoc_interesting_2bytes, havoc_interesting_4bytes,
-                      havoc_randomly_add, havoc_randomly_substract, havoc_randomly_add_2bytes,
-                      havoc_randomly_substract_2bytes, havoc_randomly_add_4bytes, havoc_randomly_substract_4bytes,
-                      havoc_set_randomly, havoc_remove_randomly_block, havoc_remove_randomly_block, havoc_clone_randomly_block,
-                      havoc_overwrite_randomly_block, havoc_overwrite_with_dict, havoc_insert_with_dict]
-
-    use_stacking = 1 << 1 + RAND(AFL_HAVOC_STACK_POW2)
-    definitive_slice = None
-    for i in range (0, use_stacking):
-        method = RAND(len(func_to_choose))
-        # randomly select one of the available methods
-        #INFO(1, None, None, "Havoc mutator %s" % func_to_choose[method].__name__)
-        data, modified_slice = func_to_choose[method](data)
-        #INFO(1, None, None, "Modified slice: %s" % repr(modified_slice))
-        # FUTURE: handle a list of slices here
-        definitive_slice = merge_slices(definitive_slice, modified_slice)
-        #INFO(1, None, None, "Definitive slice: %s" % repr(definitive_slice))
+    data, definitive_slice = havoc_round(data)
     func_state += 1
 
     # NOTE: definitive slice may still be None
     return data, func_state, definitive_slice
 
 
-def splice(data, list_of_files, queue_path, func_state, max_havoc_cycles):
+def splice(data, corpus, func_state, max_havoc_cycles):
     data_len = len(data)
     if data_len <= 2:
         return data, None, None
 
-    if len(list_of_files) <= 1:
+    if len(corpus.eligible) <= 1:
         return data, None, None
 
     if not func_state:
@@ -621,33 +795,24 @@ def splice(data, list_of_files, queue_path, func_state, max_havoc_cycles):
     if func_state > SPLICE_CYCLES:
         return data, None, None
 
-    # pick up random file from queue and splice with it
-    file_id = RAND(len(list_of_files))
-    if isinstance(list_of_files[file_id], tuple):
-        file_name = list_of_files[file_id][1]
-        picked_file_name = queue_path + "/" + file_name
+    # pick up random files from the queue until one differs from data in at least two places
+    data_crc = zlib.crc32(data)
+    for attempt in range(len(corpus.eligible)):
+        file_id = corpus.sample()
+        if corpus.crcs[file_id] == data_crc:
+            continue
+        content_target = corpus.contents[file_id]
+        f_diff, l_diff = locate_diffs(data, content_target, MIN(data_len, len(content_target)))
+        if l_diff >= 2 and f_diff != l_diff: # afl has f_diff == 0 but I believe we want to start with 0
+            break
     else:
-        # TODO: currently we don't touch original files (which is not right I believe)
-        del list_of_files[file_id]
-        return splice(data, list_of_files, queue_path, None, max_havoc_cycles)
-
-    content_target = extract_content(picked_file_name)
-    content_target_len = len(content_target)
-
-    if content_target_len < 2 or is_bytearrays_equal(data, content_target):
-        del list_of_files[file_id]
-        return splice(data, list_of_files, queue_path, None, max_havoc_cycles)
-
-    f_diff, l_diff = locate_diffs(data, content_target, MIN(data_len, content_target_len))
-
-    if l_diff < 2 or f_diff == l_diff: # afl has f_diff == 0 but I believe we want to start with 0
-        del list_of_files[file_id]
-        return splice(data, list_of_files, queue_path, None, max_havoc_cycles)
+        return data, None, None
 
-    split_last_byte = f_diff + RAND(l_diff - f_diff)
-    block = data[f_diff:f_diff+split_last_byte]
-    content_target = content_target[:f_diff] + block + content_target[f_diff+split_last_byte:]
-    modified_slice = (f_diff, f_diff + len(block))
+    # head of data, tail of the other file
+    split_at = f_diff + RAND(l_diff - f_diff)
+    content_target = bytearray(content_target)
+    content_target[:split_at] = data[:split_at]
+    modified_slice = (f_diff, split_at)
     data = content_target
 
     # ignore the havoc modification in favor of splice
@@ -657,15 +822,15 @@ def splice(data, list_of_files, queue_path, func_state, max_havoc_cycles):
     return data, func_state, modified_slice
 
 # calculate AFL-like performance score
-def calculate_perf_score(exec_per_sec, avg_exec_per_sec, bitmap_size, avg_bitmap_size, handicap):
+def calculate_perf_score(exec_us, avg_exec_us, bitmap_size, avg_bitmap_size, handicap):
     perf_score = 100
-    if exec_per_sec * 0.1 > avg_exec_per_sec: perf_score = 10
-    elif exec_per_sec * 0.25 > avg_exec_per_sec: perf_score = 25
-    elif exec_per_sec * 0.5 > avg_exec_per_sec: perf_score = 50
-    elif exec_per_sec * 0.75 > avg_exec_per_sec: perf_score = 75
-    elif exec_per_sec * 4 < avg_exec_per_sec: perf_score = 300
-    elif exec_per_sec < avg_exec_per_sec: perf_score = 200
-    elif exec_per_sec * 2 < avg_exec_per_sec: perf_score = 150
+    if exec_us * 0.1 > avg_exec_us: perf_score = 10
+    elif exec_us * 0.25 > avg_exec_us: perf_score = 25
+    elif exec_us * 0.5 > avg_exec_us: perf_score = 50
+    elif exec_us * 0.75 > avg_exec_us: perf_score = 75
+    elif exec_us * 4 < avg_exec_us: perf_score = 300
+    elif exec_us * 3 < avg_exec_us: perf_score = 200
+    elif exec_us * 2 < avg_exec_us: perf_score = 150
 
     if bitmap_size * 0.3 > avg_bitmap_size: perf_score *= 3;
     elif bitmap_size * 0.5 > avg_bitmap_size: perf_score *= 2;
@@ -674,12 +839,11 @@ def calculate_perf_score(exec_per_sec, avg_exec_per_sec, bitmap_size, avg_bitmap
     elif bitmap_size * 2 < avg_bitmap_size: perf_score *= 0.5;
     elif bitmap_size * 1.5 < avg_bitmap_size: perf_score *= 0.75;
 
+    # entries found late get a bonus until they catch up (the caller decrements handicap)
     if handicap > 4:
         perf_score *= 4
-        # TODO: handicap -= 4
     elif handicap:
-        per_score *= 2
-        #TODO handicap -= 1
+        perf_score *= 2
 
     return perf_score
 
@@ -703,6 +867,8 @@ def get_havoc_cycles(exec_per_sec, perf_score, splice):
     else:
         stage_max = AFL_HAVOC_CYCLES * perf_score / havoc_div / 100
 
+    if stage_max < AFL_HAVOC_MIN:
+        stage_max = AFL_HAVOC_MIN
 
     # if not splice:
         # TODO: if (queued_paths != havoc_queued)
@@ -714,61 +880,79 @@ def get_havoc_cycles(exec_per_sec, perf_score, splice):
     return stage_max, perf_score
 
 
+# Stage table shared by all queue entries. The order of this functions is super important. Splice must be the last
+# and havoc must be before splice.
+STAGES = (bitflip_1bit, bitflip_2bits, bitflip_4bits,
+          byteflip_1, byteflip_2, byteflip_4,
+          mutate_byte_arithmetic, mutate_2bytes_arithmetic, mutate_4bytes_arithmetic,
+          mutate_1byte_interesting, mutate_2bytes_interesting, mutate_4bytes_interesting,
+          dictionary_overwrite, dictionary_insert, havoc, splice)
+STAGE_NAMES = ('bitflip_1bit', 'bitflip_2bits', 'biflip_4bits',
+               'byteflip_1', 'byteflip_2', 'byteflip_4',
+               'arithmetic_1byte', 'arithmetic_2bytes', 'arithemtic_4bytes',
+               'interesting_1byte', 'interesting_2bytes', 'interesting_4bytes',
+               'dictionary_overwrite', 'dictionary_insert', 'havoc', 'splice')
+STAGES_COUNT = len(STAGES)
+HAVOC_STAGE = STAGES.index(havoc)
+BYTEFLIP_1_STAGE = STAGES.index(byteflip_1)
+
+
 class AFLFuzzer(object):
-    def __init__(self, user_tokens_dict, queue_path, file_name, gui_state):
-        global tokens_list, tokens_list_length
-        self.possible_stages = OrderedDict()
-
-        # The order of this functions is super important. Splice must be the last and
-        # havoc must be before splice.
-        self.list_of_functions = [bitflip_1bit, bitflip_2bits, bitflip_4bits,
-                                  byteflip_1, byteflip_2, byteflip_4,
-                                  mutate_byte_arithmetic, mutate_2bytes_arithmetic, mutate_4bytes_arithmetic,
-                                  mutate_1byte_interesting, mutate_2bytes_interesting, mutate_4bytes_interesting,
-                                  dictionary_overwrite, dictionary_insert, havoc, splice]
-        self.mutator_names = {
-            bitflip_1bit: 'bitflip_1bit',
-            bitflip_2bits: 'bitflip_2bits',
-            bitflip_4bits: 'biflip_4bits',
-            byteflip_1: 'byteflip_1',
-            byteflip_2: 'byteflip_2',
-            byteflip_4: 'byteflip_4',
-            mutate_byte_arithmetic: 'arithmetic_1byte',
-            mutate_2bytes_arithmetic: 'arithmetic_2bytes',
-            mutate_4bytes_arithmetic: 'arithemtic_4bytes',
-            mutate_1byte_interesting: 'interesting_1byte',
-            mutate_2bytes_interesting: 'interesting_2bytes',
-            mutate_4bytes_interesting: 'interesting_4bytes',
-            dictionary_overwrite: 'dictionary_overwrite',
-            dictionary_insert: 'dictionary_insert',
-            havoc: 'havoc',
-            splice: 'splice'
-        }
-        self.current_function = self.list_of_functions[0]
+    '''
+    Per queue entry state of the AFL mutator: the current stage and the cursor inside of it. Everything else lives
+    in the shared stage table and dispatcher.
+    '''
+    __slots__ = ('file_name', 'stage_id', 'cursor', 'eff_map', 'pending_flip', 'new_havoc_cycle', 'perf_score',
+                 'orig_perf_score', 'havoc_max_stages', 'pending_mutants')
+
+    def __init__(self, file_name):
         self.file_name = file_name
-        self.current_result = None
-        self.current_function_id = 0
-        self.total_func_count = len(self.list_of_functions)
-        self.queue_path = queue_path
-        tokens_list = user_tokens_dict
-        tokens_list_length = len(tokens_list)
+        self.stage_id = 0
+        self.cursor = None
+        self.eff_map = None  # blocks of the input which changed the path during byteflip_1, None means all of them
+        # (offset, original byte, is last byte) of the last byteflip_1 mutation, waiting for its execution result
+        self.pending_flip = None
         self.new_havoc_cycle = True
         self.perf_score = 100
         self.orig_perf_score = 100
-        self.gui_state = gui_state
+        self.havoc_max_stages = 0
+        self.pending_mutants = None  # havoc mutants of the current batch waiting for the next turns of this entry
 
 
-    def save_state(self, output_path):
-        # we need to save current_function_id and current_result
-        fd = open(output_path + "/afl_state_%s" % self.file_name, 'w')
-        if not fd:
-            WARNING(None, "Failed to save state of the AFLFuzzer for %s" % self.file_name)
-        fd.write("%d %s" % (self.current_function_id, str(self.current_result)))
-        fd.close()
+    def passed_det(self):
+        # True if all deterministic stages are done for this file
+        return self.stage_id >= HAVOC_STAGE
+
+
+    def skip_deterministic(self):
+        if not self.passed_det():
+            self.stage_id = HAVOC_STAGE
+            self.cursor = None
+
+
+    def get_function_id(self):
+        # deterministic stages produce the same inputs every time, so after the first round only havoc and splice
+        # are repeated
+        if self.stage_id < STAGES_COUNT:
+            return self.stage_id
+        return HAVOC_STAGE + (self.stage_id - HAVOC_STAGE) % (STAGES_COUNT - HAVOC_STAGE)
+
+
+    def update_eff_map(self, cksum, orig_cksum):
+        # called with the trace checksum of the last execution (None if it crashed)
+        if self.pending_flip is None:
+            return
+        pos, byte, last = self.pending_flip
+        self.pending_flip = None
+        if self.eff_map is not None and cksum != orig_cksum:
+            self.eff_map[pos >> AFL_EFF_MAP_SCALE2] = 1
+        if dispatcher.auto_dict is not None:
+            dispatcher.auto_dict.feed(byte, cksum, orig_cksum, last)
 
 
     def restore_state(self, output_path):
-        # we need to load current_function_id and current_result
+        # stage_id and cursor of a session saved before checkpoints, they were kept in afl_state_* files. New sessions
+        # keep them in the checkpoint, this is only used to resume the old ones
         INFO(1, None, None, "Loading AFL state from %s"  % (output_path + "/afl_state_" + self.file_name))
         try:
             fd = open(output_path + "/afl_state_%s" % self.file_name, 'r')
@@ -780,7 +964,7 @@ class AFLFuzzer(object):
             return
         content = fd.read()
         function_id = content[:content.find(" ")]
-        self.current_function_id = int(function_id)
+        self.stage_id = int(function_id)
         state = content[content.find(" ")+1:]
         if "[" in state:
             state = ast.literal_eval(state)
@@ -788,58 +972,100 @@ class AFLFuzzer(object):
             state = None
         else:
             state = int(state)
-        self.current_result = state
-        self.current_function = self.list_of_functions[self.current_function_id % len(self.list_of_functions)]
+        self.cursor = state
         fd.close()
-        INFO(1, None, None, "%s %s %s" % (self.file_name, self.current_result, self.current_function))
+        INFO(1, None, None, "%s %s %s" % (self.file_name, self.cursor, STAGE_NAMES[self.get_function_id()]))
 
 
-    def mutate(self, data, list_of_files, exec_per_sec, avg_exec_per_sec, bitmap_size,
-               avg_bitmap_size, handicap):
+    def next_havoc_mutant(self, data, queue_len):
+        # havoc stage drawing its mutants with havoc_batch, one mutant per turn
+        cursor = self.cursor or 0
+        if cursor >= self.havoc_max_stages:
+            self.pending_mutants = None
+            return data, None, None
+        if not self.pending_mutants:
+            count = MIN(pending_batch_size(HAVOC_BATCH, queue_len), int(self.havoc_max_stages) - cursor)
+            self.pending_mutants = havoc_batch(data, max(1, count))
+        data, modified_slice = self.pending_mutants.pop()
+        return data, cursor + 1, modified_slice
+
+
+    def start_eff_map(self, data_len):
+        self.pending_flip = None
+        if data_len < AFL_EFF_MIN_LEN:
+            self.eff_map = None
+            return
+        self.eff_map = bytearray(((data_len - 1) >> AFL_EFF_MAP_SCALE2) + 1)
+        # the first and the last blocks are always fuzzed
+        self.eff_map[0] = 1
+        self.eff_map[-1] = 1
+
+
+    def finish_eff_map(self):
+        # if almost every block has an effect the map is not worth checking
+        if self.eff_map is not None and \
+           self.eff_map.count(1) * 100 >= len(self.eff_map) * AFL_EFF_MAX_PERC:
+            self.eff_map = None
+
+
+    def mutate(self, data, list_of_files, exec_per_sec, get_perf_score):
+        global eff_map
         if len(data) <= 0:
             return data
 
-        if not self.current_result:
-            self.current_function = self.list_of_functions[self.current_function_id % len(self.list_of_functions)]
+        function_id = self.get_function_id()
+        function = STAGES[function_id]
 
-        current_function_name = self.mutator_names[self.current_function]
-        #INFO(1, None, None, "Running %s stage of AFL mutator" % current_function_name)
-        self.gui_state.set_mutator(current_function_name)
+        # later deterministic stages don't touch bytes which had no effect during byteflip_1
+        if BYTEFLIP_1_STAGE < function_id < HAVOC_STAGE:
+            eff_map = self.eff_map
+        else:
+            eff_map = None
+
+        gui_state = dispatcher.gui_state
+        #INFO(1, None, None, "Running %s stage of AFL mutator" % STAGE_NAMES[function_id])
+        gui_state.set_mutator(STAGE_NAMES[function_id])
 
-        if self.current_function == splice:
+        if function == splice:
 
             if self.new_havoc_cycle:
                 self.havoc_max_stages, self.perf_score = get_havoc_cycles(exec_per_sec, self.perf_score, True)
                 self.new_havoc_cycle = False
 
-            # FYI: we are sending copy of list_of_files instead of actual list_of_files in slice
-            data, self.current_result, modified_slice = self.current_function(data, list(list_of_files),
-                                                              self.queue_path,
-                                                              self.current_result,
-                                                              self.havoc_max_stages)
-            if not self.current_result:
+            corpus_index.update(list_of_files)
+            data, self.cursor, modified_slice = function(data, corpus_index, self.cursor, self.havoc_max_stages)
+            if not self.cursor:
                 self.new_havoc_cycle = True
                 self.perf_score = self.orig_perf_score
 
-        elif self.current_function == havoc:
+        elif function == havoc:
             if self.new_havoc_cycle:
-                self.perf_score = calculate_perf_score(exec_per_sec, avg_exec_per_sec, bitmap_size,
-                                                   avg_bitmap_size, handicap)
+                self.perf_score = get_perf_score()
                 self.orig_perf_score = self.perf_score
                 self.havoc_max_stages, self.perf_score = get_havoc_cycles(exec_per_sec, self.perf_score, False)
                 self.new_havoc_cycle = False
-            data, self.current_result, modified_slice = self.current_function(data, self.current_result,
-                                                              self.havoc_max_stages)
-            if not self.current_result:
+            data, self.cursor, modified_slice = self.next_havoc_mutant(data, len(list_of_files))
+            if not self.cursor:
                 self.new_havoc_cycle = True
                 self.perf_score = self.orig_perf_score
+        elif function == byteflip_1:
+            if not self.cursor:
+                self.start_eff_map(len(data))
+                if dispatcher.auto_dict is not None:
+                    dispatcher.auto_dict.start()
+            data, self.cursor, modified_slice = function(data, self.cursor)
+            if self.cursor:
+                pos = modified_slice[0]
+                self.pending_flip = (pos, data[pos] ^ 0xFF, pos == len(data) - 1)
+            else:
+                self.finish_eff_map()
         else:
-            data, self.current_result, modified_slice = self.current_function(data, self.current_result)
+            data, self.cursor, modified_slice = function(data, self.cursor)
 
-        self.gui_state.set_modified_slice(modified_slice)
-        self.gui_state.set_hexdump(data)
+        gui_state.set_modified_slice(modified_slice)
+        gui_state.set_hexdump(data)
 
-        if not self.current_result:
-            self.current_function_id += 1
+        if not self.cursor:
+            self.stage_id += 1
 
-        return data
\ No newline at end of file
+        return data
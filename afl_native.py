@@ -0,0 +1,114 @@
+#   Manul - native AFL mutation primitives
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from ctypes import *
+import os
+import helper
+
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libaflmutate", "libaflmutate.so")
+
+# havoc can grow the input by this many bytes per round, operations which don't fit are skipped (like AFL does)
+HAVOC_GROWTH = helper.AFL_HAVOC_BLK_XL
+HAVOC_PADDING = bytes(bytearray(HAVOC_GROWTH))
+
+
+class NativeMutator(object):
+    '''
+    ctypes wrapper around libaflmutate (build it with make -C libaflmutate). Data is always mutated in place,
+    havoc resizes the bytearray it was given.
+    '''
+    def __init__(self):
+        self.lib = None
+        self.state = (c_long * 3)()
+        self.skipped = c_ulong(0)
+        self.slice = (c_long * 2)()
+        self.scratch = create_string_buffer(HAVOC_GROWTH)
+        self.tokens = None  # tokens list currently loaded into the library
+        self.tokens_buffers = None
+
+    def load_library(self, library_path):
+        self.lib = cdll.LoadLibrary(library_path)
+        stage_args = [c_void_p, c_long, c_void_p, c_int, POINTER(c_long), POINTER(c_ulong)]
+        self.lib.afl_arith.argtypes = stage_args
+        self.lib.afl_interesting.argtypes = stage_args
+        self.lib.afl_havoc.argtypes = [c_void_p, c_long, c_long, c_void_p, c_uint64, POINTER(c_long)]
+        self.lib.afl_havoc.restype = c_long
+        self.lib.afl_set_tokens.argtypes = [c_void_p, POINTER(c_long), c_long]
+
+    def set_tokens(self, tokens_list):
+        if tokens_list is self.tokens:
+            return
+        tokens_list = tokens_list or []
+        offsets = [0]
+        for token in tokens_list:
+            offsets.append(offsets[-1] + len(token))
+        # keep the buffers referenced, the library doesn't copy them
+        self.tokens_buffers = (create_string_buffer(b"".join(bytes(token) for token in tokens_list)),
+                               (c_long * len(offsets))(*offsets))
+        self.lib.afl_set_tokens(self.tokens_buffers[0], self.tokens_buffers[1], len(tokens_list))
+        self.tokens = tokens_list
+
+    def run_stage(self, stage, data, func_state, width, eff_map, state_len):
+        '''
+        One candidate of a deterministic stage, returns (func_state, modified_slice, skipped) where func_state is
+        None when the stage is over.
+        '''
+        state = self.state
+        state[0], state[1], state[2] = 0, 0, 0
+        if func_state:
+            for i in range(state_len):
+                state[i] = func_state[i]
+        self.skipped.value = 0
+
+        data_buf = (c_ubyte * len(data)).from_buffer(data)
+        eff_buf = (c_ubyte * len(eff_map)).from_buffer(eff_map) if eff_map is not None else None
+        res = stage(data_buf, len(data), eff_buf, width, state, byref(self.skipped))
+        del data_buf, eff_buf
+
+        if not res:
+            return None, None, self.skipped.value
+        func_state = [state[0], state[1], bool(state[2])][:state_len]
+        return func_state, (state[0], state[0] + width - 1), self.skipped.value
+
+    def arith(self, data, func_state, width, eff_map):
+        return self.run_stage(self.lib.afl_arith, data, func_state, width, eff_map, 3)
+
+    def interesting(self, data, func_state, width, eff_map):
+        # the 1 byte stage has no swapped pass and keeps only [index, value index]
+        return self.run_stage(self.lib.afl_interesting, data, func_state, width, eff_map, 2 if width == 1 else 3)
+
+    def havoc(self, data, tokens_list):
+        # one stacked havoc round over data, returns the modified slice
+        self.set_tokens(tokens_list)
+        data_len = len(data)
+        data.extend(HAVOC_PADDING)
+        data_buf = (c_ubyte * len(data)).from_buffer(data)
+        new_len = self.lib.afl_havoc(data_buf, data_len, len(data), self.scratch, helper.RAND(1 << 64), self.slice)
+        del data_buf
+        del data[new_len:]
+        if self.slice[0] < 0:
+            return None
+        return self.slice[0], self.slice[1]
+
+
+def load_native_mutator(library_path=LIBRARY_PATH):
+    # returns None if the library is not built, the Python implementation is used then
+    if not os.path.exists(library_path):
+        return None
+    native = NativeMutator()
+    try:
+        native.load_library(library_path)
+    except (OSError, AttributeError):
+        return None
+    return native
@@ -0,0 +1,41 @@
+#   Manul - example batch mutator
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import random
+
+rng = random.Random()
+
+
+def init(seed):
+    rng.seed(seed)
+    print("[PLUGIN] Init successfully completed")
+
+
+def mutate_batch(seed, n):
+    outputs = []
+    for i in range(n):
+        data = bytearray(seed)
+        if data:
+            data[rng.randint(0, len(data) - 1)] ^= 1 << rng.randint(0, 7)
+        outputs.append(data)
+    return outputs
+
+
+def queue_new_entry(entry):
+    print("[PLUGIN] New queue entry %s" % entry.file_name)
+
+
+def trim(data):
+    # the fuzzer keeps the trimmed input only if it has the same coverage
+    return data[:len(data) // 2]
@@ -17,7 +17,12 @@
 
 
 import random
+import struct
 import os
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 AFL_MAX_FILE = 1 << 15
 
@@ -33,14 +38,122 @@ AFL_HAVOC_STACK_POW2 = 7
 SPLICE_CYCLES = 15
 AFL_HAVOC_CYCLES = 256
 AFL_HAVOC_MAX_MULT = 16
+AFL_HAVOC_MIN = 16
+
+# effector map: one entry per 1 << AFL_EFF_MAP_SCALE2 bytes, not used for short inputs or when almost
+# every byte has an effect
+AFL_EFF_MAP_SCALE2 = 3
+AFL_EFF_MIN_LEN = 128
+AFL_EFF_MAX_PERC = 90
 AFL_SPLICE_HAVOC = 32
+HAVOC_BATCH = 16  # havoc mutants generated at once for one queue entry
 
 #TODO: check in AFL
 interesting_8_Bit = [128, 255, 0, 1, 16, 32, 64, 100, 127]
 interesting_16_Bit = [65535, 32897, 128, 255, 256, 512, 1000, 1024, 4096, 32767]
 interesting_32_Bit = [4294967295, 2248146693, 2147516417, 32768, 65535, 65536, 100663045, 2147483647]
 
+RAND_POOL_SIZE = 4096  # number of 32-bit words generated per refill
+
+
+class FastRandom(object):
+    '''
+    Random numbers for the mutation engine. Words are generated RAND_POOL_SIZE at a time with a single getrandbits
+    call (or by NumPy's PCG64 if use_numpy is set) and bounded draws use Lemire's multiply-shift method, which is
+    several times faster than random.randint.
+    '''
+    def __init__(self, seed=None, use_numpy=False):
+        self.use_numpy = use_numpy and numpy is not None
+        self.rng = None
+        self.pool = []
+        self.pos = 0
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        if seed is None:
+            seed = os.urandom(4)
+        if self.use_numpy:
+            if not isinstance(seed, int):
+                seed = random.Random(seed).getrandbits(64)
+            self.rng = numpy.random.Generator(numpy.random.PCG64(seed))
+        else:
+            self.rng = random.Random(seed)
+        self.refill()
+
+    def refill(self):
+        if self.use_numpy:
+            self.pool = self.rng.integers(0, 1 << 32, size=RAND_POOL_SIZE, dtype=numpy.uint32).tolist()
+        else:
+            bits = self.rng.getrandbits(32 * RAND_POOL_SIZE)
+            if hasattr(bits, "to_bytes"):
+                self.pool = struct.unpack("<%dI" % RAND_POOL_SIZE, bits.to_bytes(4 * RAND_POOL_SIZE, "little"))
+            else:
+                getrandbits = self.rng.getrandbits
+                self.pool = [getrandbits(32) for i in range(RAND_POOL_SIZE)]
+        self.pos = 0
+
+    def next_word(self):
+        if self.pos == RAND_POOL_SIZE:
+            self.refill()
+        word = self.pool[self.pos]
+        self.pos += 1
+        return word
+
+    def rand(self, value):
+        # uniform integer in [0, value), 0 for value == 0
+        if value > 0xFFFFFFFF:
+            return self.rand_big(value)
+        pos = self.pos
+        if pos == RAND_POOL_SIZE:
+            self.refill()
+            pos = 0
+        self.pos = pos + 1
+        product = self.pool[pos] * value
+        if (product & 0xFFFFFFFF) < value:
+            # rare case, reject the words which would make some results more likely than others
+            threshold = (0x100000000 - value) % value
+            while (product & 0xFFFFFFFF) < threshold:
+                product = self.next_word() * value
+        return product >> 32
+
+    def rand_big(self, value):
+        result = 0
+        for i in range((value.bit_length() + 31) >> 5):
+            result = result << 32 | self.next_word()
+        return result % value
+
+    def random(self):
+        return self.next_word() / 4294967296.0
+
+    def getstate(self):
+        if self.use_numpy:
+            rng_state = self.rng.bit_generator.state
+        else:
+            rng_state = self.rng.getstate()
+        return rng_state, list(self.pool), self.pos
+
+    def setstate(self, state):
+        rng_state, pool, pos = state
+        if self.use_numpy:
+            self.rng.bit_generator.state = rng_state
+        else:
+            self.rng.setstate(rng_state)
+        self.pool = list(pool)
+        self.pos = pos
+
+
 random.seed(os.urandom(4))
+rng = FastRandom()
+
+
+def seed_rng(seed, use_numpy=False):
+    '''
+    Reseed the mutation engine, the same seed gives the same sequence of mutations. rng is reseeded in place so
+    modules which imported RAND keep using it.
+    '''
+    rng.use_numpy = use_numpy and numpy is not None
+    rng.seed(seed)
+    random.seed(seed)
 
 
 def AFL_choose_block_len(limit):
@@ -83,22 +196,20 @@ def MIN(value_a, value_b):
 
 def reseed():
     random.seed(os.urandom(4))
+    rng.seed()
 
-def RAND(value):
-    if value == 0:
-        return value
-    return random.randint(0, value-1)
+RAND = rng.rand
 
 def load_8(value, pos):
     return value[pos]
 
 
 def load_16(value, pos):
-    return (value[pos] << 8) + (value[pos+1] % 0xff)
+    return (value[pos] << 8) + value[pos+1]
 
 
 def load_32(value, pos):
-    return (value[pos] << 24) + (value[pos+1] << 16) + (value[pos+2] << 8) + (value[pos+3] % 0xff)
+    return (value[pos] << 24) + (value[pos+1] << 16) + (value[pos+2] << 8) + value[pos+3]
 
 
 def store_8(data, pos, value):
@@ -172,7 +283,7 @@ def to_string_32(value):
 
 
 def is_not_bitflip(value):
-    return True
+    # value is old ^ new, returns False if our bitflip or byteflip stages could produce new from old
     if value == 0:
         return False
 
@@ -181,7 +292,8 @@ def is_not_bitflip(value):
         sh += 1
         value >>= 1
 
-    if value == 1 or value == 3 or value == 15:
+    # walking 1, 2 and 4 bits never cross byte boundaries in our bitflip stages
+    if value == 1 or (value == 3 and (sh & 7) <= 6) or (value == 15 and (sh & 7) <= 4):
         return False
 
     if (sh & 7) != 0:
@@ -194,6 +306,8 @@ def is_not_bitflip(value):
 
 
 def is_not_arithmetic(value, new_value, num_bytes, set_arith_max=None):
+    # returns False if our arithmetic stages could produce new_value from value (both are big-endian as our
+    # arithmetic stages don't work on little-endian values)
     if value == new_value:
         return False
 
@@ -204,8 +318,8 @@ def is_not_arithmetic(value, new_value, num_bytes, set_arith_max=None):
     ov = 0
     nv = 0
     for i in range(num_bytes):
-        a = value >> (8 * i)
-        b = new_value >> (8 * i)
+        a = (value >> (8 * i)) & 0xff
+        b = (new_value >> (8 * i)) & 0xff
         if a != b:
             diffs += 1
             ov = a
@@ -219,9 +333,9 @@ def is_not_arithmetic(value, new_value, num_bytes, set_arith_max=None):
         return True
 
     diffs = 0
-    for i in range(num_bytes / 2):
-        a = value >> (16 * i)
-        b = new_value >> (16 * i)
+    for i in range(num_bytes // 2):
+        a = (value >> (16 * i)) & 0xffff
+        b = (new_value >> (16 * i)) & 0xffff
 
         if a != b:
             diffs += 1
@@ -232,22 +346,10 @@ def is_not_arithmetic(value, new_value, num_bytes, set_arith_max=None):
         if in_range_16(ov - nv) <= set_arith_max or in_range_16(nv - ov) <= set_arith_max:
             return False
 
-        ov = swap_16(ov)
-        nv = swap_16(nv)
-
-        if in_range_16(ov - nv) <= set_arith_max or in_range_16(nv - ov) <= set_arith_max:
-            return False
-
     if num_bytes == 4:
         if in_range_32(value - new_value) <= set_arith_max or in_range_32(new_value - value) <= set_arith_max:
             return False
 
-        value = swap_32(value)
-        new_value = swap_32(new_value)
-
-        if in_range_32(value - new_value) <= set_arith_max or in_range_32(new_value - value) <= set_arith_max:
-            return False
-
     return True
 
 
@@ -267,14 +369,13 @@ def is_not_interesting(value, new_value, num_bytes, le):
     for i in range(num_bytes - 1):
         for j in range(len(interesting_16_Bit)):
             tval = (value & ~(0xffff << (i * 8)) | (interesting_16_Bit[j] << (i * 8)))
-            #print(" -> " + str(value) + " - " + str(new_value) + " - " + str(tval))
             if new_value == tval:
                 return False
 
-            #if num_bytes > 2:
-            tval = (value & ~(0xffff << (i * 8))) | (swap_16(interesting_16_Bit[j]) << (i * 8));
-            if new_value == tval:
-                return False
+            if num_bytes > 2:
+                tval = (value & ~(0xffff << (i * 8))) | (swap_16(interesting_16_Bit[j]) << (i * 8))
+                if new_value == tval:
+                    return False
 
     if num_bytes == 4 and le:
         for j in range(len(interesting_32_Bit)):
@@ -0,0 +1,546 @@
+/*
+ * Manul - native AFL mutation primitives
+ * -------------------------------------
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at:
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ * C versions of the arithmetic and interesting values stages and of havoc
+ * stacking from afl_fuzz.py, loaded with ctypes by afl_native.py. Every
+ * function mirrors its Python counterpart, only the random numbers used by
+ * havoc come from a generator seeded by the caller.
+ */
+
+#include <stdint.h>
+#include <string.h>
+
+#define AFL_ARITH_MAX 35
+#define AFL_HAVOC_STACK_POW2 7
+#define AFL_EFF_MAP_SCALE2 3
+
+#define AFL_HAVOC_BLK_SMALL 32
+#define AFL_HAVOC_BLK_MEDIUM 128
+#define AFL_HAVOC_BLK_LARGE 1500
+#define AFL_HAVOC_BLK_XL 32768
+
+#define HAVOC_OPS 17
+
+static const uint32_t interesting_8[] = {128, 255, 0, 1, 16, 32, 64, 100, 127};
+static const uint32_t interesting_16[] = {65535, 32897, 128, 255, 256, 512, 1000, 1024, 4096, 32767};
+static const uint32_t interesting_32[] = {4294967295u, 2248146693u, 2147516417u, 32768, 65535, 65536, 100663045,
+                                          2147483647};
+
+#define COUNT(array) ((long)(sizeof(array) / sizeof(array[0])))
+
+/* dictionary tokens, set by afl_set_tokens; offsets has count + 1 entries */
+static const uint8_t *tokens_buf = NULL;
+static const long *tokens_offsets = NULL;
+static long tokens_count = 0;
+
+void afl_set_tokens(const uint8_t *buf, const long *offsets, long count) {
+  tokens_buf = buf;
+  tokens_offsets = offsets;
+  tokens_count = count;
+}
+
+/* big-endian loads and stores, like load_16/store_16 in helper.py */
+static uint32_t load(const uint8_t *data, long pos, int width) {
+  uint32_t value = 0;
+  int i;
+  for (i = 0; i < width; i++)
+    value = (value << 8) | data[pos + i];
+  return value;
+}
+
+static void store(uint8_t *data, long pos, int width, uint32_t value) {
+  int i;
+  for (i = width - 1; i >= 0; i--) {
+    data[pos + i] = value & 0xff;
+    value >>= 8;
+  }
+}
+
+static uint32_t width_mask(int width) {
+  return width == 4 ? 0xffffffffu : (1u << (8 * width)) - 1;
+}
+
+static uint32_t swap_16(uint32_t value) {
+  return ((value & 0xff00) >> 8) | ((value & 0xff) << 8);
+}
+
+static uint32_t swap_32(uint32_t value) {
+  return ((value & 0xff) << 24) | ((value & 0xff00) << 8) | ((value & 0xff0000) >> 8) | (value >> 24);
+}
+
+static long next_effective_pos(const uint8_t *eff_map, long pos, long width, long data_len) {
+  long last = data_len - width;
+  if (!eff_map)
+    return pos;
+  while (pos <= last) {
+    if (eff_map[pos >> AFL_EFF_MAP_SCALE2] || eff_map[(pos + width - 1) >> AFL_EFF_MAP_SCALE2])
+      return pos;
+    pos++;
+  }
+  return data_len;
+}
+
+static int is_not_bitflip(uint32_t value) {
+  int sh = 0;
+  if (!value)
+    return 0;
+
+  while (!(value & 1)) {
+    sh++;
+    value >>= 1;
+  }
+
+  if (value == 1 || (value == 3 && (sh & 7) <= 6) || (value == 15 && (sh & 7) <= 4))
+    return 0;
+
+  if (sh & 7)
+    return 1;
+
+  if (value == 0xff || value == 0xffff || value == 0xffffffffu)
+    return 0;
+
+  return 1;
+}
+
+static int is_not_arithmetic(uint32_t value, uint32_t new_value, int num_bytes) {
+  uint32_t ov = 0, nv = 0;
+  int diffs = 0, i;
+
+  if (value == new_value)
+    return 0;
+
+  for (i = 0; i < num_bytes; i++) {
+    uint32_t a = (value >> (8 * i)) & 0xff, b = (new_value >> (8 * i)) & 0xff;
+    if (a != b) {
+      diffs++;
+      ov = a;
+      nv = b;
+    }
+  }
+
+  if (diffs == 1 && (((ov - nv) & 0xff) <= AFL_ARITH_MAX || ((nv - ov) & 0xff) <= AFL_ARITH_MAX))
+    return 0;
+
+  if (num_bytes == 1)
+    return 1;
+
+  diffs = 0;
+  for (i = 0; i < num_bytes / 2; i++) {
+    uint32_t a = (value >> (16 * i)) & 0xffff, b = (new_value >> (16 * i)) & 0xffff;
+    if (a != b) {
+      diffs++;
+      ov = a;
+      nv = b;
+    }
+  }
+
+  if (diffs == 1 && (((ov - nv) & 0xffff) <= AFL_ARITH_MAX || ((nv - ov) & 0xffff) <= AFL_ARITH_MAX))
+    return 0;
+
+  if (num_bytes == 4 && (value - new_value <= AFL_ARITH_MAX || new_value - value <= AFL_ARITH_MAX))
+    return 0;
+
+  return 1;
+}
+
+static int is_not_interesting(uint32_t value, uint32_t new_value, int num_bytes, int le) {
+  long i, j;
+
+  if (value == new_value)
+    return 0;
+
+  for (i = 0; i < num_bytes; i++)
+    for (j = 0; j < COUNT(interesting_8); j++)
+      if (new_value == ((value & ~(0xffu << (i * 8))) | (interesting_8[j] << (i * 8))))
+        return 0;
+
+  if (num_bytes == 2 && !le)
+    return 1;
+
+  for (i = 0; i < num_bytes - 1; i++)
+    for (j = 0; j < COUNT(interesting_16); j++) {
+      if (new_value == ((value & ~(0xffffu << (i * 8))) | (interesting_16[j] << (i * 8))))
+        return 0;
+      if (num_bytes > 2 && new_value == ((value & ~(0xffffu << (i * 8))) | (swap_16(interesting_16[j]) << (i * 8))))
+        return 0;
+    }
+
+  if (num_bytes == 4 && le)
+    for (j = 0; j < COUNT(interesting_32); j++)
+      if (new_value == interesting_32[j])
+        return 0;
+
+  return 1;
+}
+
+/*
+ * One candidate of mutate_byte_arithmetic, mutate_2bytes_arithmetic or
+ * mutate_4bytes_arithmetic (depending on width). state is [index, offset,
+ * do_sub]. Returns 1 if data was mutated, 0 when the stage is over.
+ */
+int afl_arith(uint8_t *data, long data_len, const uint8_t *eff_map, int width, long *state,
+              unsigned long *skipped) {
+  uint32_t mask = width_mask(width), low_mask = width_mask(width / 2), orig, val;
+  int overflow;
+
+  if (data_len < width)
+    return 0;
+
+  for (;;) {
+    if (state[1] > AFL_ARITH_MAX) {
+      state[0]++;
+      state[1] = 0;
+    }
+
+    if (state[1] == 0)
+      state[0] = next_effective_pos(eff_map, state[0], width, data_len);
+
+    if (state[0] + width - 1 >= data_len) {
+      if (state[2])
+        return 0;
+      state[0] = next_effective_pos(eff_map, 0, width, data_len);
+      state[1] = 0;
+      state[2] = 1;
+      if (state[0] + width - 1 >= data_len)
+        return 0;
+    }
+
+    orig = load(data, state[0], width);
+    /* if the lower half doesn't overflow, the narrower stage already produced this one */
+    if (!state[2]) {
+      val = (orig + state[1]) & mask;
+      overflow = width == 1 || (orig & low_mask) + state[1] > low_mask;
+    } else {
+      val = (orig - state[1]) & mask;
+      overflow = width == 1 || (long)(orig & low_mask) < state[1];
+    }
+    state[1]++;
+
+    if (overflow && is_not_bitflip(orig ^ val))
+      break;
+    (*skipped)++;
+  }
+
+  store(data, state[0], width, val);
+  return 1;
+}
+
+/*
+ * One candidate of mutate_1byte_interesting, mutate_2bytes_interesting or
+ * mutate_4bytes_interesting. state is [index, value index, swap], the
+ * 1 byte stage ignores swap and doesn't have the second pass.
+ */
+int afl_interesting(uint8_t *data, long data_len, const uint8_t *eff_map, int width, long *state,
+                    unsigned long *skipped) {
+  long count = width == 1 ? COUNT(interesting_8) : width == 2 ? COUNT(interesting_16) : COUNT(interesting_32);
+  uint32_t mask = width_mask(width), orig, val;
+
+  if (data_len < width)
+    return 0;
+
+  for (;;) {
+    if (state[1] >= count) {
+      state[0]++;
+      state[1] = 0;
+    }
+
+    if (state[1] == 0)
+      state[0] = next_effective_pos(eff_map, state[0], width, data_len);
+
+    if (state[0] + width - 1 >= data_len) {
+      if (width == 1 || state[2])
+        return 0;
+      state[0] = next_effective_pos(eff_map, 0, width, data_len);
+      state[1] = 0;
+      state[2] = 1;
+      if (state[0] + width - 1 >= data_len)
+        return 0;
+    }
+
+    orig = load(data, state[0], width);
+    if (width == 1) {
+      val = interesting_8[state[1]] & mask;
+    } else if (width == 2) {
+      val = interesting_16[state[1]] & mask;
+      if (state[2])
+        val = swap_16(val);
+    } else {
+      val = interesting_32[state[1]];
+      if (state[2])
+        val = swap_32(val);
+    }
+    state[1]++;
+
+    /* skip values already produced by bitflip, arithmetic and previous interesting stages */
+    if (is_not_bitflip(orig ^ val) && is_not_arithmetic(orig, val, width) &&
+        (width == 1 || is_not_interesting(orig, val, width, state[2])))
+      break;
+    (*skipped)++;
+  }
+
+  store(data, state[0], width, val);
+  return 1;
+}
+
+/* havoc */
+
+static uint64_t rng_state;
+
+static uint32_t rand_next(void) {
+  /* splitmix64 */
+  uint64_t z = (rng_state += 0x9e3779b97f4a7c15ull);
+  z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ull;
+  z = (z ^ (z >> 27)) * 0x94d049bb133111ebull;
+  return (uint32_t)((z ^ (z >> 31)) >> 32);
+}
+
+static long RAND(long value) {
+  if (value <= 0)
+    return 0;
+  return (long)(((uint64_t)rand_next() * (uint64_t)value) >> 32);
+}
+
+static long choose_block_len(long limit) {
+  long min_value, max_value;
+
+  switch (RAND(3)) {
+  case 0:
+    min_value = 1;
+    max_value = AFL_HAVOC_BLK_SMALL;
+    break;
+  case 1:
+    min_value = AFL_HAVOC_BLK_SMALL;
+    max_value = AFL_HAVOC_BLK_MEDIUM;
+    break;
+  default:
+    if (RAND(10)) {
+      min_value = AFL_HAVOC_BLK_MEDIUM;
+      max_value = AFL_HAVOC_BLK_LARGE;
+    } else {
+      min_value = AFL_HAVOC_BLK_LARGE;
+      max_value = AFL_HAVOC_BLK_XL;
+    }
+  }
+
+  if (min_value >= limit)
+    min_value = 1;
+
+  return min_value + RAND((max_value < limit ? max_value : limit) - min_value + 1);
+}
+
+/* data[pos:pos+remove_len] = block, returns the new length or -1 if the result doesn't fit in cap */
+static long replace(uint8_t *data, long data_len, long cap, long pos, long remove_len, const uint8_t *block,
+                    long block_len) {
+  long new_len = data_len - remove_len + block_len;
+  if (new_len > cap)
+    return -1;
+  memmove(data + pos + block_len, data + pos + remove_len, data_len - pos - remove_len);
+  if (block)
+    memcpy(data + pos, block, block_len);
+  return new_len;
+}
+
+/* same as merge_slices in afl_fuzz.py, start < 0 means no slice */
+static void merge_slices(long *cur, long start, long end) {
+  int expanded = 0;
+
+  if (start < 0)
+    return;
+  if (cur[0] < 0) {
+    cur[0] = start;
+    cur[1] = end;
+    return;
+  }
+
+  if (start < cur[0] && end >= cur[0] - 1) {
+    cur[0] = start;
+    expanded = 1;
+  }
+  if (end > cur[1] && start <= cur[1] + 1) {
+    cur[1] = end;
+    expanded = 1;
+  }
+  if (expanded)
+    return;
+
+  if (end - start > cur[1] - cur[0] || (end - start == cur[1] - cur[0] && start <= cur[0])) {
+    cur[0] = start;
+    cur[1] = end;
+  }
+}
+
+/* prepare_block, the block is copied to scratch (or filled with a random byte) */
+static long prepare_block(uint8_t *data, long data_len, uint8_t *scratch, long *clone_to, long *clone_len) {
+  long clone_from, block_len;
+  int actually_clone = RAND(4);
+
+  if (actually_clone) {
+    *clone_len = choose_block_len(data_len);
+    clone_from = RAND(data_len - *clone_len + 1);
+  } else {
+    *clone_len = choose_block_len(AFL_HAVOC_BLK_XL);
+    clone_from = 0;
+  }
+  *clone_to = RAND(data_len);
+
+  if (!actually_clone) {
+    if (!RAND(2)) {
+      memset(scratch, RAND(256), *clone_len);
+      return *clone_len;
+    }
+    clone_from = RAND(data_len);
+  }
+  block_len = data_len - clone_from < *clone_len ? data_len - clone_from : *clone_len;
+  memcpy(scratch, data + clone_from, block_len);
+  return block_len;
+}
+
+static long havoc_op(int op, uint8_t *data, long data_len, long cap, uint8_t *scratch, long *slice) {
+  long pos, len, block_len, clone_to, clone_len, token, token_len, new_len;
+  uint32_t val;
+
+  slice[0] = -1;
+  switch (op) {
+  case 0: /* havoc_bitflip */
+    pos = RAND(data_len * 8);
+    data[pos >> 3] ^= 0x80 >> (pos & 7);
+    slice[0] = slice[1] = pos >> 3;
+    break;
+  case 1: /* havoc_interesting_byte */
+    pos = RAND(data_len);
+    data[pos] = interesting_8[RAND(COUNT(interesting_8))];
+    slice[0] = slice[1] = pos;
+    break;
+  case 2: /* havoc_interesting_2bytes */
+  case 3: /* havoc_interesting_4bytes */
+    len = op == 2 ? 2 : 4;
+    if (data_len < len)
+      break;
+    pos = RAND(data_len - len + 1);
+    if (len == 2) {
+      val = interesting_16[RAND(COUNT(interesting_16))];
+      if (RAND(2))
+        val = swap_16(val);
+    } else {
+      val = interesting_32[RAND(COUNT(interesting_32))];
+      if (RAND(2))
+        val = swap_32(val);
+    }
+    store(data, pos, len, val);
+    slice[0] = pos;
+    slice[1] = pos + len - 1;
+    break;
+  case 4: /* havoc_randomly_add */
+  case 5: /* havoc_randomly_substract */
+  case 6: /* havoc_randomly_add_2bytes */
+  case 7: /* havoc_randomly_substract_2bytes */
+  case 8: /* havoc_randomly_add_4bytes */
+  case 9: /* havoc_randomly_substract_4bytes */
+    len = op < 6 ? 1 : op < 8 ? 2 : 4;
+    if (data_len < len)
+      break;
+    pos = RAND(data_len - len + 1);
+    val = 1 + RAND(AFL_ARITH_MAX);
+    if (op & 1)
+      store(data, pos, len, load(data, pos, len) - val);
+    else
+      store(data, pos, len, load(data, pos, len) + val);
+    slice[0] = pos;
+    slice[1] = pos + len - 1;
+    break;
+  case 10: /* havoc_set_randomly */
+    pos = RAND(data_len);
+    data[pos] ^= 1 + RAND(255);
+    slice[0] = slice[1] = pos;
+    break;
+  case 11: /* havoc_remove_randomly_block, twice to increase chances */
+  case 12:
+    if (data_len <= 2)
+      break;
+    len = choose_block_len(data_len - 1);
+    pos = RAND(data_len - len + 1);
+    data_len = replace(data, data_len, cap, pos, len, NULL, 0);
+    slice[0] = slice[1] = pos;
+    break;
+  case 13: /* havoc_clone_randomly_block */
+  case 14: /* havoc_overwrite_randomly_block */
+    block_len = prepare_block(data, data_len, scratch, &clone_to, &clone_len);
+    len = 0;
+    if (op == 14)
+      len = data_len - clone_to < clone_len ? data_len - clone_to : clone_len;
+    new_len = replace(data, data_len, cap, clone_to, len, scratch, block_len);
+    if (new_len < 0) /* too big, AFL skips these as well */
+      break;
+    data_len = new_len;
+    slice[0] = clone_to;
+    slice[1] = clone_to + clone_len;
+    break;
+  case 15: /* havoc_overwrite_with_dict */
+    if (tokens_count <= 0)
+      break;
+    token = RAND(tokens_count);
+    pos = RAND(data_len);
+    token_len = tokens_offsets[token + 1] - tokens_offsets[token];
+    if (data_len < token_len)
+      break;
+    if (pos >= data_len - token_len) {
+      /* same as dictionary_overwrite when it runs out of places */
+      if (token + 1 >= tokens_count)
+        break;
+      pos = 0;
+    }
+    memcpy(data + pos, tokens_buf + tokens_offsets[token], token_len);
+    slice[0] = pos;
+    slice[1] = pos + token_len;
+    break;
+  case 16: /* havoc_insert_with_dict */
+    if (tokens_count <= 0)
+      break;
+    token = RAND(tokens_count);
+    pos = RAND(data_len);
+    token_len = tokens_offsets[token + 1] - tokens_offsets[token];
+    new_len = replace(data, data_len, cap, pos, 0, tokens_buf + tokens_offsets[token], token_len);
+    if (new_len < 0)
+      break;
+    data_len = new_len;
+    slice[0] = pos;
+    slice[1] = pos + token_len;
+    break;
+  }
+  return data_len;
+}
+
+/*
+ * One havoc round: stacks 2..128 random operations on data, which has room
+ * for cap bytes. scratch must hold at least AFL_HAVOC_BLK_XL bytes. Returns
+ * the new length, the merged modified slice is written to out_slice
+ * ([-1, -1] if nothing was modified).
+ */
+long afl_havoc(uint8_t *data, long data_len, long cap, uint8_t *scratch, uint64_t seed, long *out_slice) {
+  long slice[2];
+  long i, stack;
+
+  rng_state = seed;
+  out_slice[0] = out_slice[1] = -1;
+  if (data_len <= 0)
+    return data_len;
+
+  stack = 1L << (1 + RAND(AFL_HAVOC_STACK_POW2));
+  for (i = 0; i < stack; i++) {
+    data_len = havoc_op(RAND(HAVOC_OPS), data, data_len, cap, scratch, slice);
+    merge_slices(out_slice, slice[0], slice[1]);
+  }
+  return data_len;
+}
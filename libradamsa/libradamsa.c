@@ -30842,3 +30842,24 @@ size_t radamsa_inplace(uint8_t *ptr, size_t len, size_t max, unsigned int seed)
    return radamsa(ptr, len, ptr, max, seed);
 }
 
+/* generate count outputs from the same input one after another in arena, output i gets at most maxs[i] bytes and
+   its length is written to lens[i]. Seeds which produce no data are skipped. *seed is advanced past the seeds used,
+   returns the number of outputs written (less than count if the arena is full) */
+size_t radamsa_batch(uint8_t *ptr, size_t len, uint8_t *arena, size_t arena_size, const size_t *maxs, size_t *lens,
+                     size_t count, unsigned int *seed) {
+   size_t i, offset = 0;
+   for (i = 0; i < count; i++) {
+      size_t max = maxs[i], n = 0;
+      int attempts = 0;
+      if (max > arena_size - offset)
+         max = arena_size - offset;
+      if (max == 0)
+         break;
+      while (n == 0 && attempts++ < 16)
+         n = radamsa(ptr, len, arena + offset, max, (*seed)++);
+      lens[i] = n;
+      offset += n;
+   }
+   return i;
+}
+
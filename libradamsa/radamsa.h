@@ -12,4 +12,7 @@ extern size_t radamsa_inplace(uint8_t *ptr,
                               size_t max, 
                               unsigned int seed);
 
-
+extern size_t radamsa_batch(uint8_t *ptr, size_t len,
+                            uint8_t *arena, size_t arena_size,
+                            const size_t *maxs, size_t *lens,
+                            size_t count, unsigned int *seed);
@@ -17,7 +17,6 @@
 
 from os import listdir
 from os.path import isfile, join
-import shutil
 from ctypes import *
 import multiprocessing
 import argparse
@@ -30,9 +29,19 @@ import manul_network
 import random
 import afl_fuzz
 import zlib
-import importlib
+import functools
 import dbi_mode
 import radamsa
+from manul_queue import QueueEntry, get_trace_mini, update_bitmap_score, cull_queue, skip_entry, pending_batch_size
+from manul_scheduler import PowerScheduler, SCHEDULES
+from manul_plugins import load_user_mutator, PLUGIN_BATCH
+from manul_dict import AutoDictionary, extract_binary_tokens
+from manul_stats import StatsLog, read_last_record, STATS_LOG_NAME
+from manul_corpus import PackedCorpus, is_packed_corpus, PACK_SUFFIX
+from manul_storage import Storage, QueueIndex, content_hash, read_index_records, BLOBS_DIR, QUEUE_INDEX_NAME, \
+    SYNC_INTERVAL, SYNC_PREFIX, SYNC_MUTATOR
+from manul_checkpoint import save_checkpoint, load_checkpoint, save_bitmaps, load_bitmaps, CalibrationLog, \
+    CHECKPOINT_NAME, CHECKPOINT_INTERVAL, BITMAP_NAME, CALIBRATION_NAME, RESUME_VERIFY
 
 from fuzzwatch import run_gui
 from fuzzwatch import GuiState
@@ -40,20 +49,23 @@ from fuzzwatch import GuiState
 PY3 = sys.version_info[0] == 3
 
 if PY3:
-    string_types = str,
     xrange = range
 else:
-    string_types = basestring,
     xrange = xrange
 
 import subprocess, threading
 import signal
+import select
 
 net_process_is_up = None
 net_sleep_between_cases = 0
 
 INIT_WAIT_TIME = 0
 
+# auto timeout is AUTO_TIMEOUT_MULT times the calibrated exec time of the entry (or the queue average if bigger)
+AUTO_TIMEOUT_MULT = 5
+AUTO_TIMEOUT_MIN = 0.2  # seconds, process startup in Python is too noisy to go below this
+
 class ForkServer(object):
     def __init__(self, timeout):
         self.control = os.pipe()
@@ -66,7 +78,7 @@ class ForkServer(object):
         if processid:
             # This is the parent process
             time.sleep(INIT_WAIT_TIME)
-            self.r_fd = os.fdopen(self.status[0], 'rb')
+            self.r_fd = os.fdopen(self.status[0], 'rb', 0)  # unbuffered, we select() on this fd
             res = self.r_fd.read(4)
             if len(res) != 4:
                 ERROR("Failed to init forkserver")
@@ -92,9 +104,7 @@ class ForkServer(object):
             sys.exit(0) # this shouldn't be happen
 
 
-    def run_via_forkserver(self):
-        # TODO: timeouts for read/write otherwise we can wait infinitely
-
+    def run_via_forkserver(self, timeout):
         res = os.write(self.control[1], b"go_!") # ask forkserver to fork
         if res != 4:
             ERROR("Failed to communicate with forkserver (run_via_forkserver, write). Unable to send go command")
@@ -103,10 +113,22 @@ class ForkServer(object):
         if len(fork_pid) != 4:
             ERROR("Failed to communicate with forkserver (run_via_forkserver, read). Unable to confirm fork")
 
-        status = self.r_fd.read(4) # TODO: we need timeout here because our target can go idle
+        timed_out = False
+        ready, _, _ = select.select([self.r_fd], [], [], timeout)
+        if not ready:
+            # the target went idle, kill the child and let the forkserver report its status
+            timed_out = True
+            try:
+                os.kill(bytes_to_int(fork_pid), signal.SIGKILL)
+            except OSError:
+                pass  # child just finished
+
+        status = self.r_fd.read(4)
         if len(status) != 4:
             ERROR("Failed to communicate with forkserver (run_via_forkserver, read). Unable to retrieve child status")
 
+        if timed_out:
+            return None
         return bytes_to_int(status)
 
 
@@ -118,6 +140,7 @@ class Command(object):
         self.forkserver_is_up = False
         self.forkserver = None
         self.returncode = 0
+        self.timed_out = False
 
         if self.forkserver_on:
             self.forkserver = ForkServer(timeout)
@@ -179,11 +202,12 @@ class Command(object):
         return 0, ""
 
 
-    def exec_command_forkserver(self, cmd):
+    def exec_command_forkserver(self, cmd, timeout):
         if not self.forkserver_is_up:
             self.forkserver.init_forkserver(cmd)
             self.forkserver_is_up = True
-        status = self.forkserver.run_via_forkserver()
+        status = self.forkserver.run_via_forkserver(timeout)
+        self.timed_out = status is None
 
         return status
 
@@ -283,6 +307,7 @@ class Command(object):
             except subprocess.TimeoutExpired:
                 INFO(1, None, None, "Timeout occured")
                 kill_all(self.process.pid)
+                self.timed_out = True
                 return False
         else:
             self.out, self.err = self.process.communicate() # watchdog will handle timeout if needed in PY2
@@ -290,9 +315,10 @@ class Command(object):
         return True
 
 
-    def exec_command(self, cmd):
+    def exec_command(self, cmd, timeout):
+        self.timed_out = False
         if self.forkserver_on:
-            self.returncode = self.exec_command_forkserver(cmd)
+            self.returncode = self.exec_command_forkserver(cmd, timeout)
             self.err = ""
             return
 
@@ -309,11 +335,13 @@ class Command(object):
                                             preexec_fn=os.setsid)
 
         #INFO(1, None, None, "Target successfully started, waiting for result")
-        self.handle_return(self.timeout)
+        self.handle_return(timeout)
 
-    def run(self, cmd):
+    def run(self, cmd, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
 
-        self.exec_command(cmd)
+        self.exec_command(cmd, timeout)
 
         if isinstance(self.err, (bytes, bytearray)):
             self.err = self.err.decode("utf-8", 'replace')
@@ -334,11 +362,13 @@ class Fuzzer:
         self.SHM_ENV_VAR = "__AFL_SHM_ID"
 
         self.deterministic = args.deterministic_seed
-        if self.deterministic:
-            random.seed(a=self.fuzzer_id)
+        self.numpy_rng = args.numpy_rng
+        if self.numpy_rng and numpy is None:
+            WARNING(None, "numpy is not installed, using the default random number generator")
+        # forked instances inherit the parent's generator state, so every instance has to be seeded on its own
+        seed_rng(fuzzer_id if self.deterministic else None, self.numpy_rng)
 
         self.dbi = args.dbi
-        self.afl_fuzzer = dict()
         self.radamsa_path = radamsa_path
         if "linux" in sys.platform and "radamsa:0" not in args.mutator_weights:
             self.radamsa_fuzzer = radamsa.RadamsaFuzzer(RAND(MAX_SEED))
@@ -350,23 +380,26 @@ class Fuzzer:
 
         self.token_dict = list()
         self.timeout = args.timeout
+        self.auto_timeout = args.auto_timeout
+        self.skip_det_nonfavored = args.skip_det_nonfavored
         self.disable_volatile_bytes = args.disable_volatile_bytes
         net_sleep_between_cases = float(args.net_sleep_between_cases)
 
         self.user_mutators = dict()
         self.mutator_weights = OrderedDict()
-        total_weights = 0
         try:
             weights = args.mutator_weights.split(",")
             for weight in weights:
                 name, weight = weight.split(":")
-                total_weights += int(weight)
-                self.mutator_weights[name] = total_weights
+                self.mutator_weights[name] = int(weight)
         except:
             ERROR("Invalid format for mutator_weights string, check manul.config file")
 
-        if total_weights != 10:
-            ERROR("Weights in mutator_weights should have 10 in sum, check manul.config file")
+        if any(weight < 0 for weight in self.mutator_weights.values()) or sum(self.mutator_weights.values()) <= 0:
+            ERROR("Weights in mutator_weights can't be negative and at least one should be positive, check manul.config file")
+        # filled by init_mutators
+        self.mutator_dispatch = None
+        self.mutator_alias = None
 
         try:
             if args.dict:
@@ -382,10 +415,13 @@ class Fuzzer:
         except:
             WARNING(None, "Failed to parse dictionary file, dictionary is in invalid format or not accessible")
 
-        self.current_file_name = None
-        self.prev_hashes = dict()  # used to store hash of coverage bitmap for each file
-        for file_name in list_of_files:
-            self.prev_hashes[file_name] = None
+        # user tokens are extended with string constants of the target and tokens found during byteflip_1
+        self.auto_dict = None
+        if not args.disable_auto_dict:
+            self.auto_dict = AutoDictionary(self.token_dict, args.binary_tokens)
+            self.token_dict = self.auto_dict.tokens()
+
+        self.current_entry = None
 
         self.cmd_fuzzing = args.cmd_fuzzing
 
@@ -415,7 +451,12 @@ class Fuzzer:
             self.target_port = args.target_ip_port.split(':')[1]
             self.target_protocol = args.target_protocol
 
-        self.list_of_files = list_of_files
+        self.input_path = args.input
+        packed = None
+        if is_packed_corpus(self.input_path):  # seeds are slices of the mapped corpus instead of files
+            packed = PackedCorpus(self.input_path)
+        self.list_of_files = [QueueEntry(file_name, self.input_path + "/" + file_name, False, packed)
+                              for file_name in list_of_files]
         self.fuzzer_id = fuzzer_id
         self.virgin_bits = list()
         self.virgin_bits = [0xFF] * SHM_SIZE
@@ -423,8 +464,11 @@ class Fuzzer:
         self.global_map = virgin_bits_global
         self.crash_bits = crash_bits  # happens not too often
         self.bitmap_size = 0
-        self.avg_bitmap_size = 0
-        self.avg_exec_per_sec = 0
+
+        self.top_rated = [None] * SHM_SIZE  # the best queue entry for each map position
+        self.score_changed = False
+        self.pending_favored = 0
+        self.scheduler = PowerScheduler(args.power_schedule)
 
         self.stats_array = stats_array
         self.restore = restore_session
@@ -439,6 +483,7 @@ class Fuzzer:
 
         self.crashes_path = self.output_path + "/crashes"
         self.unique_crashes_path = self.crashes_path + "/unique"
+        self.hangs_path = self.output_path + "/hangs"  # inputs which hit the timeout
 
         self.enable_logging = args.logging_enable
         self.log_file = None
@@ -469,15 +514,52 @@ class Fuzzer:
                     os.mkdir(self.mutate_file_path)
                 except:
                     ERROR("Failed to create output directory for mutated files")
+        if not os.path.isdir(self.hangs_path):  # also missing in sessions saved before hangs were kept
+            try:
+                os.mkdir(self.hangs_path)
+            except:
+                ERROR("Failed to create required output dir structure (hangs)")
+
+        self.storage = Storage(args.async_storage)
+        if self.restore:
+            self.storage.index_crashes(self.crashes_path, self.hangs_path)
+        self.cur_input = None  # content of .cur_input, None if it was written by an external tool
+        self.cur_mutator = None  # name of the mutator which produced .cur_input
+
+        self.queue_index = None  # metadata of the queue in content-addressed layout
+        if args.content_addressed_queue:
+            blobs_path = args.output + "/" + BLOBS_DIR
+            if not os.path.isdir(blobs_path):
+                try:
+                    os.mkdir(blobs_path)
+                except OSError:
+                    pass  # created by another instance in the meantime
+            self.queue_index = QueueIndex(self.output_path + "/" + QUEUE_INDEX_NAME, blobs_path)
+
+        # importing entries found by the other instances
+        self.nfuzzers = args.nfuzzers
+        self.sync_root = args.output
+        self.sync_interval = args.sync_interval
+        self.last_sync_time = time.time()
+        self.sync_seen = dict()  # instance id -> names of its queue files seen so far
+        self.sync_offsets = dict()  # instance id -> offset of the first unread record of its queue index
 
         self.is_dumb_mode = args.simple_mode
-        self.input_path = args.input
         self.target_binary_path = args.target_binary  # and its arguments
 
         self.fuzzer_stats = FuzzerStats()
-        self.stats_file = None
+        self.stats_log = None
         self.disable_save_stats = args.no_stats
 
+        self.checkpoint_path = self.output_path + "/" + CHECKPOINT_NAME
+        self.bitmap_path = self.output_path + "/" + BITMAP_NAME
+        self.restored_bitmaps = False  # True if coverage maps of the previous session were loaded
+        self.checkpoint_interval = args.checkpoint_interval
+        self.resume_verify = args.resume_verify  # inputs executed on resume to verify the restored calibration
+        self.last_checkpoint_time = 0
+        self.checkpoint = None  # loaded on restore, used to restore mutators in init_mutators
+        self.calibration_log = None
+
         if not self.is_dumb_mode:
             self.trace_bits = self.setup_shm()
 
@@ -488,32 +570,16 @@ class Fuzzer:
                     self.virgin_bits[i] = self.global_map[i]
 
         if self.restore:
-            if not isfile(self.output_path + "/fuzzer_stats"):
-                ERROR("Fuzzer stats file doesn't exist. Make sure your output is actual working dir of manul")
-
-            self.stats_file = open(self.output_path + "/fuzzer_stats", 'r')
-            content = self.stats_file.readlines()
-            line = None
-            for line in content:  # getting last line from file to restore session
-                pass
-            if line is None:
-                ERROR("Failed to restore fuzzer %d from stats. Invalid fuzzer_stats format" % self.fuzzer_id)
-
-            last = line[:-2]  # skipping last symbol space and \n
-            INFO(0, None, None, "Restoring last stats %s" % last)
-            self.stats_file.close()
+            last = self.read_last_stats()
+            INFO(0, None, None, "Restoring last stats %s" % " ".join("%s:%.2f" % (k, v) for k, v in last.items()))
 
-            bitmap = None
-            if not self.is_dumb_mode:
-                self.bitmap_file = open(self.output_path + "/fuzzer_bitmap", "rb")
-                bitmap = self.bitmap_file.read()
-                self.bitmap_file.close()
+            self.restore_session(last)
 
-            self.restore_session(last, bitmap)
+        # calibration results of the previous session are loaded on restore
+        self.calibration_log = CalibrationLog(self.output_path + "/" + CALIBRATION_NAME, self.restore)
 
         if not self.disable_save_stats:
-            self.stats_file = open(self.output_path + "/fuzzer_stats", 'a+')
-            self.bitmap_file = open(self.output_path + "/fuzzer_bitmap", 'wb')
+            self.stats_log = StatsLog(self.output_path + "/" + STATS_LOG_NAME, self.fuzzer_stats.stats.keys())
 
         if self.enable_logging:
             self.log_file = open(self.output_path + "/fuzzer_log", 'a')
@@ -543,52 +609,145 @@ class Fuzzer:
                 self.virgin_bits[i] = self.global_map[i]
 
 
-    def restore_session(self, last, bitmap):
-        # parse previously saved stats line
-        last = last.split(" ")[1:]  # cut timestamp
-        for index, stat in enumerate(last):
-            stat = float(stat.split(":")[1])  # taking actual value
-            if PY3:
-                stat_name = list(self.fuzzer_stats.stats.items())[index][0]
-            else:
-                stat_name = self.fuzzer_stats.stats.items()[index][0]
-            self.fuzzer_stats.stats[stat_name] = stat
-
-        if bitmap:
-            # restoring and synchronizing bitmap
-            '''for i in range(0, SHM_SIZE):
-                self.virgin_bits[i] = bitmap[i]
-                self.sync_bitmap_freq = self.user_sync_freq # little trick to enable synchronization
-                self.sync_bitmap()
-                self.sync_bitmap_freq = 0'''
+    def read_last_stats(self):
+        # returns {stat name: value} saved by the last save_stats call
+        try:
+            last = read_last_record(self.output_path + "/" + STATS_LOG_NAME)
+        except ValueError as exc:
+            ERROR("Failed to restore fuzzer %d from stats. %s" % (self.fuzzer_id, exc))
+        if last is not None:
+            return last[1]
+        if isfile(self.output_path + "/" + STATS_LOG_NAME):
+            return dict()  # the instance was stopped before its first record, nothing to restore
+
+        # session saved before the binary stats log was introduced, stats are in the text fuzzer_stats file
+        if not isfile(self.output_path + "/fuzzer_stats"):
+            ERROR("Fuzzer stats file doesn't exist. Make sure your output is actual working dir of manul")
+        line = None
+        with open(self.output_path + "/fuzzer_stats", 'r') as fd:
+            for line in fd:  # getting last line from file to restore session
+                pass
+        if line is None:
+            ERROR("Failed to restore fuzzer %d from stats. Invalid fuzzer_stats format" % self.fuzzer_id)
+        names = list(self.fuzzer_stats.stats.keys())
+        values = [float(stat.split(":")[1]) for stat in line.split()[1:]]  # cut timestamp, take actual values
+        return dict(zip(names, values))
+
+
+    def restore_session(self, last):
+        for stat_name, stat in last.items():
+            if stat_name in self.fuzzer_stats.stats:
+                self.fuzzer_stats.stats[stat_name] = stat
+
+        if not self.is_dumb_mode:
+            self.restore_bitmaps()
+
+        # restoring queue
+        final_list_of_files = list()
+        packed = None
+        if is_packed_corpus(self.queue_path + PACK_SUFFIX):  # queue packed with manul_corpus.py between two runs
+            packed = PackedCorpus(self.queue_path + PACK_SUFFIX)
+            for file_name in packed.names:
+                final_list_of_files.append(QueueEntry(file_name, self.queue_path + "/" + file_name, True, packed))
+        new_files = [f for f in os.listdir(self.queue_path) if os.path.isfile(os.path.join(self.queue_path, f)) and
+                     not f.startswith(".") and  # temporary files of writes interrupted by the restart
+                     (packed is None or f not in packed)]
+        for file_name in new_files:
+            final_list_of_files.append(QueueEntry(file_name, self.queue_path + "/" + file_name, True))
+        if self.queue_index is not None:
+            for record in self.queue_index.records:
+                blob_path = self.queue_index.blob_path(record["hash"])
+                if os.path.isfile(blob_path):  # the blob may not have been written before the instance was killed
+                    final_list_of_files.append(QueueEntry(record["hash"], blob_path, True))
+
+        self.list_of_files = self.list_of_files + final_list_of_files
+
+        try:
+            self.checkpoint = load_checkpoint(self.checkpoint_path)
+        except ValueError as exc:
+            WARNING(None, "Failed to load checkpoint of fuzzer %d (%s), mutators will start from the beginning" %
+                    (self.fuzzer_id, exc))
+        if self.checkpoint is not None:  # entries of the other instances looked at before are not executed again
+            self.sync_offsets = self.checkpoint.sync_offsets
+            self.sync_seen = self.checkpoint.sync_seen
+
+
+    def restore_rng(self):
+        # called right before fuzzing starts, so random numbers drawn during initialization don't shift the stream
+        if not self.deterministic:
+            return
+        if self.checkpoint is not None and self.checkpoint.numpy_rng == rng.use_numpy:
+            # the stream continues exactly where the checkpoint was taken, whatever the number of executions
+            rng.setstate(self.checkpoint.rng_state)
+        else:
+            # session saved without a checkpoint, at least don't repeat the mutations made before the restart
+            seed_rng("%d:%d" % (self.fuzzer_id, self.fuzzer_stats.stats['executions']), self.numpy_rng)
 
-            # restoring queue
-            final_list_of_files = list()
-            new_files = [f for f in os.listdir(self.queue_path) if os.path.isfile(os.path.join(self.queue_path, f))]
-            for file_name in new_files:
-                final_list_of_files.append((1, file_name))  # this is how we add new files
 
-            self.list_of_files = self.list_of_files + final_list_of_files
+    def restore_bitmaps(self):
+        # coverage seen before the restart, so the dry run and the fuzzing don't have to rediscover it
+        try:
+            maps = load_bitmaps(self.bitmap_path)
+        except ValueError as exc:
+            WARNING(None, "Failed to load bitmaps of fuzzer %d (%s), coverage will be rediscovered" %
+                    (self.fuzzer_id, exc))
+            return
+        if maps is None:
+            return
+        virgin_bits, crash_bits = maps
+        if len(virgin_bits) != SHM_SIZE:
+            WARNING(None, "Bitmaps of fuzzer %d have a different size, coverage will be rediscovered" % self.fuzzer_id)
+            return
 
-        if self.deterministic:  # skip already seen seeds
-            for i in range(0, self.fuzzer_stats.stats['executions']):
-                random.seed(seed=self.fuzzer_id)
+        self.virgin_bits = list(virgin_bits)
+        with self.crash_bits.get_lock():
+            self.crash_bits[:] = [saved & current for saved, current in zip(crash_bits, self.crash_bits[:])]
+        self.sync_bitmap_freq = -1  # next call synchronizes with the global map
+        self.sync_bitmap()
+        self.restored_bitmaps = True
 
 
     def save_stats(self):
-        if self.stats_file is None:
+        if self.stats_log is None:
             return
 
-        self.stats_file.write(str(time.time()) + " ")
-        for index, (k,v) in enumerate(self.fuzzer_stats.stats.items()):
-            self.stats_file.write("%d:%.2f " % (index, v))
-        self.stats_file.write("\n")
-        self.stats_file.flush()
+        self.stats_log.append(time.time(), self.fuzzer_stats.stats.values())
+
+        if time.time() - self.last_checkpoint_time >= self.checkpoint_interval:
+            self.write_checkpoint()
+
+
+    def write_checkpoint(self):
+        # stage and cursor of every queue entry, RNG and sync state in one file, coverage maps in another
+        self.storage.flush()  # the checkpoint never refers to queue files which are not on disk yet
+        for entry in self.list_of_files:
+            if entry.file_name not in self.calibration_log:
+                calibration = self.calibration_of(entry)
+                if calibration is not None:
+                    self.calibration_log.append(entry.file_name, calibration)
+        self.calibration_log.flush()
+        entries = [(entry.file_name, entry.mutator.stage_id, entry.mutator.cursor) for entry in self.list_of_files]
+        save_checkpoint(self.checkpoint_path, entries, rng.getstate(), rng.use_numpy, self.sync_offsets,
+                        self.sync_seen)
+        if not self.is_dumb_mode:
+            save_bitmaps(self.bitmap_path, self.virgin_bits, self.crash_bits[:])
+        self.last_checkpoint_time = time.time()
+
+
+    def calibration_of(self, entry):
+        # dry run results saved to the calibration log, None if the entry hasn't been executed yet
+        if entry.exec_cksum is None or not entry.bitmap_size:
+            return None
+        return entry.size, entry.exec_cksum, entry.exec_us, entry.bitmap_size, entry.trace_mini
+
 
-        # saving AFL state
-        for file_name in self.list_of_files:
-            if not isinstance(file_name, string_types) : file_name = file_name[1]
-            self.afl_fuzzer[file_name].save_state(self.output_path)
+    def restore_mutator_state(self, entry):
+        if self.checkpoint is None:
+            entry.mutator.restore_state(self.output_path)  # session saved before checkpoints were introduced
+            return
+        state = self.checkpoint.entries.get(entry.file_name)
+        if state is not None:
+            entry.mutator.stage_id, entry.mutator.cursor = state
 
 
     def prepare_cmd_to_run(self, target_file_path, is_net):
@@ -690,19 +849,86 @@ class Fuzzer:
         for module_name in self.mutator_weights:
             if "afl" == module_name or "radamsa" == module_name:
                 continue
-            try:
-                self.user_mutators[module_name] = importlib.import_module(module_name)
-            except ImportError as exc:
-                ERROR("Unable to load user provided mutator %s. %s" % (module_name, exc.message))
+            self.user_mutators[module_name] = load_user_mutator(module_name, RAND(MAX_SEED))
 
-            self.user_mutators[module_name].init()
+        # mutator per weight, sampled with an alias table for every new input
+        names = [name for name in self.mutator_weights if self.mutator_weights[name] > 0]
+        self.mutator_names = names
+        self.mutator_dispatch = [self.get_mutator(name) for name in names]
+        self.mutator_alias = build_alias_table([self.mutator_weights[name] for name in names])
 
         # init AFL fuzzer state
-        for file_name in self.list_of_files:
-            if not isinstance(file_name, string_types): file_name = file_name[1]
-            self.afl_fuzzer[file_name] = afl_fuzz.AFLFuzzer(self.token_dict, self.queue_path, file_name, self.gui_state)  #assign AFL for each file
+        afl_fuzz.dispatcher.setup(self.token_dict, self.gui_state, self.auto_dict)
+        for entry in self.list_of_files:
+            entry.update_size()
+            entry.mutator = afl_fuzz.AFLFuzzer(entry.file_name)  #assign AFL for each file
             if self.restore:
-                self.afl_fuzzer[file_name].restore_state(self.output_path)
+                self.restore_mutator_state(entry)
+
+
+    def dry_run_entry(self, entry):
+        # executes entry once, returns the trace bitmap and the output of the target
+        file_name = entry.file_name
+
+        full_input_file_path = self.mutate_file_path + "/.cur_input"
+        self.save_cur_input(entry.read(), full_input_file_path)
+
+        memset(self.trace_bits, 0x0, SHM_SIZE)
+
+        timer_start = timer()
+        if self.target_ip:
+            err_code, err_output = self.command.net_send_data_to_target(extract_content(full_input_file_path), self.net_cmd)
+        else:
+            cmd = self.prepare_cmd_to_run(full_input_file_path, False)
+            INFO(1, bcolors.BOLD, self.log_file, "Launching %s" % cmd)
+            err_code, err_output = self.command.run(cmd)
+        entry.exec_us = int((timer() - timer_start) * 1000000)
+
+        if err_code and err_code != 0:
+            INFO(1, None, self.log_file, "Initial input file: %s triggers an exception in the target" % file_name)
+            if self.is_critical(err_output, err_code):
+                WARNING(self.log_file, "Initial input %s leads target to crash (did you disable leak sanitizer?). "
+                                       "Enable --debug to check actual output" % file_name)
+                INFO(1, None, self.log_file, err_output)
+            elif self.is_problem_with_config(err_code, err_output):
+                WARNING(self.log_file, "Problematic file %s" % file_name)
+
+        return string_at(self.trace_bits, SHM_SIZE), err_output
+
+
+    def restore_calibration(self):
+        '''
+        On resume entries are not executed again, their trace checksums and calibration results are taken from the
+        calibration log. Only possible if the coverage maps were restored as well. A random sample of resume_verify entries
+        is executed to check that the target still behaves the same way. Returns the set of restored file names.
+        '''
+        if not self.restored_bitmaps:
+            self.calibration_log.forget()
+            return set()
+
+        stored = []
+        for entry in self.list_of_files:
+            calibration = self.calibration_log.entries.get(entry.file_name)
+            if calibration is not None and calibration[0] == entry.size:  # size differs if the file was replaced
+                stored.append((entry, calibration))
+            else:
+                self.calibration_log.forget(entry.file_name)
+
+        # separate generator, the sample must not shift the random stream restored from the checkpoint
+        sample = random.Random().sample(stored, min(self.resume_verify, len(stored)))
+        for entry, calibration in sample:
+            trace_bits_as_str, _ = self.dry_run_entry(entry)
+            if zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF != calibration[1]:
+                WARNING(self.log_file, "%s produces a different trace than before the restart, all inputs will be "
+                                       "executed again" % entry.file_name)
+                self.calibration_log.forget()
+                return set()
+
+        for entry, calibration in stored:
+            _, entry.exec_cksum, entry.exec_us, entry.bitmap_size, entry.trace_mini = calibration
+        INFO(0, None, self.log_file, "Restored calibration of %d out of %d inputs (%d verified)" %
+             (len(stored), len(self.list_of_files), len(sample)))
+        return set(entry.file_name for entry, _ in stored)
 
 
     def dry_run(self):
@@ -710,49 +936,34 @@ class Fuzzer:
         INFO(0, bcolors.BOLD + bcolors.HEADER, self.log_file, "Performing dry run")
 
         useless = 0
+        restored = self.restore_calibration() if self.restore else set()
 
-        for file_name in self.list_of_files:
-            # if we have tuple and not string here it means that this file was found during execution and located in queue
-            self.current_file_name = file_name
-            if not isinstance(file_name, string_types):
-                file_name = file_name[1]
-                full_input_file_path = self.queue_path + "/" + file_name
-            else:
-                full_input_file_path = self.input_path + "/" + file_name
-
-            shutil.copy(full_input_file_path, self.mutate_file_path + "/.cur_input")
+        for entry in self.list_of_files:
+            self.current_entry = entry
+            file_name = entry.file_name
             full_input_file_path = self.mutate_file_path + "/.cur_input"
 
-            memset(self.trace_bits, 0x0, SHM_SIZE)
+            if file_name in restored:
+                self.update_bitmap_score(entry)
+                self.scheduler.add_entry(entry)
+                continue
 
-            if self.target_ip:
-                err_code, err_output = self.command.net_send_data_to_target(extract_content(full_input_file_path), self.net_cmd)
-            else:
-                cmd = self.prepare_cmd_to_run(full_input_file_path, False)
-                INFO(1, bcolors.BOLD, self.log_file, "Launching %s" % cmd)
-                err_code, err_output = self.command.run(cmd)
-
-            if err_code and err_code != 0:
-                INFO(1, None, self.log_file, "Initial input file: %s triggers an exception in the target" % file_name)
-                if self.is_critical(err_output, err_code):
-                    WARNING(self.log_file, "Initial input %s leads target to crash (did you disable leak sanitizer?). "
-                                           "Enable --debug to check actual output" % file_name)
-                    INFO(1, None, self.log_file, err_output)
-                elif self.is_problem_with_config(err_code, err_output):
-                    WARNING(self.log_file, "Problematic file %s" % file_name)
-
-            trace_bits_as_str = string_at(self.trace_bits, SHM_SIZE)
+            trace_bits_as_str, err_output = self.dry_run_entry(entry)
+            entry.exec_cksum = zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF
+            entry.bitmap_size = count_bytes(trace_bits_as_str)
+            entry.trace_mini = get_trace_mini(trace_bits_as_str)
+            self.update_bitmap_score(entry)
+            self.scheduler.add_entry(entry)
 
             # count non-zero bytes just to check that instrumentation actually works
-            non_zeros = [x for x in trace_bits_as_str if x != 0x0]
-            if len(non_zeros) == 0:
+            if entry.bitmap_size == 0:
                 INFO(1, None, self.log_file, "Output from target %s" % err_output)
                 if "is for the wrong architecture" in err_output:
                     ERROR("You should run 32-bit drrun for 32-bit targets and 64-bit drrun for 64-bit targets")
                 ERROR("%s doesn't cover any path in the target, Make sure the binary is actually instrumented" % file_name)
 
             ret = self.has_new_bits(trace_bits_as_str, True, list(), self.virgin_bits, False, full_input_file_path)
-            if ret == 0:
+            if ret == 0 and not self.restored_bitmaps:  # otherwise its coverage is already in the restored maps
                 useless += 1
                 WARNING(self.log_file, "Test %s might be useless because it doesn't cover new paths in the target, consider removing it" % file_name)
             else:
@@ -767,23 +978,22 @@ class Fuzzer:
         self.update_stats()
 
 
-    def has_new_bits(self, trace_bits_as_str, update_virgin_bits, volatile_bytes, bitmap_to_compare, calibration, full_input_file_path):
+    def has_new_bits(self, trace_bits_as_str, update_virgin_bits, volatile_bytes, bitmap_to_compare, calibration,
+                     full_input_file_path, hash_current=None):
 
         ret = 0
 
         #print_bitmaps(bitmap_to_compare, trace_bits_as_str, full_input_file_path)
 
         if not calibration:
-            hash_current = zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF
-
-            if not isinstance(self.current_file_name, string_types):
-                self.current_file_name = self.current_file_name[1]
+            if hash_current is None:
+                hash_current = zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF
 
-            prev_hash = self.prev_hashes.get(self.current_file_name, None)
+            prev_hash = self.current_entry.last_cksum
 
             if prev_hash and hash_current == prev_hash:
                 return 0
-            self.prev_hashes[self.current_file_name] = hash_current
+            self.current_entry.last_cksum = hash_current
 
         for j in range(0, SHM_SIZE):
             if j in volatile_bytes:
@@ -815,7 +1025,7 @@ class Fuzzer:
 
         return ret
 
-    def calibrate_test_case(self, full_file_path):
+    def calibrate_test_case(self, full_file_path, entry):
         volatile_bytes = list()
         trace_bits_as_str = string_at(self.trace_bits, self.SHM_SIZE)  # this is how we read memory in Python
 
@@ -833,6 +1043,7 @@ class Fuzzer:
             cmd = self.prepare_cmd_to_run(full_file_path, False)
 
         self.gui_state.set_mutator('calibrating')
+        timer_start = timer()
         for i in range(0, self.CALIBRATIONS_COUNT):
             #INFO(1, None, self.log_file, "Calibrating %s %d" % (full_file_path, i))
 
@@ -874,12 +1085,45 @@ class Fuzzer:
                 if len(volatile_bytes) != 0:
                     INFO(1, None, self.log_file, "We have %d volatile bytes for this new finding" % len(volatile_bytes))
 
+        entry.exec_us = int((timer() - timer_start) * 1000000 / self.CALIBRATIONS_COUNT)
+        entry.exec_cksum = zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF
+        entry.bitmap_size = count_bytes(trace_bits_as_str)
+        entry.trace_mini = get_trace_mini(trace_bits_as_str)
+
         # let's try to check for new coverage ignoring volatile bytes
         self.fuzzer_stats.stats['blacklisted_paths'] = len(volatile_bytes)
 
         return self.has_new_bits(trace_bits_as_str, True, volatile_bytes, self.virgin_bits, True, full_file_path)
 
+    def update_bitmap_score(self, entry):
+        if update_bitmap_score(self.top_rated, entry):
+            self.score_changed = True
+
+    def cull_queue(self):
+        if self.is_dumb_mode or not self.score_changed:
+            return
+        self.score_changed = False
+        self.pending_favored = cull_queue(self.top_rated, self.list_of_files)
+
+    def entry_timeout(self, entry):
+        # derive the timeout from the calibrated exec time so that hangs don't burn the whole args.timeout
+        if not self.auto_timeout or not entry.exec_us:
+            return self.timeout
+        exec_us = max(entry.exec_us, self.scheduler.avg_exec_us())
+        return min(self.timeout, max(AUTO_TIMEOUT_MIN, exec_us * AUTO_TIMEOUT_MULT / 1000000.0))
+
+    def calculate_perf_score(self):
+        return self.scheduler.calculate_score(self.current_entry)
+
+    def mark_fuzzed(self, entry):
+        if entry.was_fuzzed:
+            return
+        entry.was_fuzzed = True
+        if entry.favored and self.pending_favored:
+            self.pending_favored -= 1
+
     def update_stats(self):
+        self.fuzzer_stats.stats['redundant_skipped'] = afl_fuzz.redundant_skipped
         for i, (k,v) in enumerate(self.fuzzer_stats.stats.items()):
             self.stats_array[i] = v
 
@@ -893,6 +1137,8 @@ class Fuzzer:
 
     def generate_new_name(self, file_name):
         iteration = int(round(self.fuzzer_stats.stats['executions']))
+        if file_name.startswith(SYNC_PREFIX):  # sync-<instance id>-<original name>
+            file_name = file_name.split("-", 2)[2]
         if file_name.startswith("manul"): # manul-DateTime-FuzzerId-iteration_original.name
             base_name = file_name[file_name.find("_")+1:]
             file_name = base_name
@@ -942,18 +1188,31 @@ class Fuzzer:
         else:  # looks like Linux
             return self.is_critifcal_linux(err_code)
 
-    def mutate_radamsa(self, full_input_file_path, full_output_file_path):
+    def mutate_radamsa(self, entry, full_output_file_path):
+        full_input_file_path = entry.path
         if "linux" in sys.platform: # on Linux we just use a shared library to speed up test cases generation
-            data = extract_content(full_input_file_path)
-            data_new = self.radamsa_fuzzer.radamsa_generate_output(bytes(data))
-            save_content(data_new, full_output_file_path)
+            # outputs are generated in batches, the rest of a batch waits for the next turn of this entry
+            outputs = entry.pending_outputs.pop("radamsa", None)
+            if not outputs:
+                data = bytes(entry.read())
+                count = pending_batch_size(radamsa.RADAMSA_BATCH, len(self.list_of_files))
+                outputs = self.radamsa_fuzzer.radamsa_generate_batch(data, count, detach=True)
+                if not outputs:
+                    outputs = [self.radamsa_fuzzer.radamsa_generate_output(data)]
+            self.save_cur_input(outputs.pop(), full_output_file_path)
+            if outputs:
+                entry.pending_outputs["radamsa"] = outputs
             return 0
 
         new_seed_str = ""
         if self.deterministic:
-            new_seed = random.randint(0, sys.maxsize)
+            new_seed = RAND(sys.maxsize)
             new_seed_str = "--seed %d " % new_seed
 
+        self.cur_input = None
+        if entry.packed is not None:  # radamsa binary needs a file
+            full_input_file_path = self.mutate_file_path + "/.radamsa_input"
+            save_content(entry.read(), full_input_file_path)
         cmd = "%s %s%s > %s" % (self.radamsa_path, new_seed_str, full_input_file_path, full_output_file_path)
 
         INFO(1, None, self.log_file, "Running %s" % cmd)
@@ -966,42 +1225,215 @@ class Fuzzer:
             return 1
         return 0
 
-    def mutate_afl(self, file_name, full_input_file_path, full_output_file_path):
-        data = extract_content(full_input_file_path)
-        res = self.afl_fuzzer[file_name].mutate(data, self.list_of_files,
-                                                self.fuzzer_stats.stats['exec_per_sec'],
-                                                self.avg_exec_per_sec, self.bitmap_size,
-                                                self.avg_bitmap_size, 0) # TODO: handicap
-        if not res:
+    def mutate_afl(self, entry, full_output_file_path):
+        if self.skip_det_nonfavored and not self.is_dumb_mode and not entry.favored:
+            entry.mutator.skip_deterministic()
+        data = entry.read()
+        # most stages mutate data in place, but splice hands back a new buffer
+        data = entry.mutator.mutate(data, self.list_of_files, self.fuzzer_stats.stats['exec_per_sec'],
+                                    self.calculate_perf_score)
+        if not data:
             WARNING(self.log_file, "Unable to mutate data provided using afl")
             return 1
+        if entry.mutator.passed_det():
+            self.mark_fuzzed(entry)
         if len(data) <= 0:
-            WARNING(self.log_file, "AFL produced empty file for %s", full_input_file_path)
+            WARNING(self.log_file, "AFL produced empty file for %s" % entry.path)
 
-        save_content(data, full_output_file_path)
+        self.save_cur_input(data, full_output_file_path)
         return 0
 
-    def mutate_input(self, file_name, full_input_file_path, full_output_file_path):
-        execution = self.fuzzer_stats.stats['executions'] % 10
-        for name in self.mutator_weights:
-            weight = self.mutator_weights[name]
-            if execution < weight and name == "afl":
-                return self.mutate_afl(file_name, full_input_file_path, full_output_file_path)
-            elif execution < weight and name == "radamsa":
-                return self.mutate_radamsa(full_input_file_path, full_output_file_path)
-            elif execution < weight:
-                mutator = self.user_mutators.get(name, None)
-                if not mutator:
-                    ERROR("Unable to load user provided mutator %s at mutate_input stage" % name)
-                data = extract_content(full_input_file_path)
-                data = mutator.mutate(data)
-                if not data:
+    def get_mutator(self, name):
+        if name == "afl":
+            return self.mutate_afl
+        if name == "radamsa":
+            return self.mutate_radamsa_input
+        mutator = self.user_mutators.get(name, None)
+        if not mutator:
+            ERROR("Unable to load user provided mutator %s" % name)
+        return functools.partial(self.mutate_user, mutator)
+
+    def mutate_radamsa_input(self, entry, full_output_file_path):
+        self.mark_fuzzed(entry)
+        return self.mutate_radamsa(entry, full_output_file_path)
+
+    def mutate_user(self, mutator, entry, full_output_file_path):
+        self.mark_fuzzed(entry)
+        if mutator.batch:
+            # the rest of a batch waits for the next turn of this entry
+            outputs = entry.pending_outputs.pop(mutator.name, None)
+            if not outputs:
+                outputs = list(mutator.mutate_batch(entry.read(),
+                                                    pending_batch_size(PLUGIN_BATCH, len(self.list_of_files))))
+                if not outputs:
                     ERROR("No data returned from user provided mutator. Exciting.")
-                save_content(data, full_output_file_path)
-                return 0
-            else:
+            self.save_cur_input(outputs.pop(), full_output_file_path)
+            if outputs:
+                entry.pending_outputs[mutator.name] = outputs
+            return 0
+        data = entry.read()
+        data = mutator.mutate(data)
+        if not data:
+            ERROR("No data returned from user provided mutator. Exciting.")
+        self.save_cur_input(data, full_output_file_path)
+        return 0
+
+    def save_cur_input(self, data, full_output_file_path):
+        # the content stays in memory, findings are saved from it instead of reading .cur_input back
+        self.cur_input = data
+        save_content(data, full_output_file_path)
+
+    def get_cur_input(self, full_output_file_path):
+        if self.cur_input is None:
+            return extract_content(full_output_file_path)
+        return self.cur_input
+
+    def refresh_dictionary(self):
+        self.token_dict = self.auto_dict.tokens()
+        afl_fuzz.dispatcher.set_tokens(self.token_dict)
+        INFO(1, None, self.log_file, "Auto dictionary updated, %d tokens in use" % len(self.token_dict))
+
+    def trim_new_entry(self, entry, full_file_path):
+        '''
+        Let user mutators with a trim hook shrink a new finding. A trimmed input is kept only if it produces the same
+        trace checksum as the original one. Returns True if the file at full_file_path was replaced.
+        '''
+        trimmed = False
+        for mutator in self.user_mutators.values():
+            if not mutator.trim or self.target_ip or self.cmd_fuzzing:
+                continue
+            data = self.get_cur_input(full_file_path)
+            candidate = mutator.trim(bytearray(data))
+            if not candidate or len(candidate) >= len(data):
                 continue
 
+            trim_file_path = self.mutate_file_path + "/.trim_input"
+            save_content(candidate, trim_file_path)
+            memset(self.trace_bits, 0x0, SHM_SIZE)
+            exc_code, err_output = self.command.run(self.prepare_cmd_to_run(trim_file_path, False),
+                                                    self.entry_timeout(entry))
+            self.fuzzer_stats.stats['executions'] += 1.0
+            if self.command.timed_out or (exc_code and self.is_critical(err_output, exc_code)):
+                continue
+            trace_bits_as_str = string_at(self.trace_bits, SHM_SIZE)
+            if zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF == entry.exec_cksum:
+                self.save_cur_input(candidate, full_file_path)
+                trimmed = True
+        return trimmed
+
+    def mutate_input(self, entry, full_output_file_path):
+        mutator_id = 0
+        if len(self.mutator_dispatch) > 1:
+            mutator_id = alias_draw(*self.mutator_alias)
+        self.cur_mutator = self.mutator_names[mutator_id]
+        return self.mutator_dispatch[mutator_id](entry, full_output_file_path)
+
+    def sync_queues(self, cycle_id):
+        '''
+        AFL's sync stage: entries found by the other instances since the last call are executed and imported if they
+        are useful. The instances share the virgin map, so new bits can't tell that. An entry is imported if it
+        touches map positions none of our own entries covers. Returns the list of imported entries.
+        '''
+        imported = list()
+        for fuzzer_id in range(self.nfuzzers):
+            if fuzzer_id == self.fuzzer_id:
+                continue
+            for name, path in self.new_foreign_entries(fuzzer_id):
+                entry = self.import_entry(fuzzer_id, name, path, cycle_id)
+                if entry is not None:
+                    imported.append(entry)
+        if imported:
+            INFO(1, None, self.log_file, "Fuzzer %d imported %d entries from the other instances" %
+                 (self.fuzzer_id, len(imported)))
+        self.last_sync_time = time.time()
+        return imported
+
+    def new_foreign_entries(self, fuzzer_id):
+        # (name, path) of the entries of another instance which haven't been looked at yet, imports are skipped
+        source_path = self.sync_root + "/%d" % fuzzer_id
+        if self.queue_index is not None:
+            entries = list()
+            offset = self.sync_offsets.get(fuzzer_id, 0)
+            for record, end in read_index_records(source_path + "/" + QUEUE_INDEX_NAME, offset):
+                blob_path = self.queue_index.blob_path(record["hash"])
+                if not os.path.isfile(blob_path):
+                    break  # not written yet, try again next time
+                offset = end
+                if record["mutator"] != SYNC_MUTATOR:
+                    entries.append((record["hash"], blob_path))
+            self.sync_offsets[fuzzer_id] = offset
+            return entries
+
+        queue_path = source_path + "/queue"
+        try:
+            names = os.listdir(queue_path)
+        except OSError:
+            return []  # the instance hasn't created its output directory yet
+        seen = self.sync_seen.setdefault(fuzzer_id, set())
+        new_names = sorted(name for name in names if name not in seen and not name.startswith(SYNC_PREFIX) and
+                           not name.startswith("."))
+        seen.update(new_names)
+        return [(name, queue_path + "/" + name) for name in new_names]
+
+    def import_entry(self, fuzzer_id, name, path, cycle_id):
+        try:
+            content = extract_content(path)
+        except (IOError, OSError):
+            return None
+
+        full_input_file_path = self.mutate_file_path + "/.cur_input"
+        self.save_cur_input(content, full_input_file_path)
+        memset(self.trace_bits, 0x0, SHM_SIZE)
+        if self.target_ip:  # in net mode the input is sent to the target like in the main loop
+            exc_code, err_output = self.command.net_send_data_to_target(content, self.net_cmd)
+        else:
+            try:
+                exc_code, err_output = self.command.run(self.prepare_cmd_to_run(full_input_file_path, False))
+            except OSError:
+                return None  # too long for the command line
+        self.fuzzer_stats.stats['executions'] += 1.0
+        if self.command.timed_out or (exc_code and self.is_critical(err_output, exc_code)):
+            return None
+
+        trace_mini = get_trace_mini(string_at(self.trace_bits, SHM_SIZE))
+        if all(self.top_rated[i] is not None for i in trace_mini):
+            return None
+
+        entry_name = "%s%d-%s" % (SYNC_PREFIX, fuzzer_id, name)
+        entry = QueueEntry(entry_name, self.queue_path + "/" + entry_name, True)
+        self.calibrate_test_case(full_input_file_path, entry)
+        self.cur_mutator = SYNC_MUTATOR
+        if not self.save_new_entry(entry, content, "%d/%s" % (fuzzer_id, name)):
+            return None
+        entry.mutator = afl_fuzz.AFLFuzzer(entry.file_name)
+        entry.handicap = cycle_id - 1
+        self.update_bitmap_score(entry)
+        self.scheduler.add_entry(entry)
+        for mutator in self.user_mutators.values():
+            if mutator.queue_new_entry:
+                mutator.queue_new_entry(entry)
+        return entry
+
+    def save_new_entry(self, entry, content, parent):
+        '''
+        Saves a new finding. In the content-addressed layout the entry is named after the hash of its content and
+        recorded in the queue index. Returns False if the same content is already in the queue.
+        '''
+        entry.size = len(content)
+        if self.queue_index is None:
+            self.storage.save(entry.path, content)
+            return True
+
+        blob_hash = content_hash(content)
+        if blob_hash in self.queue_index:
+            return False
+        entry.file_name = blob_hash
+        entry.path = self.queue_index.blob_path(blob_hash)
+        if not os.path.isfile(entry.path):  # otherwise found by another instance or before a restart
+            self.storage.save(entry.path, content)
+        self.queue_index.add(blob_hash, parent, self.cur_mutator, entry.exec_cksum, entry.bitmap_size)
+        return True
+
     def run(self):
         if not self.is_dumb_mode:
             self.dry_run()
@@ -1009,6 +1441,7 @@ class Fuzzer:
         last_stats_saved_time = 0
 
         if self.restore:
+            self.restore_rng()
             INFO(0, bcolors.BOLD + bcolors.OKBLUE, self.log_file, "Session successfully restored")
 
         start_time = timer()
@@ -1019,18 +1452,20 @@ class Fuzzer:
             elapsed = 0
             cycle_id += 1
 
-            for i, file_name in enumerate(self.list_of_files):
-                self.current_file_name = file_name
+            self.cull_queue()
+            self.scheduler.begin_cycle(self.list_of_files)
+            queued_paths = len(self.list_of_files)
+
+            for i, entry in enumerate(self.list_of_files):
+                if not self.is_dumb_mode and skip_entry(entry, self.pending_favored, queued_paths, cycle_id,
+                                                        self.scheduler.avg_exec_us()):
+                    continue
+
+                self.current_entry = entry
+                file_name = entry.file_name
                 crash_found = False
                 self.fuzzer_stats.stats['file_running'] = i
 
-                full_input_file_path = self.input_path + "/"
-                # if we have tuple and not string here it means that this file was found during execution and located in queue
-                if not isinstance(file_name, string_types):
-                    file_name = file_name[1]
-                    full_input_file_path = self.queue_path + "/"
-                full_input_file_path += file_name
-
                 if not self.is_dumb_mode:
                     memset(self.trace_bits, 0x0, SHM_SIZE) # preparing our bitmap for new run
 
@@ -1039,7 +1474,7 @@ class Fuzzer:
 
                 # command to generate new input using one of selected mutators
                 self.gui_state.set_cur_filename(file_name)
-                res = self.mutate_input(file_name, full_input_file_path, full_output_file_path)
+                res = self.mutate_input(entry, full_output_file_path)
 
                 if res != 0:
                     ERROR("Fuzzer %d failed to generate and save new input on disk" % self.fuzzer_id)
@@ -1047,16 +1482,17 @@ class Fuzzer:
                 timer_start = timer()
 
                 if self.target_ip:
-                    data = extract_content(full_output_file_path)
+                    data = self.get_cur_input(full_output_file_path)
                     exc_code, err_output = self.command.net_send_data_to_target(data, self.net_cmd)
                 else:
                     cmd = self.prepare_cmd_to_run(full_output_file_path, False)
                     first_iteration = False
+                    exec_timeout = self.entry_timeout(entry)
                     #INFO(1, None, self.log_file, "Running %s" % cmd)
 
                     if self.cmd_fuzzing:
                         try:
-                            exc_code, err_output = self.command.run(cmd)
+                            exc_code, err_output = self.command.run(cmd, exec_timeout)
                         except OSError as e:
                             if e.errno == 7:
                                 WARNING(self.log_file, "Failed to send this input over command line into the target, input too long")
@@ -1064,32 +1500,50 @@ class Fuzzer:
                             else:
                                 ERROR("Failed to execute command, error:", e)
                     else:
-                        exc_code, err_output = self.command.run(cmd)
+                        exc_code, err_output = self.command.run(cmd, exec_timeout)
 
                 self.fuzzer_stats.stats['executions'] += 1.0
                 elapsed += (timer() - timer_start)
 
+                if not self.target_ip and self.command.timed_out:
+                    # like AFL's hangs: the trace of a killed run is incomplete, so it is neither checked for new
+                    # coverage nor calibrated (which would run the hang again several times)
+                    self.fuzzer_stats.stats['timeouts'] += 1
+                    content = self.get_cur_input(full_output_file_path)
+                    if self.storage.is_new_hang(content):
+                        self.storage.save(self.hangs_path + "/" + self.generate_new_name(file_name), content)
+                    if not self.is_dumb_mode:
+                        entry.mutator.update_eff_map(None, entry.exec_cksum)  # the block is kept, like for crashes
+                    self.update_stats()
+                    continue
+
                 if exc_code and exc_code != 0:
                     #self.fuzzer_stats.stats['exceptions'] += 1
                     #INFO(1, None, self.log_file, "Target raised exception or had nonzero return code (0x%x)" % (exc_code))
 
                     if self.is_critical(err_output, exc_code):
-                        INFO(0, bcolors.BOLD + bcolors.OKGREEN, self.log_file, "New crash found by fuzzer %d" % self.fuzzer_id)
                         self.fuzzer_stats.stats["last_crash_time"] = time.time()
-
-                        new_name = self.generate_new_name(file_name)
-                        shutil.copy(full_output_file_path, self.crashes_path + "/" + new_name)  # copying into crash folder
                         self.fuzzer_stats.stats['crashes'] += 1
 
-                        if not self.is_dumb_mode:
-                            trace_bits_as_str = string_at(self.trace_bits, SHM_SIZE)  # this is how we read memory in Python
-                            ret = self.has_new_bits(trace_bits_as_str, True, list(), self.crash_bits, False, full_output_file_path)
-                            if ret == 2:
-                                INFO(0, bcolors.BOLD + bcolors.OKGREEN, self.log_file, "Crash is unique")
-                                self.fuzzer_stats.stats['unique_crashes'] += 1
-                                shutil.copy(full_output_file_path, self.unique_crashes_path + "/" + new_name)  # copying into crash folder with unique crashes
+                        content = self.get_cur_input(full_output_file_path)
+                        if not self.storage.is_new_crash(content):
+                            INFO(1, None, self.log_file, "Crash with the same content was already saved, skipping")
+                        else:
+                            INFO(0, bcolors.BOLD + bcolors.OKGREEN, self.log_file, "New crash found by fuzzer %d" % self.fuzzer_id)
+                            new_name = self.generate_new_name(file_name)
+                            self.storage.save(self.crashes_path + "/" + new_name, content)
+
+                            if not self.is_dumb_mode:
+                                trace_bits_as_str = string_at(self.trace_bits, SHM_SIZE)  # this is how we read memory in Python
+                                ret = self.has_new_bits(trace_bits_as_str, True, list(), self.crash_bits, False, full_output_file_path)
+                                if ret == 2:
+                                    INFO(0, bcolors.BOLD + bcolors.OKGREEN, self.log_file, "Crash is unique")
+                                    self.fuzzer_stats.stats['unique_crashes'] += 1
+                                    self.storage.save(self.unique_crashes_path + "/" + new_name, content)
 
                         crash_found = True
+                        if not self.is_dumb_mode:
+                            entry.mutator.update_eff_map(None, entry.exec_cksum)
 
                     elif self.is_problem_with_config(exc_code, err_output):
                         WARNING(self.log_file, "Problematic file: %s" % file_name)
@@ -1099,33 +1553,54 @@ class Fuzzer:
 
                     trace_bits_as_str = string_at(self.trace_bits, SHM_SIZE)  # this is how we read memory in Python
                     self.gui_state.set_cur_bitmap(trace_bits_as_str)
+                    trace_cksum = zlib.crc32(trace_bits_as_str) & 0xFFFFFFFF
+                    self.scheduler.update_path_frequency(trace_cksum)
+                    entry.mutator.update_eff_map(trace_cksum, entry.exec_cksum)
+                    if self.auto_dict is not None and self.auto_dict.changed:
+                        self.refresh_dictionary()
                     # we are not ready to update coverage at this stage due to volatile bytes
-                    ret = self.has_new_bits(trace_bits_as_str, False, list(), self.virgin_bits, False, full_output_file_path)
+                    ret = self.has_new_bits(trace_bits_as_str, False, list(), self.virgin_bits, False,
+                                            full_output_file_path, trace_cksum)
                     if ret == 2:
                         INFO(1, None, self.log_file, "Input %s produces new coverage, calibrating" % file_name)
-                        if self.calibrate_test_case(full_output_file_path) == 2:
+                        new_coverage_file_name = self.generate_new_name(file_name)
+                        new_entry = QueueEntry(new_coverage_file_name, self.queue_path + "/" + new_coverage_file_name,
+                                               True)
+                        if self.calibrate_test_case(full_output_file_path, new_entry) == 2:
                             self.fuzzer_stats.stats['new_paths'] += 1
                             self.fuzzer_stats.stats['last_path_time'] = time.time()
                             #INFO(1, None, self.log_file, "Calibration finished successfully. Saving new finding")
                             self.gui_state.set_global_bitmap(self.virgin_bits)
 
-                            new_coverage_file_name = self.generate_new_name(file_name)
-                            INFO(1, None, self.log_file, "Copying %s to %s" % (full_output_file_path,
-                                 self.queue_path + "/" + new_coverage_file_name))
-
-                            shutil.copy(full_output_file_path, self.queue_path + "/" + new_coverage_file_name)
+                            if self.trim_new_entry(new_entry, full_output_file_path):
+                                INFO(1, None, self.log_file, "New finding trimmed by user provided mutator")
 
-                            new_files.append((1, new_coverage_file_name))
-                            # for each new file assign new AFLFuzzer
-                            self.afl_fuzzer[new_coverage_file_name] = afl_fuzz.AFLFuzzer(self.token_dict, self.queue_path,
-                                                                                         new_coverage_file_name, self.gui_state)
-                            self.prev_hashes[new_coverage_file_name] = None
+                            content = self.get_cur_input(full_output_file_path)
+                            if not self.save_new_entry(new_entry, content, file_name):
+                                INFO(1, None, self.log_file, "New finding is already in the queue")
+                            else:
+                                INFO(1, None, self.log_file, "New finding saved to %s" % new_entry.path)
+
+                                # for each new file assign new AFLFuzzer
+                                new_entry.mutator = afl_fuzz.AFLFuzzer(new_entry.file_name)
+                                new_entry.handicap = cycle_id - 1
+                                self.update_bitmap_score(new_entry)
+                                self.scheduler.add_entry(new_entry)
+                                new_files.append(new_entry)
+                                for mutator in self.user_mutators.values():
+                                    if mutator.queue_new_entry:
+                                        mutator.queue_new_entry(new_entry)
 
                 self.update_stats()
 
             self.sync_bitmap()
 
+            if self.sync_interval and self.nfuzzers > 1 and not self.is_dumb_mode and \
+               time.time() - self.last_sync_time >= self.sync_interval:
+                new_files += self.sync_queues(cycle_id)
+
             if len(new_files) > 0:
+                self.storage.flush()  # new entries are read back for splicing
                 self.list_of_files = self.list_of_files + new_files
 
             self.fuzzer_stats.stats['files_in_queue'] = len(self.list_of_files)
@@ -1134,8 +1609,6 @@ class Fuzzer:
 
             end_time = timer() - start_time
             self.fuzzer_stats.stats['exec_per_sec'] = self.fuzzer_stats.stats['executions'] / end_time
-            self.avg_exec_per_sec += int(self.fuzzer_stats.stats['exec_per_sec'] / cycle_id)
-            self.avg_bitmap_size += int(self.bitmap_size / cycle_id)
 
             last_stats_saved_time += elapsed
             if last_stats_saved_time > 1:  # we save fuzzer stats per iteration or once per second to avoid huge stats files
@@ -1159,13 +1632,8 @@ def run_fuzzer_instance(files_list, i, virgin_bits, args, stats_array, restore_s
     fuzzer_instance.run()  # never return
 
 
-def check_instrumentation(target_binary):
-    with open(target_binary, 'rb') as f:
-        s = f.read()
-        res = s.find(b"__AFL_SHM_ID")
-        if res == -1:
-            return False
-    return True
+def check_instrumentation(binary_content):
+    return binary_content.find(b"__AFL_SHM_ID") != -1
 
 
 def which(target_binary):
@@ -1278,8 +1746,13 @@ def split_files_by_count(files_list, threads_count):
 
 
 def get_files_list(path):
-    files_list = [f for f in listdir(path) if isfile(join(path, f))]  # let's process input directory
-    files_list.sort()
+    if is_packed_corpus(path):
+        corpus = PackedCorpus(path)
+        files_list = list(corpus.names)  # sorted when packed
+        corpus.close()
+    else:
+        files_list = [f for f in listdir(path) if isfile(join(path, f))]  # let's process input directory
+        files_list.sort()
 
     if len(files_list) == 0:
         ERROR("No files for fuzzing, exiting")
@@ -1288,10 +1761,13 @@ def get_files_list(path):
 
 
 def check_if_exist(files_list, path):
+    corpus = PackedCorpus(path) if is_packed_corpus(path) else None
     for file_name in files_list:
         if file_name == "":
             ERROR("File list has empty file name")
-        elif isfile(path + "/" + file_name):
+        elif corpus is not None and file_name in corpus:
+            continue
+        elif corpus is None and isfile(path + "/" + file_name):
             continue
         else:
             ERROR("File %s doesn't exist in %s" % (file_name, path))
@@ -1352,7 +1828,7 @@ def parse_args():
                                      description = 'Manul - coverage-guided parallel fuzzing for native applications.',
                                      usage = '%(prog)s -i /home/user/inputs_dir -o /home/user/outputs_dir -n 40 "target -png @@"')
     requiredNamed = parser.add_argument_group('Required parameters')
-    requiredNamed.add_argument('-i', required=True, dest='input', help = "Path to directory with initial corpus")
+    requiredNamed.add_argument('-i', required=True, dest='input', help = "Path to directory with initial corpus or to a packed corpus (see manul_corpus.py)")
     requiredNamed.add_argument('-o', dest='output', required=True, default="manul_output",
                                help = "Path to output directory")
 
@@ -1402,6 +1878,16 @@ def parse_args():
     parser.add_argument("--stop_after_nseconds", default = 0.0, type=int, help = argparse.SUPPRESS)
     parser.add_argument("--forkserver_on", default = False, action = 'store_true', help = argparse.SUPPRESS)
     parser.add_argument("--skip_binary_check", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--power_schedule", default = "explore", help = argparse.SUPPRESS)
+    parser.add_argument("--auto_timeout", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--skip_det_nonfavored", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--async_storage", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--content_addressed_queue", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--sync_interval", default = SYNC_INTERVAL, type=int, help = argparse.SUPPRESS)
+    parser.add_argument("--numpy_rng", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--disable_auto_dict", default = False, action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument("--checkpoint_interval", default = CHECKPOINT_INTERVAL, type=int, help = argparse.SUPPRESS)
+    parser.add_argument("--resume_verify", default = RESUME_VERIFY, type=int, help = argparse.SUPPRESS)
 
     parser.add_argument('target_binary', nargs='*', help="The target binary and options to be executed (quotes needed e.g. \"target -png @@\")")
 
@@ -1428,6 +1914,9 @@ def parse_args():
     if not args.mutator_weights:
         ERROR("At least one mutator should be specified")
 
+    if args.power_schedule not in SCHEDULES:
+        ERROR("Unknown power schedule %s, supported schedules are %s" % (args.power_schedule, ", ".join(SCHEDULES)))
+
     if args.custom_path and not os.path.isdir(args.custom_path):
         ERROR("Custom path provided does not exist or not a directory")
 
@@ -1464,14 +1953,25 @@ if __name__ == "__main__":
     if args.dbi is not None:
         dbi_setup = configure_dbi(args, target_binary, args.debug)
 
+    binary_content = None
     if not args.skip_binary_check:
         check_binary(target_binary)  # check if our binary exists and is actually instrumented
+        with open(which(target_binary), 'rb') as f:
+            binary_content = f.read()
 
-    if not args.simple_mode and args.dbi is None and not args.skip_binary_check and not check_instrumentation(target_binary):
+    if not args.simple_mode and args.dbi is None and binary_content is not None and \
+       not check_instrumentation(binary_content):
         ERROR("Failed to find afl's instrumentation in the target binary, try to recompile or run manul in dumb mode")
 
-    if not os.path.isdir(args.input):
-        ERROR("Input directory doesn't exist")
+    # string constants of the target for the auto dictionary, passed to every fuzzer instance
+    args.binary_tokens = None
+    if binary_content is not None and not args.disable_auto_dict:
+        args.binary_tokens = extract_binary_tokens(binary_content)
+        INFO(1, None, None, "Extracted %d dictionary tokens from the target binary" % len(args.binary_tokens))
+    binary_content = None
+
+    if not os.path.isdir(args.input) and not is_packed_corpus(args.input):
+        ERROR("Input directory or packed corpus doesn't exist")
 
     if not os.path.isdir(args.output):
         ERROR("Output directory doesn't exist")
@@ -0,0 +1,98 @@
+#   Manul - mutation benchmarks
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import sys
+import time
+import argparse
+import tracemalloc
+from afl_fuzz import *
+
+INPUT_SIZE = 64 * 1024
+ROUNDS = 1000
+
+
+# the way block ops were implemented before, every op builds a new buffer out of three slices
+def concat_remove(data):
+    len_to_remove = AFL_choose_block_len(len(data) - 1)
+    pos = RAND(len(data) - len_to_remove + 1)
+    return data[:pos] + data[pos+len_to_remove:], None
+
+
+def concat_clone(data):
+    block, clone_to, clone_len = prepare_block(data)
+    return data[:clone_to] + block + data[clone_to:], None
+
+
+def concat_overwrite(data):
+    block, clone_to, clone_len = prepare_block(data)
+    return data[:clone_to] + block + data[clone_to+clone_len:], None
+
+
+OPS = (
+    ("remove", concat_remove, havoc_remove_randomly_block),
+    ("clone", concat_clone, havoc_clone_randomly_block),
+    ("overwrite", concat_overwrite, havoc_overwrite_randomly_block),
+)
+
+
+def measure(op, size, rounds):
+    data = bytearray(b"A") * size
+    tracemalloc.start()
+    start = time.time()
+    allocated = 0
+    for i in range(rounds):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        data, _ = op(data)
+        # peak over the op shows how much memory it needed on top of the working buffer
+        allocated += tracemalloc.get_traced_memory()[1] - before
+        # keep the buffer close to size so every round works on a 64 KB input
+        if len(data) > size:
+            del data[size:]
+        elif len(data) < size:
+            data.extend(b"A" * (size - len(data)))
+    elapsed = time.time() - start
+    tracemalloc.stop()
+    return allocated / rounds, elapsed * 1000000 / rounds
+
+
+def run_bench(size, rounds):
+    lines = ["%-10s %16s %16s %12s %12s" % ("op", "concat B/op", "in-place B/op", "concat us", "in-place us")]
+    for name, concat_op, inplace_op in OPS:
+        concat_bytes, concat_us = measure(concat_op, size, rounds)
+        inplace_bytes, inplace_us = measure(inplace_op, size, rounds)
+        lines.append("%-10s %16d %16d %12.1f %12.1f" % (name, concat_bytes, inplace_bytes, concat_us, inplace_us))
+    return lines
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="manul_bench.py",
+                                     description="Compare allocations of slice-concat and in-place block mutations")
+    parser.add_argument("--size", default=INPUT_SIZE, type=int, help="Input size in bytes")
+    parser.add_argument("--rounds", default=ROUNDS, type=int, help="Number of mutations per op")
+    parser.add_argument("--output", default=None, help="Also write results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    if sys.version_info[0] < 3:
+        print("tracemalloc is required, please run the benchmark with python3")
+        sys.exit(1)
+    args = parse_args()
+    lines = run_bench(args.size, args.rounds)
+    for line in lines:
+        print(line)
+    if args.output:
+        with open(args.output, "w") as fd:
+            fd.write("\n".join(lines) + "\n")
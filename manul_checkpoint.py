@@ -0,0 +1,300 @@
+#   Manul - session checkpoints
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#   One checkpoint file per fuzzer instance (output/<id>/checkpoint), all integers are little endian:
+#   header      magic, version, flags, number of entries, sizes of the RNG state and RNG pool
+#   RNG state   JSON encoded state of the underlying generator, the pool of words as uint32 and the pool position
+#   entries     name length, stage index, cursor kind (None/int/list), cursor length, name, cursor values as int64
+#   sync        number of other instances, then for each of them: instance id, offset in its queue index, number of
+#               its queue files already looked at, their names (name length as uint16, name)
+#
+#   Calibration results never change, so they are appended once per entry to a separate log (output/<id>/calibration):
+#   header      magic, version
+#   records     name length, file size, trace checksum, execution time in us, bitmap size, number of touched map
+#               positions, name, touched map positions as uint16. The last record of a name wins
+#
+#   Coverage maps are saved next to it (output/<id>/fuzzer_bitmap):
+#   header      magic, version, size of one map, compressed size, CRC32 of the uncompressed maps
+#   maps        zlib compressed virgin map followed by the crash map
+
+import os
+import json
+import zlib
+import struct
+
+CHECKPOINT_MAGIC = b"MNLC"
+CHECKPOINT_VERSION = 4
+CHECKPOINT_NAME = "checkpoint"
+CHECKPOINT_INTERVAL = 10  # seconds between two checkpoints
+RESUME_VERIFY = 4  # inputs executed on resume to check the calibration saved in the checkpoint
+
+BITMAP_MAGIC = b"MNLB"
+BITMAP_VERSION = 1
+BITMAP_NAME = "fuzzer_bitmap"
+
+CALIBRATION_MAGIC = b"MNLK"
+CALIBRATION_VERSION = 1
+CALIBRATION_NAME = "calibration"
+
+FLAG_NUMPY_RNG = 1
+
+HEADER = struct.Struct("<4sHHIIII")  # magic, version, flags, entries, rng json len, pool len, pool pos
+BITMAP_HEADER = struct.Struct("<4sHIII")  # magic, version, map size, compressed size, crc32
+ENTRY = struct.Struct("<HIBB")  # name len, stage, cursor kind, cursor len
+SYNC_HEADER = struct.Struct("<I")  # other instances
+SYNC_SOURCE = struct.Struct("<IQI")  # instance id, queue index offset, names
+NAME_LEN = struct.Struct("<H")
+CALIBRATION_HEADER = struct.Struct("<4sH")  # magic, version
+CALIBRATION_ENTRY = struct.Struct("<HIIIII")  # name len, size, cksum, us, bitmap, trace len
+
+CURSOR_NONE = 0
+CURSOR_INT = 1
+CURSOR_LIST = 2
+
+
+class Checkpoint(object):
+    def __init__(self):
+        self.numpy_rng = False
+        self.rng_state = None  # as returned by FastRandom.getstate()
+        self.entries = dict()  # file name -> (stage index, cursor)
+        self.sync_offsets = dict()  # instance id -> offset of the first unread record of its queue index
+        self.sync_seen = dict()  # instance id -> names of its queue files already looked at
+
+
+def encode_cursor(cursor):
+    if cursor is None:
+        return CURSOR_NONE, ()
+    if isinstance(cursor, list):
+        return CURSOR_LIST, [int(value) for value in cursor]
+    return CURSOR_INT, (int(cursor),)
+
+
+def decode_cursor(kind, values):
+    # booleans of the arithmetic and interesting stages come back as 0/1, the stages only test their truth value
+    if kind == CURSOR_NONE:
+        return None
+    if kind == CURSOR_INT:
+        return values[0]
+    return list(values)
+
+
+def write_atomically(path, content):
+    # a crash in the middle of the write never leaves a broken file behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fd:
+        fd.write(content)
+    if hasattr(os, "replace"):
+        os.replace(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+
+
+def save_checkpoint(path, entries, rng_state, numpy_rng=False, sync_offsets=None, sync_seen=None):
+    # entries is a list of (file name, stage index, cursor), sync_offsets and sync_seen as in Checkpoint
+    generator_state, pool, pool_pos = rng_state
+    rng_json = json.dumps(generator_state).encode("utf-8")
+    chunks = [HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, FLAG_NUMPY_RNG if numpy_rng else 0, len(entries),
+                          len(rng_json), len(pool), pool_pos),
+              rng_json, struct.pack("<%dI" % len(pool), *pool)]
+    for file_name, stage_id, cursor in entries:
+        name = file_name.encode("utf-8")
+        kind, values = encode_cursor(cursor)
+        chunks.append(ENTRY.pack(len(name), stage_id, kind, len(values)))
+        chunks.append(name)
+        chunks.append(struct.pack("<%dq" % len(values), *values))
+
+    sync_offsets = sync_offsets or dict()
+    sync_seen = sync_seen or dict()
+    sources = sorted(set(sync_offsets) | set(sync_seen))
+    chunks.append(SYNC_HEADER.pack(len(sources)))
+    for fuzzer_id in sources:
+        names = sync_seen.get(fuzzer_id, ())
+        chunks.append(SYNC_SOURCE.pack(fuzzer_id, sync_offsets.get(fuzzer_id, 0), len(names)))
+        for name in names:
+            name = name.encode("utf-8")
+            chunks.append(NAME_LEN.pack(len(name)) + name)
+    write_atomically(path, b"".join(chunks))
+
+
+def load_checkpoint(path):
+    # returns None if there is no checkpoint, raises ValueError if it is broken
+    try:
+        with open(path, "rb") as fd:
+            content = fd.read()
+    except (IOError, OSError):
+        return None
+
+    try:
+        magic, version, flags, entries_count, rng_len, pool_len, pool_pos = HEADER.unpack_from(content, 0)
+        if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+            raise ValueError("unsupported checkpoint format")
+        checkpoint = Checkpoint()
+        checkpoint.numpy_rng = bool(flags & FLAG_NUMPY_RNG)
+        offset = HEADER.size
+
+        generator_state = json.loads(content[offset:offset + rng_len].decode("utf-8"))
+        if isinstance(generator_state, list):  # random.Random state is (version, internal state, gauss_next)
+            generator_state = (generator_state[0], tuple(generator_state[1]), generator_state[2])
+        offset += rng_len
+        pool = struct.unpack_from("<%dI" % pool_len, content, offset)
+        offset += 4 * pool_len
+        checkpoint.rng_state = (generator_state, pool, pool_pos)
+
+        for i in range(entries_count):
+            name_len, stage_id, kind, cursor_len = ENTRY.unpack_from(content, offset)
+            offset += ENTRY.size
+            name = content[offset:offset + name_len].decode("utf-8")
+            offset += name_len
+            values = struct.unpack_from("<%dq" % cursor_len, content, offset)
+            offset += 8 * cursor_len
+            checkpoint.entries[name] = (stage_id, decode_cursor(kind, values))
+
+        sources, = SYNC_HEADER.unpack_from(content, offset)
+        offset += SYNC_HEADER.size
+        for i in range(sources):
+            fuzzer_id, index_offset, names_count = SYNC_SOURCE.unpack_from(content, offset)
+            offset += SYNC_SOURCE.size
+            names = set()
+            for j in range(names_count):
+                name_len, = NAME_LEN.unpack_from(content, offset)
+                offset += NAME_LEN.size
+                names.add(content[offset:offset + name_len].decode("utf-8"))
+                offset += name_len
+            checkpoint.sync_offsets[fuzzer_id] = index_offset
+            checkpoint.sync_seen[fuzzer_id] = names
+    except (struct.error, UnicodeDecodeError) as exc:
+        raise ValueError(str(exc))
+    return checkpoint
+
+
+def save_bitmaps(path, virgin_bits, crash_bits):
+    # virgin_bits and crash_bits are sequences of SHM_SIZE byte values
+    maps = bytes(bytearray(virgin_bits)) + bytes(bytearray(crash_bits))
+    compressed = zlib.compress(maps, 1)
+    header = BITMAP_HEADER.pack(BITMAP_MAGIC, BITMAP_VERSION, len(maps) // 2, len(compressed),
+                                zlib.crc32(maps) & 0xFFFFFFFF)
+    write_atomically(path, header + compressed)
+
+
+def load_bitmaps(path):
+    '''
+    Returns (virgin map, crash map) as bytearrays, None if the file is missing or empty (sessions saved before the
+    maps were persisted), raises ValueError if it is broken.
+    '''
+    try:
+        with open(path, "rb") as fd:
+            content = fd.read()
+    except (IOError, OSError):
+        return None
+    if not content:
+        return None
+
+    try:
+        magic, version, map_size, compressed_size, crc = BITMAP_HEADER.unpack_from(content, 0)
+    except struct.error as exc:
+        raise ValueError(str(exc))
+    if magic != BITMAP_MAGIC or version != BITMAP_VERSION:
+        raise ValueError("unsupported bitmap format")
+    try:
+        maps = zlib.decompress(content[BITMAP_HEADER.size:BITMAP_HEADER.size + compressed_size])
+    except zlib.error as exc:
+        raise ValueError(str(exc))
+    if len(maps) != 2 * map_size or zlib.crc32(maps) & 0xFFFFFFFF != crc:
+        raise ValueError("bitmap checksum mismatch")
+    return bytearray(maps[:map_size]), bytearray(maps[map_size:])
+
+
+def load_calibration(path):
+    '''
+    Returns ({file name: (size, exec_cksum, exec_us, bitmap_size, trace_mini)}, size of the complete records), the
+    size is 0 if the log is missing. A record left incomplete by a crash is ignored, raises ValueError if path is
+    not a calibration log.
+    '''
+    try:
+        with open(path, "rb") as fd:
+            content = fd.read()
+    except (IOError, OSError):
+        return dict(), 0
+
+    try:
+        magic, version = CALIBRATION_HEADER.unpack_from(content, 0)
+    except struct.error as exc:
+        raise ValueError(str(exc))
+    if magic != CALIBRATION_MAGIC or version != CALIBRATION_VERSION:
+        raise ValueError("unsupported calibration log format")
+    calibration = dict()
+    offset = CALIBRATION_HEADER.size
+    while offset < len(content):
+        try:
+            name_len, size, exec_cksum, exec_us, bitmap_size, trace_len = \
+                CALIBRATION_ENTRY.unpack_from(content, offset)
+            record_end = offset + CALIBRATION_ENTRY.size + name_len + 2 * trace_len
+            if record_end > len(content):
+                break
+            name_offset = offset + CALIBRATION_ENTRY.size
+            name = content[name_offset:name_offset + name_len].decode("utf-8")
+            trace_mini = struct.unpack_from("<%dH" % trace_len, content, name_offset + name_len)
+        except (struct.error, UnicodeDecodeError):
+            break
+        calibration[name] = (size, exec_cksum, exec_us, bitmap_size, trace_mini)
+        offset = record_end
+    return calibration, offset
+
+
+class CalibrationLog(object):
+    '''
+    Append-only calibration results of one fuzzer instance. Every entry is written once, after it has been
+    calibrated, so periodic checkpoints only have to save the stage cursors. With resume unset an existing log is
+    discarded.
+    '''
+    def __init__(self, path, resume):
+        self.path = path
+        self.entries = dict()  # file name -> calibration as returned by load_calibration
+        size = 0
+        if resume:
+            try:
+                self.entries, size = load_calibration(path)
+            except ValueError:
+                size = 0
+        if size:
+            self.fd = open(path, "r+b")
+            self.fd.truncate(size)
+            self.fd.seek(0, os.SEEK_END)
+        else:
+            self.fd = open(path, "wb")
+            self.fd.write(CALIBRATION_HEADER.pack(CALIBRATION_MAGIC, CALIBRATION_VERSION))
+            self.fd.flush()
+
+    def __contains__(self, file_name):
+        return file_name in self.entries
+
+    def forget(self, file_name=None):
+        # the entry (all entries if file_name is None) is calibrated again and appended again
+        if file_name is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(file_name, None)
+
+    def append(self, file_name, calibration):
+        size, exec_cksum, exec_us, bitmap_size, trace_mini = calibration
+        name = file_name.encode("utf-8")
+        self.fd.write(CALIBRATION_ENTRY.pack(len(name), size, exec_cksum, exec_us, bitmap_size, len(trace_mini)) +
+                      name + struct.pack("<%dH" % len(trace_mini), *trace_mini))
+        self.entries[file_name] = calibration
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
@@ -0,0 +1,155 @@
+#   Manul - packed corpus
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#   A packed corpus is a data file with the contents of all inputs one after another (<name>.pack) and an index next
+#   to it (<name>.pack.idx), little endian:
+#   header   magic, version, number of inputs
+#   inputs   offset in the data file (uint64), length (uint32), name length (uint16), name
+#   The data file is memory-mapped, inputs are read as slices of the mapping without opening a file per input.
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+
+PACK_MAGIC = b"MNLP"
+PACK_VERSION = 1
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+
+INDEX_HEADER = struct.Struct("<4sHI")  # magic, version, inputs
+INDEX_ENTRY = struct.Struct("<QIH")  # offset, length, name length
+
+
+def is_packed_corpus(path):
+    return os.path.isfile(path) and os.path.isfile(path + INDEX_SUFFIX)
+
+
+def pack_directory(directory, pack_path):
+    # packs every file of directory in the order Manul reads them (sorted by name), returns the number of inputs
+    names = sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+    index = [INDEX_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(names))]
+    offset = 0
+    with open(pack_path, "wb") as data_fd:
+        for name in names:
+            with open(os.path.join(directory, name), "rb") as fd:
+                content = fd.read()
+            data_fd.write(content)
+            encoded_name = name.encode("utf-8")
+            index.append(INDEX_ENTRY.pack(offset, len(content), len(encoded_name)) + encoded_name)
+            offset += len(content)
+    with open(pack_path + INDEX_SUFFIX, "wb") as fd:
+        fd.write(b"".join(index))
+    return len(names)
+
+
+def unpack_corpus(pack_path, directory):
+    # writes every input of the packed corpus as a file of directory, returns the number of inputs
+    corpus = PackedCorpus(pack_path)
+    for name in corpus.names:
+        with open(os.path.join(directory, name), "wb") as fd:
+            fd.write(corpus.content(name))
+    corpus.close()
+    return len(corpus.names)
+
+
+class PackedCorpus(object):
+    '''
+    Read-only view of a packed corpus. content() returns a memoryview of the mapping, so reading an input neither opens
+    a file nor copies it. Mappings of the same corpus are shared by all fuzzer instances through the page cache.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.entries = dict()  # name -> (offset, length)
+        self.load_index(path + INDEX_SUFFIX)
+
+        self.fd = open(path, "rb")
+        self.data = b""
+        if os.path.getsize(path):  # empty files can't be mapped
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+
+    def load_index(self, index_path):
+        with open(index_path, "rb") as fd:
+            content = fd.read()
+        try:
+            magic, version, count = INDEX_HEADER.unpack_from(content, 0)
+            if magic != PACK_MAGIC or version != PACK_VERSION:
+                raise ValueError("unsupported packed corpus format")
+            offset = INDEX_HEADER.size
+            for i in range(count):
+                data_offset, length, name_len = INDEX_ENTRY.unpack_from(content, offset)
+                offset += INDEX_ENTRY.size
+                name = content[offset:offset + name_len].decode("utf-8")
+                offset += name_len
+                self.names.append(name)
+                self.entries[name] = (data_offset, length)
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise ValueError(str(exc))
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.names)
+
+    def size(self, name):
+        return self.entries[name][1]
+
+    def content(self, name):
+        offset, length = self.entries[name]
+        return self.view[offset:offset + length]
+
+    def close(self):
+        # slices returned by content() must not be used any more
+        if hasattr(self.view, "release"):
+            self.view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fd.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="manul_corpus.py", description="Convert between corpus directories and "
+                                                                         "packed corpora (manul.py -i <name>.pack)")
+    subparsers = parser.add_subparsers(dest="command")
+    pack = subparsers.add_parser("pack", help="Pack all files of a directory")
+    pack.add_argument("directory")
+    pack.add_argument("pack_path")
+    unpack = subparsers.add_parser("unpack", help="Write all inputs of a packed corpus to a directory")
+    unpack.add_argument("pack_path")
+    unpack.add_argument("directory")
+    listing = subparsers.add_parser("list", help="Print names and sizes of the inputs of a packed corpus")
+    listing.add_argument("pack_path")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "pack":
+        print("Packed %d inputs into %s" % (pack_directory(args.directory, args.pack_path), args.pack_path))
+    elif args.command == "unpack":
+        if not os.path.isdir(args.directory):
+            os.mkdir(args.directory)
+        print("Unpacked %d inputs into %s" % (unpack_corpus(args.pack_path, args.directory), args.directory))
+    elif args.command == "list":
+        corpus = PackedCorpus(args.pack_path)
+        for name in corpus.names:
+            print("%10d %s" % (corpus.size(name), name))
+        corpus.close()
+    else:
+        print("Specify pack, unpack or list, see --help")
+        sys.exit(1)
@@ -0,0 +1,160 @@
+#   Manul - automatic dictionary
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import re
+import struct
+from helper import interesting_32_Bit, RAND
+
+MIN_AUTO_EXTRA = 3  # same limits as AFL
+MAX_AUTO_EXTRA = 32
+MAX_AUTO_EXTRAS = 500  # candidates remembered by the auto dictionary
+USE_AUTO_EXTRAS = 50  # auto tokens used by the dictionary stages, free slots go to the most frequent candidates
+MIN_AUTO_HITS = 2  # candidates seen only once are mostly noise, they have to show up again before they are used
+MAX_BINARY_TOKENS = 50  # string constants taken from the target binary
+
+ELF_STRING_SECTIONS = (b".rodata", b".data")
+STRING_RE = re.compile(b"[\x20-\x7e]{%d,}" % MIN_AUTO_EXTRA)
+
+
+def elf_sections(content, names):
+    # returns contents of the named sections, empty list if content is not an ELF file
+    if content[:4] != b"\x7fELF":
+        return []
+    endian = "<" if content[5:6] == b"\x01" else ">"
+    try:
+        if content[4:5] == b"\x02":
+            shoff, = struct.unpack_from(endian + "Q", content, 0x28)
+            shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", content, 0x3A)
+            header = endian + "IIQQQQ"
+        else:
+            shoff, = struct.unpack_from(endian + "I", content, 0x20)
+            shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", content, 0x2E)
+            header = endian + "IIIIII"
+        headers = [struct.unpack_from(header, content, shoff + i * shentsize) for i in range(shnum)]
+        strtab_offset, strtab_size = headers[shstrndx][4:6]
+        strtab = content[strtab_offset:strtab_offset + strtab_size]
+    except (struct.error, IndexError):
+        return []
+
+    sections = []
+    for name_offset, section_type, flags, addr, offset, size in headers:
+        name = strtab[name_offset:strtab.find(b"\x00", name_offset)]
+        if name in names and section_type != 8:  # SHT_NOBITS has no content in the file
+            sections.append(content[offset:offset + size])
+    return sections
+
+
+def extract_binary_tokens(content, limit=MAX_BINARY_TOKENS):
+    '''
+    Printable string constants of the target binary. Only .rodata and .data are scanned for ELF files, the whole file
+    otherwise. Short strings without spaces (keywords, magic values) are ranked first.
+    '''
+    sections = elf_sections(content, ELF_STRING_SECTIONS) or [content]
+    tokens = []
+    seen = set()
+    for section in sections:
+        for match in STRING_RE.finditer(section):
+            token = match.group().strip()
+            if not MIN_AUTO_EXTRA <= len(token) <= MAX_AUTO_EXTRA or token in seen:
+                continue
+            seen.add(token)
+            tokens.append(token)
+    tokens.sort(key=lambda token: (b" " in token, b"%" in token, len(token)))
+    return [bytearray(token) for token in tokens[:limit]]
+
+
+def is_useless_token(token):
+    # same checks as AFL's maybe_add_auto: runs of the same byte and interesting values are tried anyway
+    if token.count(token[0]) == len(token):
+        return True
+    if len(token) == 4:
+        value = struct.unpack("<I", bytes(token))[0]
+        if value in interesting_32_Bit or struct.unpack(">I", bytes(token))[0] in interesting_32_Bit:
+            return True
+    return False
+
+
+class AutoDictionary(object):
+    '''
+    AFL's auto-extras. During byteflip_1 consecutive bytes which all change the path of the input in the same way are
+    likely compared against a constant (magic value, keyword), so they are collected as a dictionary token.
+    '''
+    def __init__(self, user_tokens, binary_tokens=None):
+        self.user_tokens = [bytearray(token) for token in user_tokens]
+        self.binary_tokens = []
+        known = set(bytes(token).lower() for token in self.user_tokens)
+        for token in binary_tokens or []:
+            if bytes(token).lower() not in known:
+                known.add(bytes(token).lower())
+                self.binary_tokens.append(bytearray(token))
+        self.known = known
+        self.hits = dict()  # auto token not in use yet -> number of times it was seen
+        self.auto_tokens = []  # auto tokens in use, in the order they were admitted
+        self.changed = False  # True if a new token has been added since the last call of tokens()
+        self.collected = bytearray()
+        self.prev_cksum = None
+
+    def maybe_add(self, token):
+        token = bytes(token)
+        if is_useless_token(token) or token.lower() in self.known:
+            return
+        if token in self.hits:
+            self.hits[token] += 1
+            if self.hits[token] == MIN_AUTO_HITS and len(self.auto_tokens) < USE_AUTO_EXTRAS:
+                self.changed = True
+            return
+        if len(self.hits) >= MAX_AUTO_EXTRAS:
+            # replace a random token from the less frequent half, like AFL does
+            ranked = sorted(self.hits, key=self.hits.get, reverse=True)
+            del self.hits[ranked[MAX_AUTO_EXTRAS // 2 + RAND(MAX_AUTO_EXTRAS - MAX_AUTO_EXTRAS // 2)]]
+        self.hits[token] = 1
+
+    def start(self):
+        # called before byteflip_1 starts on a new input
+        self.collected = bytearray()
+        self.prev_cksum = None
+
+    def feed(self, byte, cksum, orig_cksum, last):
+        '''
+        Result of flipping one byte during byteflip_1: the original byte, the trace checksum after the flip (None if
+        the target crashed), the checksum of the input and whether it was the last byte of the input.
+        '''
+        if last and cksum == self.prev_cksum:
+            if len(self.collected) < MAX_AUTO_EXTRA:
+                self.collected.append(byte)
+            if MIN_AUTO_EXTRA <= len(self.collected) <= MAX_AUTO_EXTRA:
+                self.maybe_add(self.collected)
+        elif cksum != self.prev_cksum:
+            if MIN_AUTO_EXTRA <= len(self.collected) <= MAX_AUTO_EXTRA:
+                self.maybe_add(self.collected)
+            self.collected = bytearray()
+            self.prev_cksum = cksum
+
+        if cksum is not None and cksum != orig_cksum and len(self.collected) <= MAX_AUTO_EXTRA:
+            self.collected.append(byte)
+
+    def tokens(self):
+        '''
+        User tokens first, then the binary ones and the auto tokens. Free slots are given to the most frequent new
+        auto tokens seen at least MIN_AUTO_HITS times, tokens already in use keep their place, so a dictionary stage
+        resumed on a refreshed list neither skips nor repeats tokens.
+        '''
+        self.changed = False
+        free = USE_AUTO_EXTRAS - len(self.auto_tokens)
+        ready = [token for token in self.hits if self.hits[token] >= MIN_AUTO_HITS]
+        for token in sorted(ready, key=self.hits.get, reverse=True)[:max(0, free)]:
+            del self.hits[token]
+            self.known.add(token.lower())
+            self.auto_tokens.append(bytearray(token))
+        return self.user_tokens + self.binary_tokens + self.auto_tokens
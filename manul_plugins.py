@@ -0,0 +1,55 @@
+#   Manul - user mutators
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#   Two plugin interfaces are supported:
+#   v1: init() and mutate(data), one new input per call (see example_mutator.py)
+#   v2: mutate_batch(seed, n) returns a list of up to n new inputs generated from the seed input, optional hooks
+#       are init(seed) with a random seed for the plugin, queue_new_entry(entry) called for every new queue entry
+#       and trim(data) returning a smaller input with the same coverage (see example_batch_mutator.py)
+
+import importlib
+from printing import ERROR
+
+PLUGIN_BATCH = 16  # inputs requested from a v2 plugin per call
+
+
+class UserMutator(object):
+    def __init__(self, name, module, seed):
+        self.name = name
+        self.module = module
+        self.batch = hasattr(module, "mutate_batch")
+        init = getattr(module, "init", None)
+        if self.batch:
+            if init:
+                init(seed)
+        elif init and hasattr(module, "mutate"):
+            init()
+        else:
+            ERROR("User provided mutator %s should define init() and mutate(data) or mutate_batch(seed, n)" % name)
+        self.queue_new_entry = getattr(module, "queue_new_entry", None)
+        self.trim = getattr(module, "trim", None)
+
+    def mutate(self, data):
+        return self.module.mutate(data)
+
+    def mutate_batch(self, data, count=PLUGIN_BATCH):
+        return self.module.mutate_batch(data, count)
+
+
+def load_user_mutator(module_name, seed):
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as exc:
+        ERROR("Unable to load user provided mutator %s. %s" % (module_name, exc))
+    return UserMutator(module_name, module, seed)
@@ -0,0 +1,187 @@
+#   Manul - queue entries
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import zlib
+from helper import RAND
+from manul_utils import extract_content
+
+# probabilities (in percent) to skip entries while there are more interesting ones in the queue (see AFL's fuzz_one)
+SKIP_TO_NEW_PROB = 99
+SKIP_NFAV_OLD_PROB = 95
+SKIP_NFAV_NEW_PROB = 75
+# entries running SLOW_ENTRY_MULT times slower than the average are skipped most of the time unless favored
+SLOW_ENTRY_MULT = 10
+SKIP_SLOW_PROB = 90
+# outputs generated in advance by one batch mutator and kept for the next turns of their entries, whole queue
+PENDING_OUTPUTS_BUDGET = 1024
+
+
+class QueueEntry(object):
+    '''
+    One input in the fuzzer's queue (initial seed or a new finding). Paths are resolved once when the entry is
+    created so the hot loop never has to check where a file lives or rebuild its path.
+    '''
+    __slots__ = ('file_name', 'path', 'in_queue', 'size', 'exec_cksum', 'last_cksum', 'exec_us', 'bitmap_size',
+                 'trace_mini', 'favored', 'was_fuzzed', 'mutator', 'tc_ref', 'fuzz_level', 'handicap',
+                 'pending_outputs', 'packed')
+
+    def __init__(self, file_name, path, in_queue, packed=None):
+        self.file_name = file_name
+        self.path = path
+        self.packed = packed  # PackedCorpus holding the content, None if the entry is a file
+        self.in_queue = in_queue  # False for initial seeds, True for files found during fuzzing
+        self.size = 0
+        self.exec_cksum = None  # checksum of the trace bitmap produced by this entry
+        self.last_cksum = None  # checksum of the last trace produced by a mutation of this entry
+        self.exec_us = 0  # execution time in microseconds
+        self.bitmap_size = 0  # number of bytes set in the trace bitmap
+        self.trace_mini = ()  # map positions touched by this entry
+        self.favored = False
+        self.was_fuzzed = False
+        self.mutator = None  # AFL mutation progress for this entry
+        self.tc_ref = 0  # number of map positions this entry is the winner for
+        self.fuzz_level = 0  # number of havoc rounds assigned to this entry
+        self.handicap = 0  # number of queue cycles missed by this entry
+        # outputs generated in advance for this entry by batch mutators, per mutator (see pending_batch_size)
+        self.pending_outputs = {}
+
+    def __repr__(self):
+        return "QueueEntry(%s)" % self.path
+
+    def update_size(self):
+        if self.packed is not None:
+            self.size = self.packed.size(self.file_name)
+        else:
+            self.size = os.path.getsize(self.path)
+
+    def read(self):
+        # content as a new bytearray, free to be mutated
+        if self.packed is not None:
+            return bytearray(self.packed.content(self.file_name))
+        return extract_content(self.path)
+
+    def view(self):
+        # read-only content, a slice of the mapping for packed entries
+        if self.packed is not None:
+            return self.packed.content(self.file_name)
+        return bytes(extract_content(self.path))
+
+    def fav_factor(self):
+        return self.exec_us * self.size
+
+
+class CorpusIndex(object):
+    '''
+    Contents of the queue kept in memory for splicing. Queue files never change once written, so every file is read
+    only once, together with its length and checksum. list_of_files only grows, update() indexes new entries.
+    '''
+    def __init__(self):
+        self.contents = []
+        self.crcs = []
+        self.eligible = []  # indices of entries long enough to splice with
+        self.indexed = 0
+
+    def __len__(self):
+        return len(self.contents)
+
+    def update(self, list_of_files):
+        for entry in list_of_files[self.indexed:]:
+            content = entry.view()
+            if len(content) >= 2:
+                self.eligible.append(len(self.contents))
+            self.contents.append(content)
+            self.crcs.append(zlib.crc32(content))
+        self.indexed = len(list_of_files)
+
+    def sample(self):
+        # random index of an eligible entry, None if the queue has nothing to splice with
+        if not self.eligible:
+            return None
+        return self.eligible[RAND(len(self.eligible))]
+
+
+def pending_batch_size(batch, queue_len):
+    '''
+    Number of outputs a batch mutator should generate for one entry. Every entry gets one mutation per turn and the
+    rest of a batch waits for its next turns, so batches shrink as the queue grows and the whole queue never keeps
+    much more than PENDING_OUTPUTS_BUDGET outputs per mutator.
+    '''
+    return max(1, min(batch, PENDING_OUTPUTS_BUDGET // max(1, queue_len)))
+
+
+def get_trace_mini(trace_bits_as_str):
+    return tuple(i for i, trace_byte in enumerate(bytearray(trace_bits_as_str)) if trace_byte)
+
+
+def update_bitmap_score(top_rated, entry):
+    '''
+    Check if entry is the new winner (the fastest and smallest entry) for any map position it touches.
+    Returns True if top_rated has been changed.
+    '''
+    fav_factor = entry.fav_factor()
+    score_changed = False
+    for i in entry.trace_mini:
+        top = top_rated[i]
+        if top is not None:
+            if fav_factor >= top.fav_factor():
+                continue
+            top.tc_ref -= 1
+        top_rated[i] = entry
+        entry.tc_ref += 1
+        score_changed = True
+    return score_changed
+
+
+def cull_queue(top_rated, list_of_files):
+    '''
+    Mark a minimal set of entries that still covers every position seen so far as favored. Walks over top_rated and
+    picks the winner for every position not covered by previously picked entries. Returns number of favored entries
+    which were not fuzzed yet.
+    '''
+    for entry in list_of_files:
+        entry.favored = False
+
+    pending_favored = 0
+    temp_v = bytearray(b"\x01") * len(top_rated)
+    for i, top in enumerate(top_rated):
+        if top is None or not temp_v[i]:
+            continue
+        for j in top.trace_mini:
+            temp_v[j] = 0
+        top.favored = True
+        if not top.was_fuzzed:
+            pending_favored += 1
+    return pending_favored
+
+
+def skip_entry(entry, pending_favored, queued_paths, queue_cycle, avg_exec_us):
+    '''
+    Decide if we should skip entry in this queue cycle. While there are favored entries which are not fuzzed yet
+    we spend almost all the time on them, otherwise non-favored entries are only picked from time to time.
+    Very slow entries are picked rarely as well, each execution costs as much as many executions of other entries.
+    '''
+    if not entry.favored and avg_exec_us and entry.exec_us > avg_exec_us * SLOW_ENTRY_MULT:
+        if RAND(100) < SKIP_SLOW_PROB:
+            return True
+    if pending_favored:
+        if (entry.was_fuzzed or not entry.favored) and RAND(100) < SKIP_TO_NEW_PROB:
+            return True
+    elif not entry.favored and queued_paths > 10:
+        if queue_cycle > 1 and not entry.was_fuzzed:
+            if RAND(100) < SKIP_NFAV_NEW_PROB:
+                return True
+        elif RAND(100) < SKIP_NFAV_OLD_PROB:
+            return True
+    return False
@@ -0,0 +1,118 @@
+#   Manul - power schedules
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from array import array
+from afl_fuzz import calculate_perf_score
+from helper import AFL_HAVOC_MAX_MULT
+
+# explore is plain AFL, the others are AFLFast schedules
+SCHEDULES = ("explore", "fast", "coe", "rare")
+
+N_FUZZ_SIZE = 1 << 20  # number of buckets used to count how often every path is exercised
+POWER_MAX_FACTOR = 32  # upper bound for the energy multiplier
+POWER_MAX_FUZZ_LEVEL = 16  # energy stops doubling after this many havoc rounds
+
+
+def next_pow2(value):
+    ret = 1
+    while ret < value:
+        ret <<= 1
+    return ret
+
+
+class PowerScheduler(object):
+    '''
+    Assigns havoc energy (perf_score) to queue entries. Every execution is counted in the bucket of its trace
+    checksum, so paths which are exercised all the time get less energy and rarely seen paths get more.
+    '''
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.n_fuzz = array('I', [0]) * N_FUZZ_SIZE
+        self.total_execs = 0
+        # running totals over calibrated entries (AFL's total_cal_us and total_bitmap_size)
+        self.total_exec_us = 0
+        self.total_bitmap_size = 0
+        self.total_entries = 0
+        self.fuzz_mu = 0.0
+
+    def update_path_frequency(self, cksum):
+        idx = cksum % N_FUZZ_SIZE
+        if self.n_fuzz[idx] < 0xFFFFFFFF:
+            self.n_fuzz[idx] += 1
+        self.total_execs += 1
+
+    def path_frequency(self, entry):
+        if entry.exec_cksum is None:
+            return 0
+        return self.n_fuzz[entry.exec_cksum % N_FUZZ_SIZE]
+
+    def add_entry(self, entry):
+        self.total_exec_us += entry.exec_us
+        self.total_bitmap_size += entry.bitmap_size
+        self.total_entries += 1
+
+    def avg_exec_us(self):
+        if not self.total_entries:
+            return 0
+        return self.total_exec_us / float(self.total_entries)
+
+    def avg_bitmap_size(self):
+        if not self.total_entries:
+            return 0
+        return self.total_bitmap_size / float(self.total_entries)
+
+    def begin_cycle(self, list_of_files):
+        # coe compares every entry with the average path frequency in the queue, compute it once per queue cycle
+        if self.schedule != "coe" or not list_of_files:
+            return
+        fuzz_total = 0
+        for entry in list_of_files:
+            fuzz_total += self.path_frequency(entry)
+        self.fuzz_mu = fuzz_total / float(len(list_of_files))
+
+    def calculate_score(self, entry):
+        '''
+        Energy for the next havoc round of entry. Called once per round, consumes the entry's handicap and bumps
+        its fuzz_level.
+        '''
+        perf_score = calculate_perf_score(entry.exec_us, self.avg_exec_us(), entry.bitmap_size,
+                                          self.avg_bitmap_size(), entry.handicap)
+        if entry.handicap > 4:
+            entry.handicap -= 4
+        elif entry.handicap:
+            entry.handicap -= 1
+
+        fuzz = self.path_frequency(entry)
+        fuzz_level = entry.fuzz_level
+        entry.fuzz_level += 1
+
+        factor = 1
+        if self.schedule == "fast":
+            if fuzz_level < POWER_MAX_FUZZ_LEVEL:
+                factor = (1 << fuzz_level) / float(fuzz or 1)
+            else:
+                factor = POWER_MAX_FACTOR / float(next_pow2(fuzz))
+        elif self.schedule == "coe":
+            if fuzz <= self.fuzz_mu:
+                factor = 1 << fuzz_level if fuzz_level < POWER_MAX_FUZZ_LEVEL else POWER_MAX_FACTOR
+            else:
+                factor = 0
+        elif self.schedule == "rare":
+            perf_score += entry.tc_ref * 10
+            if self.total_execs:
+                perf_score *= 1 - fuzz / float(self.total_execs)
+
+        perf_score *= min(factor, POWER_MAX_FACTOR)
+
+        return min(perf_score, AFL_HAVOC_MAX_MULT * 100)
@@ -0,0 +1,174 @@
+#   Manul - stats log
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+#   Append-only stats log, one per fuzzer instance (output/<id>/fuzzer_stats.bin), little endian:
+#   header   magic, version, number of columns, length of the column names, column names separated by \0
+#   records  timestamp and one value per column, all float64, so record k is at header size + k * record size
+
+import os
+import sys
+import struct
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STATS_LOG_MAGIC = b"MNLS"
+STATS_LOG_VERSION = 1
+STATS_LOG_NAME = "fuzzer_stats.bin"
+
+HEADER = struct.Struct("<4sHHI")  # magic, version, columns, names length
+
+
+def record_struct(columns):
+    return struct.Struct("<%dd" % (columns + 1))
+
+
+def read_header(fd):
+    # returns (column names, header size), raises ValueError if fd is not a stats log
+    header = fd.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError("truncated stats log header")
+    magic, version, columns, names_len = HEADER.unpack(header)
+    if magic != STATS_LOG_MAGIC or version != STATS_LOG_VERSION:
+        raise ValueError("unsupported stats log format")
+    names = fd.read(names_len).decode("utf-8").split("\0")
+    if len(names) != columns:
+        raise ValueError("broken stats log header")
+    return names, HEADER.size + names_len
+
+
+class StatsLog(object):
+    '''
+    Writer of the stats log. An existing log is appended to if it has the same columns, otherwise it is moved aside
+    to <path>.old. A record left incomplete by a crash is dropped.
+    '''
+    def __init__(self, path, names):
+        self.path = path
+        self.names = list(names)
+        self.record = record_struct(len(self.names))
+        self.fd = None
+        self.open()
+
+    def open(self):
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "rb") as fd:
+                    names, header_size = read_header(fd)
+            except ValueError:
+                names, header_size = None, 0
+            if names == self.names:
+                size = os.path.getsize(self.path)
+                self.fd = open(self.path, "r+b")
+                self.fd.truncate(size - (size - header_size) % self.record.size)
+                self.fd.seek(0, os.SEEK_END)
+                return
+            os.rename(self.path, self.path + ".old")
+
+        self.fd = open(self.path, "wb")
+        names = "\0".join(self.names).encode("utf-8")
+        self.fd.write(HEADER.pack(STATS_LOG_MAGIC, STATS_LOG_VERSION, len(self.names), len(names)) + names)
+        self.fd.flush()
+
+    def append(self, timestamp, values):
+        self.fd.write(self.record.pack(timestamp, *values))
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+
+def read_last_record(path):
+    '''
+    Returns (timestamp, {column: value}) of the last complete record, None if the log is missing or empty. Only the
+    header and the last record are read.
+    '''
+    try:
+        fd = open(path, "rb")
+    except (IOError, OSError):
+        return None
+    with fd:
+        names, header_size = read_header(fd)
+        record = record_struct(len(names))
+        count = (os.path.getsize(path) - header_size) // record.size
+        if count <= 0:
+            return None
+        fd.seek(header_size + (count - 1) * record.size)
+        values = record.unpack(fd.read(record.size))
+    return values[0], dict(zip(names, values[1:]))
+
+
+def load_stats_log(path):
+    '''
+    Loads the whole time series of one fuzzer instance, returns {"time": array, column: array, ...}. Columns are NumPy
+    arrays if numpy is installed, lists otherwise.
+    '''
+    with open(path, "rb") as fd:
+        names, header_size = read_header(fd)
+        content = fd.read()
+    record = record_struct(len(names))
+    count = len(content) // record.size
+    content = content[:count * record.size]
+
+    if numpy is not None:
+        table = numpy.frombuffer(content, dtype="<f8").reshape(count, len(names) + 1)
+        columns = [table[:, i] for i in range(len(names) + 1)]
+    else:
+        rows = [record.unpack_from(content, i * record.size) for i in range(count)]
+        columns = [[row[i] for row in rows] for i in range(len(names) + 1)]
+    return dict(zip(["time"] + names, columns))
+
+
+def load_campaign(output_path):
+    # time series of every fuzzer instance in a Manul output directory, {fuzzer id: columns}
+    campaign = dict()
+    for name in os.listdir(output_path):
+        path = os.path.join(output_path, name, STATS_LOG_NAME)
+        if name.isdigit() and os.path.isfile(path):
+            campaign[int(name)] = load_stats_log(path)
+    return campaign
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="manul_stats.py", description="Print or export Manul stats logs")
+    parser.add_argument("output", help="Manul output directory")
+    parser.add_argument("--csv", default=None, help="Write all records of all fuzzer instances to this CSV file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    campaign = load_campaign(args.output)
+    if not campaign:
+        print("No stats logs found in %s" % args.output)
+        sys.exit(1)
+
+    for fuzzer_id in sorted(campaign):
+        columns = campaign[fuzzer_id]
+        records = len(columns["time"])
+        print("Fuzzer %d: %d records" % (fuzzer_id, records))
+        if records:
+            for name in columns:
+                print("  %-20s %.2f" % (name, columns[name][-1]))
+
+    if args.csv:
+        with open(args.csv, "w") as fd:
+            names = list(campaign[min(campaign)])
+            fd.write("fuzzer," + ",".join(names) + "\n")
+            for fuzzer_id in sorted(campaign):
+                columns = campaign[fuzzer_id]
+                for i in range(len(columns["time"])):
+                    fd.write("%d," % fuzzer_id + ",".join("%.2f" % columns[name][i] for name in names) + "\n")
@@ -0,0 +1,230 @@
+#   Manul - crash and queue storage
+#   -------------------------------------
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at:
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import json
+import hashlib
+import itertools
+import threading
+import time
+from printing import WARNING
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+FSYNC_BATCH = 32  # files written by the background writer between two fsync rounds
+
+BLOBS_DIR = "queue_blobs"  # content-addressed queue shared by all instances (output/queue_blobs/<sha1>)
+QUEUE_INDEX_NAME = "queue_index"  # queue of one instance in content-addressed layout (output/<id>/queue_index)
+
+
+SYNC_INTERVAL = 30  # seconds between two imports of the entries found by the other instances
+SYNC_PREFIX = "sync-"  # entries imported from another instance are named sync-<instance id>-<original name>
+SYNC_MUTATOR = "sync"  # mutator of imported entries in the queue index
+
+
+def content_hash(content):
+    return hashlib.sha1(bytes(content)).hexdigest()
+
+
+temp_ids = itertools.count()
+
+
+def temp_path(path):
+    '''
+    Files are written under a hidden name first, other instances scanning the directory never see partial files.
+    Every write gets its own name, instances saving the same blob at the same time don't share a temporary file.
+    '''
+    head, tail = os.path.split(path)
+    return os.path.join(head, ".%s.%d-%d.tmp" % (tail, os.getpid(), next(temp_ids)))
+
+
+def rename(src, dst):
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def publish(tmp_path, path):
+    # moves a written file to its real name. If it fails because another instance has saved the same blob in the
+    # meantime, the content is the same and the file is already in place
+    try:
+        rename(tmp_path, path)
+    except OSError:
+        if not os.path.isfile(path):
+            raise
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def read_index_records(path, offset=0):
+    '''
+    Reads the complete records of a queue index starting at offset, returns a list of (record, offset after the
+    record). A record which is still being written is left for the next call.
+    '''
+    try:
+        fd = open(path, "rb")
+    except (IOError, OSError):
+        return []
+    with fd:
+        fd.seek(offset)
+        content = fd.read()
+    records = []
+    for line in content.split(b"\n")[:-1]:
+        offset += len(line) + 1
+        try:
+            records.append((json.loads(line.decode("utf-8")), offset))
+        except ValueError:
+            continue  # incomplete record left by a crash
+    return records
+
+
+class Storage(object):
+    '''
+    Saves new queue entries, crashes and hangs straight from memory, so inputs don't have to be read back from
+    .cur_input. Crashes and hangs are deduplicated by content hash. With background set, files are written by a separate thread and
+    fsync'ed in batches, flush() waits until everything saved so far is on disk.
+    '''
+    def __init__(self, background=False):
+        self.crash_hashes = set()
+        self.hang_hashes = set()
+        self.pending = None
+        self.unsynced = []  # (file, temporary path, path) written by the background writer and not fsync'ed yet
+        if background:
+            self.pending = queue.Queue()
+            writer = threading.Thread(target=self.write_loop)
+            writer.daemon = True
+            writer.start()
+
+    def index_crashes(self, crashes_path, hangs_path):
+        # crashes and hangs saved before a restart are not saved again
+        for directory, hashes in ((crashes_path, self.crash_hashes), (hangs_path, self.hang_hashes)):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as fd:
+                        hashes.add(hashlib.sha1(fd.read()).digest())
+
+    def is_new_crash(self, content):
+        return self.is_new_content(content, self.crash_hashes)
+
+    def is_new_hang(self, content):
+        return self.is_new_content(content, self.hang_hashes)
+
+    def is_new_content(self, content, hashes):
+        digest = hashlib.sha1(bytes(content)).digest()
+        if digest in hashes:
+            return False
+        hashes.add(digest)
+        return True
+
+    def save(self, path, content):
+        # content is copied, the caller is free to reuse its buffer
+        content = bytes(content)
+        if self.pending is None:
+            tmp_path = temp_path(path)
+            with open(tmp_path, "wb") as fd:
+                fd.write(content)
+            publish(tmp_path, path)
+        else:
+            self.pending.put((path, content))
+
+    def flush(self):
+        if self.pending is not None:
+            self.pending.join()
+
+    def write_loop(self):
+        while True:
+            path, content = self.pending.get()
+            try:
+                self.write(path, content)
+                if len(self.unsynced) >= FSYNC_BATCH or self.pending.empty():
+                    self.sync()
+            except Exception as exc:  # the writer must survive anything, flush() waits for it
+                WARNING(None, "Failed to save %s (%s)" % (path, exc))
+            finally:
+                self.pending.task_done()
+
+    def write(self, path, content):
+        tmp_path = temp_path(path)
+        fd = open(tmp_path, "wb")
+        try:
+            fd.write(content)
+            fd.flush()
+        except (IOError, OSError):
+            fd.close()
+            os.remove(tmp_path)
+            raise
+        self.unsynced.append((fd, tmp_path, path))
+
+    def sync(self):
+        # files appear under their real names only once their content is on disk. Every file is taken off the list
+        # before it is handled, a failure only loses that file
+        while self.unsynced:
+            fd, tmp_path, path = self.unsynced.pop(0)
+            try:
+                os.fsync(fd.fileno())
+                fd.close()
+                publish(tmp_path, path)
+            except (IOError, OSError, ValueError) as exc:
+                fd.close()
+                if os.path.isfile(tmp_path):
+                    os.remove(tmp_path)
+                WARNING(None, "Failed to save %s (%s)" % (path, exc))
+
+
+class QueueIndex(object):
+    '''
+    Metadata of the queue entries of one instance in the content-addressed layout, one JSON record per line: hash of
+    the content (the blob name), parent entry, mutator, time, trace checksum and bitmap size. Blobs live in a store
+    shared by all instances and restored sessions, identical inputs are saved only once.
+    '''
+    def __init__(self, path, blobs_path):
+        self.path = path
+        self.blobs_path = blobs_path
+        self.records = []
+        self.hashes = set()
+        complete = self.load()
+        self.fd = open(self.path, "a")
+        if not complete:
+            self.fd.write("\n")  # don't glue the next record to the incomplete one
+
+    def load(self):
+        # returns False if the last record is incomplete
+        offset = 0
+        for record, offset in read_index_records(self.path):
+            if record["hash"] not in self.hashes:
+                self.hashes.add(record["hash"])
+                self.records.append(record)
+        return not os.path.isfile(self.path) or os.path.getsize(self.path) == offset
+
+    def blob_path(self, blob_hash):
+        return self.blobs_path + "/" + blob_hash
+
+    def __contains__(self, blob_hash):
+        return blob_hash in self.hashes
+
+    def add(self, blob_hash, parent, mutator, exec_cksum, bitmap_size):
+        record = {"hash": blob_hash, "parent": parent, "mutator": mutator, "time": int(time.time()),
+                  "cksum": exec_cksum, "bitmap_size": bitmap_size}
+        self.hashes.add(blob_hash)
+        self.records.append(record)
+        self.fd.write(json.dumps(record, sort_keys=True) + "\n")
+        self.fd.flush()
+        return record
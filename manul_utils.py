@@ -59,6 +59,8 @@ class FuzzerStats:
         self.stats["files_in_queue"] = 0.0
         self.stats["file_running"] = 0.0
         self.stats["exec_per_sec"] = 0.0
+        self.stats["timeouts"] = 0.0
+        self.stats["redundant_skipped"] = 0.0
     def get_len(self):
         return len(self.stats)
 
@@ -222,6 +224,7 @@ def save_content_lin(data, output_file_path):
     if not fd:
         printing.ERROR("Failed to open output file, aborting")
     fd.write(data)
+    fd.truncate()  # drop the tail of a longer previous input
     fd.flush()
     #fd.close()
     return 1
@@ -253,14 +256,71 @@ def is_bytearrays_equal(data1, data2):
         return False
     return True
 
+def count_bytes(trace_bits_as_str):
+    # number of non-zero bytes in the trace bitmap
+    return len(trace_bits_as_str) - trace_bits_as_str.count(b"\x00")
+
+def build_alias_table(weights):
+    '''
+    Walker's alias table for integer weights, all the math is done in integers so the probabilities are exact.
+    Entry i is kept with probability prob[i] / total, otherwise alias[i] is used (see alias_draw).
+    '''
+    count = len(weights)
+    total = sum(weights)
+    scaled = [weight * count for weight in weights]
+    prob = [total] * count
+    alias = list(range(count))
+    small = [i for i in range(count) if scaled[i] < total]
+    large = [i for i in range(count) if scaled[i] >= total]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= total - scaled[less]
+        if scaled[more] < total:
+            small.append(more)
+        else:
+            large.append(more)
+    return prob, alias, total
+
+
+def alias_draw(prob, alias, total):
+    i = RAND(len(prob))
+    if RAND(total) < prob[i]:
+        return i
+    return alias[i]
+
+
 def locate_diffs(data1, data2, length):
-    f_loc = -1
-    l_loc = -1
-    for i in range(0, length):
-        if data1[i] != data2[i]:
-            if f_loc == -1: f_loc = i
-            l_loc = i
-    return f_loc, l_loc
+    '''
+    First and last positions where data1 and data2 differ within length, (-1, -1) if they are the same. Uses a
+    binary search over memoryview comparisons (memcmp) instead of comparing byte by byte.
+    '''
+    view1 = memoryview(data1)[:length]
+    view2 = memoryview(data2)[:length]
+    if view1 == view2:
+        return -1, -1
+
+    # data is the same in [0, low) and different somewhere in [0, high)
+    low, high = 0, length
+    while high - low > 1:
+        middle = (low + high) // 2
+        if view1[low:middle] == view2[low:middle]:
+            low = middle
+        else:
+            high = middle
+    f_loc = low
+
+    # data is the same in [high, length) and different somewhere in [low, length)
+    low, high = f_loc, length
+    while high - low > 1:
+        middle = (low + high) // 2
+        if view1[middle:high] == view2[middle:high]:
+            high = middle
+        else:
+            low = middle
+    return f_loc, low
 
 
 # source of this function
@@ -291,6 +291,8 @@ def print_summary(all_threads_stats, bytes_cov, time_elapsed, active_threads_cou
                         first_table_max_len, second_table_max_len))
         print(fill_table("New paths found", "Files in queue", new_paths_str, ("%d" % stats_total.stats['files_in_queue']),
                         first_table_max_len, second_table_max_len))
+        print(fill_table("Skipped as redundant", "Timeouts", ("%d" % stats_total.stats['redundant_skipped']),
+                        ("%d" % stats_total.stats['timeouts']), first_table_max_len, second_table_max_len))
         print ("|  ------------------------------------------   ------------------------------ |")
 
         print("--------------------------------------------------------------------------------")
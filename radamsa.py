@@ -6,11 +6,17 @@ import manul_utils
 
 PY3 = sys.version_info[0] == 3
 
+RADAMSA_BATCH = 16  # outputs generated per trip through the library
+
 
 class RadamsaFuzzer(object):
     def __init__(self, seed):
         self.seed = seed
         self.lib = None
+        self.has_batch = False
+        # one output arena reused by every batch, outputs are placed one after another
+        self.arena = None
+        self.arena_size = 0
         if not PY3:
             printing.ERROR("Radamsa library is not supported in Python2")
 
@@ -19,16 +25,74 @@ class RadamsaFuzzer(object):
         self.lib.radamsa_init()
 
         self.lib.radamsa.argtypes = [POINTER(c_ubyte), c_size_t, POINTER(c_ubyte), c_size_t, c_size_t]
+        # libraries built before radamsa_batch was added only have the single output call
+        self.has_batch = hasattr(self.lib, "radamsa_batch")
+        if self.has_batch:
+            self.lib.radamsa_batch.argtypes = [c_void_p, c_size_t, c_void_p, c_size_t, POINTER(c_size_t),
+                                               POINTER(c_size_t), c_size_t, POINTER(c_uint)]
+            self.lib.radamsa_batch.restype = c_size_t
+
+    def prepare_arena(self, count):
+        arena_size = count * helper.AFL_HAVOC_BLK_XL
+        if arena_size > self.arena_size:
+            self.arena = create_string_buffer(arena_size)
+            self.arena_size = arena_size
+
+    def radamsa_generate_batch(self, radamsa_input, count=RADAMSA_BATCH, detach=False):
+        '''
+        Generate count outputs from radamsa_input in one call, returns a list of memoryview slices. The slices point
+        into the shared arena and are only valid until the next call, with detach=True every output is copied out of
+        the arena as bytes, so outputs kept for later are freed one by one as they are used.
+        '''
+        self.prepare_arena(count)
+        maxs = (c_size_t * count)(*[helper.AFL_choose_block_len(helper.AFL_HAVOC_BLK_XL) for i in range(count)])
+        lens = (c_size_t * count)()
+        if self.has_batch:
+            seed = c_uint(self.seed & 0xffffffff)
+            produced = self.lib.radamsa_batch(radamsa_input, len(radamsa_input), self.arena, self.arena_size, maxs,
+                                              lens, count, byref(seed))
+            self.seed = seed.value
+        else:
+            produced = self.generate_batch_fallback(radamsa_input, maxs, lens, count)
+
+        arena = memoryview(self.arena)
+        outputs = []
+        offset = 0
+        for i in range(produced):
+            if lens[i]:
+                output = arena[offset:offset + lens[i]]
+                outputs.append(output.tobytes() if detach else output)
+            offset += lens[i]
+        return outputs
+
+    def generate_batch_fallback(self, radamsa_input, maxs, lens, count):
+        input_casted = cast(radamsa_input, POINTER(c_ubyte))
+        input_len = c_size_t(len(radamsa_input))
+        offset = 0
+        for i in range(count):
+            max_len = min(maxs[i], self.arena_size - offset)
+            if max_len == 0:
+                return i
+            output_casted = cast(addressof(self.arena) + offset, POINTER(c_ubyte))
+            lens[i] = 0
+            for attempt in range(16):
+                lens[i] = self.lib.radamsa(input_casted, input_len, output_casted, c_size_t(max_len),
+                                           c_size_t(self.seed))
+                self.seed += 1
+                if lens[i]:
+                    break
+            offset += lens[i]
+        return count
 
     def radamsa_generate_output(self, radamsa_input):
         input_len = c_size_t(len(radamsa_input))
         output_len = helper.AFL_choose_block_len(helper.AFL_HAVOC_BLK_XL)
-        radamsa_output = create_string_buffer(output_len)
+        self.prepare_arena(1)
         input_casted = cast(radamsa_input, POINTER(c_ubyte))
-        output_casted = cast(radamsa_output, POINTER(c_ubyte))
+        output_casted = cast(self.arena, POINTER(c_ubyte))
         bytes_mutated = 0
         while bytes_mutated == 0: # we call it in cycle because sometimes radamsa mutates 0 bytes
             bytes_mutated = self.lib.radamsa(input_casted, input_len, output_casted, c_size_t(output_len),
                                              c_size_t(self.seed))
             self.seed += 1
-        return bytearray(radamsa_output.raw[:bytes_mutated])
\ No newline at end of file
+        return bytearray(memoryview(self.arena)[:bytes_mutated])
\ No newline at end of file
@@ -16,6 +16,15 @@
 #   limitations under the License.
 
 from afl_fuzz import *
+import afl_fuzz
+from manul_queue import QueueEntry, CorpusIndex, update_bitmap_score, cull_queue, pending_batch_size
+from manul_plugins import UserMutator
+from manul_dict import AutoDictionary
+from manul_checkpoint import save_checkpoint, load_checkpoint, save_bitmaps, load_bitmaps, CalibrationLog
+from manul_stats import StatsLog, read_last_record, load_stats_log
+from manul_corpus import PackedCorpus, pack_directory, unpack_corpus
+from manul_storage import Storage, QueueIndex, content_hash, read_index_records, temp_path, publish
+from manul_scheduler import PowerScheduler
 import copy
 import radamsa
 import sys
@@ -30,7 +39,7 @@ def test_bitflip(data, iteration_id):
     last_str = None
     res = None
     while True:
-        data, res = bitflip_1bit(data, res)
+        data, res, _ = bitflip_1bit(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -44,7 +53,7 @@ def test_bitflip(data, iteration_id):
     data = copy.copy(original_data)
     res = None
     while True:
-        data, res = bitflip_2bits(data, res)
+        data, res, _ = bitflip_2bits(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -58,7 +67,7 @@ def test_bitflip(data, iteration_id):
     data = copy.copy(original_data)
     res = None
     while True:
-        data, res = bitflip_4bits(data, res)
+        data, res, _ = bitflip_4bits(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -80,7 +89,7 @@ def test_byteflip(data, iteration_id):
     last_str = None
     res = None
     while True:
-        data, res = byteflip_1(data, res)
+        data, res, _ = byteflip_1(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -95,7 +104,7 @@ def test_byteflip(data, iteration_id):
     res = None
 
     while True:
-        data, res = byteflip_2(data, res)
+        data, res, _ = byteflip_2(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -110,7 +119,7 @@ def test_byteflip(data, iteration_id):
     res = None
 
     while True:
-        data, res = byteflip_4(data, res)
+        data, res, _ = byteflip_4(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -124,14 +133,15 @@ def test_byteflip(data, iteration_id):
 
 def test_arithmentic(data, iteration_id):
     res = None
-    expected_output_1_byte = ["414141414141414141", "41414141", "4141", "41"]
-    expected_output_2_bytes = ["404141414141414142", "40414142", "4042", "41"]  # TODO: check if it is correct output
-    expected_output_4_bytes = ["414140414141414142", "41414042", "4141", "41"]  # TODO: check if it is correct output
+    # values which could be produced by bitflips or smaller arithmetic are skipped
+    expected_output_1_byte = ["555555555555555555", "55555555", "5555", "55"]
+    expected_output_2_bytes = ["414141414141414141", "41414141", "4141", "41"]
+    expected_output_4_bytes = ["414141414141414141", "41414141", "4141", "41"]
     original_data = copy.copy(data)  # sic!
     last_str = None
     res = None
     while True:
-        data, res = mutate_byte_arithmetic(data, res)
+        data, res, _ = mutate_byte_arithmetic(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -146,7 +156,7 @@ def test_arithmentic(data, iteration_id):
     res = None
     i = 0
     while True:
-        data, res = mutate_2bytes_arithmetic(data, res)
+        data, res, _ = mutate_2bytes_arithmetic(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -162,7 +172,7 @@ def test_arithmentic(data, iteration_id):
     res = None
 
     while True:
-        data, res = mutate_4bytes_arithmetic(data, res)
+        data, res, _ = mutate_4bytes_arithmetic(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -177,14 +187,14 @@ def test_arithmentic(data, iteration_id):
 # print ''.join('{:02x}'.format(x) for x in data)
 def test_interesting(data, iteration_id):
     res = None
-    expected_output_1_byte = ["7f7f7f7f7f7f7f7f7f", "7f7f7f7f", "7f7f", "7f"]
+    expected_output_1_byte = ["646464646464646464", "64646464", "6464", "64"]
     expected_output_2_bytes = ["ffffffffffffffff7f", "ffffff7f", "ff7f", "41"]
     expected_output_4_bytes = ["ffffffffffffffff7f", "ffffff7f", "4141", "41"]
     original_data = copy.copy(data)  # sic!
     last_str = None
     res = None
     while True:
-        data, res = mutate_1byte_interesting(data, res)
+        data, res, _ = mutate_1byte_interesting(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -199,7 +209,7 @@ def test_interesting(data, iteration_id):
     res = None
     i = 0
     while True:
-        data, res = mutate_2bytes_interesting(data, res)
+        data, res, _ = mutate_2bytes_interesting(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -215,7 +225,7 @@ def test_interesting(data, iteration_id):
     res = None
 
     while True:
-        data, res = mutate_4bytes_interesting(data, res)
+        data, res, _ = mutate_4bytes_interesting(data, res)
         if not res:
             last_str = ''.join('{:02x}'.format(x) for x in data)
             break
@@ -233,15 +243,14 @@ def test_dict(data, iteration_id):
     expected_output_insert = [b'very_long_dict_string777777777777777AAAAAAAAA', b'AtestAAA', b"AAext1", b"Aa"]
     data_clean = copy.copy(data)
 
-    # call AFL init to initialize dictionary
-    AFLFuzzer(tokens_list, None, "test_file")
+    afl_fuzz.dispatcher.set_tokens(tokens_list)
 
-    data, func_state = dictionary_overwrite(data, [iteration_id, iteration_id])
+    data, func_state, _ = dictionary_overwrite(data, [iteration_id, iteration_id])
     if data != expected_output_overwrite[iteration_id]:
         print("test_dict_overwrite failed, output is %s" % data)
     else:
         print("test_dict_overwrite succeeded")
-    data, func_state = dictionary_insert(data_clean, [iteration_id, iteration_id])
+    data, func_state, _ = dictionary_insert(data_clean, [iteration_id, iteration_id])
     if data != expected_output_insert[iteration_id]:
         print("test_dict_insert failed, output is %s" % data)
     else:
@@ -251,35 +260,35 @@ def test_dict(data, iteration_id):
 
 def test_havoc(data, iteration_id):
     print("starting havocs")
-    data = havoc_bitflip(data)
+    data, _ = havoc_bitflip(data)
     print("Bitflip:", data)
-    data = havoc_interesting_byte(data)
+    data, _ = havoc_interesting_byte(data)
     print("Interesting byte:", data)
-    data = havoc_interesting_2bytes(data)
+    data, _ = havoc_interesting_2bytes(data)
     print("Interesting 2 bytes:", data)
-    data = havoc_interesting_4bytes(data)
+    data, _ = havoc_interesting_4bytes(data)
     print("Interesting 4 bytes:", data)
-    data = havoc_randomly_add(data)
+    data, _ = havoc_randomly_add(data)
     print("Randomly add:", data)
-    data = havoc_randomly_substract(data)
+    data, _ = havoc_randomly_substract(data)
     print("Randomly subtract:", data)
-    data = havoc_randomly_add_2bytes(data)
+    data, _ = havoc_randomly_add_2bytes(data)
     print("Randomly add 2 bytes:", data)
-    data = havoc_randomly_substract_2bytes(data)
+    data, _ = havoc_randomly_substract_2bytes(data)
     print("Randomly subtract 2 bytes:", data)
-    data = havoc_randomly_add_4bytes(data)
+    data, _ = havoc_randomly_add_4bytes(data)
     print("Randomly add 4 bytes:", data)
-    data = havoc_randomly_substract_4bytes(data)
+    data, _ = havoc_randomly_substract_4bytes(data)
     print("Randomly subtract 4 bytes:", data)
-    data = havoc_remove_randomly_block(data)
+    data, _ = havoc_remove_randomly_block(data)
     print("Randomly remove block:", data)
-    data = havoc_clone_randomly_block(data)
+    data, _ = havoc_clone_randomly_block(data)
     print("Randomly clone block:", data)
-    data = havoc_overwrite_randomly_block(data)
+    data, _ = havoc_overwrite_randomly_block(data)
     print("Randomly overwrite block:", data)
-    data = havoc_overwrite_with_dict(data)
+    data, _ = havoc_overwrite_with_dict(data)
     print("Randomly overwrite with dict:", data)
-    data = havoc_insert_with_dict(data)
+    data, _ = havoc_insert_with_dict(data)
     print("Randomly insert with dict:", data)
     print("all havocs succeeded")
     return True
@@ -288,9 +297,11 @@ def test_havoc(data, iteration_id):
 def test_splice(data, iteration_id):
     # merge with manul.config or unit_tests.py :)
     print("Starting splice")
-    queue_path = "./"  # current path where we run this unit_tests.py
-    list_of_files = [(1, "manul.config"), (1, "unit_tests.py")]
-    data, func_state = splice(data, list_of_files, queue_path, None, 20)
+    list_of_files = [QueueEntry("manul.config", "./manul.config", True),
+                     QueueEntry("unit_tests.py", "./unit_tests.py", True)]
+    corpus = CorpusIndex()
+    corpus.update(list_of_files)
+    data, func_state, modified_slice = splice(data, corpus, None, 20)
     print("Result of splice:", data)
     return True
 
@@ -309,9 +320,9 @@ def test_cycle(data):
 
 
 def extra_test_havoc_remove_randomly_block():
-    data_extra = b"AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+    data_extra = bytearray(b"AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
     for i in range(0, 500):
-        data_extra = havoc_remove_randomly_block(data_extra)
+        data_extra, _ = havoc_remove_randomly_block(data_extra)
         if data_extra == b"":
             print("extra_test_havoc_remove_randomly_block failed!")
 
@@ -323,14 +334,327 @@ def test_radamsa_library(): # TODO: make it work on Windows
     print("Radamsa output %s" % res)
     if len(res) == 0:
         print("radamsa library test failed")
+    outputs = radamsa_fuzzer.radamsa_generate_batch(b"ABDSDADA", 8, detach=True)
+    if not outputs or any(len(output) == 0 for output in outputs):
+        print("radamsa batch test failed")
+    else:
+        print("radamsa batch test succeeded")
 
 def extra_test_havoc_add_random_block():
-    data = b'A'
-    data = havoc_clone_randomly_block(data)
+    data = bytearray(b'A')
+    data, _ = havoc_clone_randomly_block(data)
     if len(data) <= 1:
         print("extra_test_havoc_add_random_block failed!")
     print("Result of add random block %s" % data)
 
+def test_cull_queue():
+    # slow entry covers everything, two fast entries cover the same positions together
+    top_rated = [None] * 8
+    slow = QueueEntry("slow", "slow", True)
+    slow.exec_us, slow.size, slow.trace_mini = 1000, 10, (0, 1, 2, 3)
+    fast_a = QueueEntry("fast_a", "fast_a", True)
+    fast_a.exec_us, fast_a.size, fast_a.trace_mini = 10, 10, (0, 1)
+    fast_b = QueueEntry("fast_b", "fast_b", True)
+    fast_b.exec_us, fast_b.size, fast_b.trace_mini = 10, 10, (2, 3)
+    queue = [slow, fast_a, fast_b]
+    for entry in queue:
+        update_bitmap_score(top_rated, entry)
+    pending = cull_queue(top_rated, queue)
+    if slow.favored or not fast_a.favored or not fast_b.favored or pending != 2:
+        print("cull_queue failed")
+    else:
+        print("cull_queue succeeded")
+
+def test_power_schedule():
+    # two identical entries, one of them exercises its path much more often
+    scheduler = PowerScheduler("fast")
+    common = QueueEntry("common", "common", True)
+    rare = QueueEntry("rare", "rare", True)
+    for cksum, entry in enumerate([common, rare]):
+        entry.exec_us, entry.bitmap_size, entry.exec_cksum, entry.fuzz_level = 100, 10, cksum, 3
+        scheduler.add_entry(entry)
+    for i in range(0, 100):
+        scheduler.update_path_frequency(common.exec_cksum)
+    scheduler.update_path_frequency(rare.exec_cksum)
+    if scheduler.calculate_score(common) >= scheduler.calculate_score(rare) or common.fuzz_level != 4:
+        print("power_schedule failed")
+    else:
+        print("power_schedule succeeded")
+
+def test_redundant_skip():
+    # 0x41 + 4 only differs from 0x41 by one bit and must be skipped, 0x41 + 5 is new
+    afl_fuzz.redundant_skipped = 0
+    data, res, _ = mutate_byte_arithmetic(bytearray(b"A"), [0, 4, False])
+    if data != bytearray(b"F") or afl_fuzz.redundant_skipped != 1 or is_not_bitflip(0x0180) == False or \
+       is_not_arithmetic(0x4141, 0x4142, 2) or is_not_interesting(0x4141, 0xffff, 2, True):
+        print("redundant_skip failed")
+    else:
+        print("redundant_skip succeeded")
+
+def test_havoc_batch():
+    data = bytearray(b"A" * 64)
+    mutants = havoc_batch(data, 32)
+    buffers = [mutant for mutant, modified_slice in mutants]
+    mutants_reused = havoc_batch(data, 16, buffers)
+    if len(mutants) != 32 or len(mutants_reused) != 16 or data != bytearray(b"A" * 64) or \
+       all(mutant == data for mutant, modified_slice in mutants):
+        print("havoc_batch failed")
+    else:
+        print("havoc_batch succeeded")
+
+def test_fast_random():
+    rng = FastRandom(1)
+    draws = [rng.rand(10) for i in range(RAND_POOL_SIZE * 3)]
+    state = rng.getstate()
+    tail = [rng.rand(1 << 40) for i in range(100)]
+    rng.setstate(state)
+    replayed = [rng.rand(1 << 40) for i in range(100)]
+    if set(draws) != set(range(10)) or rng.rand(0) != 0 or tail != replayed or \
+       FastRandom(1).rand(1000) != FastRandom(1).rand(1000):
+        print("fast_random failed")
+    else:
+        print("fast_random succeeded")
+
+def test_locate_diffs():
+    if locate_diffs(b"AAAAAAAA", b"AABAAAAA", 8) != (2, 2) or locate_diffs(b"ABAAAABA", b"AAAAAAAA", 8) != (1, 6) or \
+       locate_diffs(b"AAAA", b"AAAAB", 4) != (-1, -1):
+        print("locate_diffs failed")
+    else:
+        print("locate_diffs succeeded")
+
+def run_stage(stage, data):
+    outputs = []
+    res = None
+    while True:
+        data, res, _ = stage(data, res)
+        if not res:
+            return outputs
+        outputs.append(bytes(data))
+
+def test_native_mutator():
+    native = afl_fuzz.native
+    if native is None:
+        print("native mutator is not built, skipping")
+        return
+    data = bytearray(b"\x00\x41\xff\x7f\x80\x10\x41\x41\x01")
+    stages = [mutate_byte_arithmetic, mutate_2bytes_arithmetic, mutate_4bytes_arithmetic, mutate_1byte_interesting,
+              mutate_2bytes_interesting, mutate_4bytes_interesting]
+    native_outputs = [run_stage(stage, bytearray(data)) for stage in stages]
+    afl_fuzz.native = None
+    python_outputs = [run_stage(stage, bytearray(data)) for stage in stages]
+    afl_fuzz.native = native
+
+    mutant, modified_slice = havoc_round(bytearray(data))
+    if native_outputs != python_outputs or not mutant:
+        print("native_mutator failed")
+    else:
+        print("native_mutator succeeded")
+
+def test_alias_table():
+    prob, alias, total = build_alias_table([95, 0, 5])
+    counts = [0, 0, 0]
+    for i in range(10000):
+        counts[alias_draw(prob, alias, total)] += 1
+    if counts[1] != 0 or not 9000 < counts[0] < 9900 or not 200 < counts[2] < 1000:
+        print("alias_table failed, counts are %s" % counts)
+    else:
+        print("alias_table succeeded")
+
+def test_user_mutator():
+    import example_batch_mutator
+    mutator = UserMutator("example_batch_mutator", example_batch_mutator, 1)
+    outputs = mutator.mutate_batch(bytearray(b"ABCD"), 4)
+    # small queues get whole batches, large ones one output per turn
+    if not mutator.batch or len(outputs) != 4 or any(len(out) != 4 for out in outputs) or \
+       pending_batch_size(16, 10) != 16 or pending_batch_size(16, 100000) != 1:
+        print("user_mutator failed, got %s" % outputs)
+    else:
+        print("user_mutator succeeded")
+
+def test_auto_dict():
+    # flipping any byte of the magic value takes the same path, the other bytes don't change the path at all
+    auto_dict = AutoDictionary([b"test"], [bytearray(b"test"), bytearray(b"MAGIC")])
+    data = bytearray(b"xxPWNITyy")
+    for i in range(2):
+        if i == 1:
+            seen_once = auto_dict.tokens()  # a token seen only once is not used yet
+        auto_dict.start()
+        for pos, byte in enumerate(data):
+            auto_dict.feed(byte, 1 if 2 <= pos < 7 else 0, 0, pos == len(data) - 1)
+    changed = auto_dict.changed
+    tokens = auto_dict.tokens()
+    # a more frequent token found later doesn't move the ones already in use
+    for i in range(3):
+        auto_dict.maybe_add(b"QWERTY")
+    auto_dict.maybe_add(b"PWNIT")
+    auto_dict.maybe_add(b"ONCE")
+    refreshed = auto_dict.tokens()
+    if seen_once != [b"test", b"MAGIC"] or not changed or tokens != [b"test", b"MAGIC", b"PWNIT"] or \
+       refreshed != tokens + [b"QWERTY"] or auto_dict.changed:
+        print("auto_dict failed, tokens are %s" % tokens)
+    else:
+        print("auto_dict succeeded")
+
+def test_checkpoint():
+    path = "./test_checkpoint"
+    calibration = (9, 0xdeadbeef, 1500, 3, (7, 100, 65534))
+    entries = [("a", 3, None), ("b", 6, [5, 12, True]), ("c", 14, 7)]
+    fast_random = FastRandom(1)
+    for i in range(RAND_POOL_SIZE + 10):  # checkpoint taken in the middle of the second pool
+        fast_random.rand(1000)
+    state = fast_random.getstate()
+    stream = [fast_random.rand(1000) for i in range(RAND_POOL_SIZE)]
+    save_checkpoint(path, entries, state, False, {1: 120}, {1: set(["manul-1", "manul-2"]), 2: set()})
+    checkpoint = load_checkpoint(path)
+    fast_random = FastRandom()
+    fast_random.setstate(checkpoint.rng_state)
+    replayed = [fast_random.rand(1000) for i in range(RAND_POOL_SIZE)]
+    save_bitmaps(path, bytearray(b"\xff" * 16), bytearray(b"\xfe" * 16))
+    virgin_bits, crash_bits = load_bitmaps(path)
+    with open(path, "r+b") as fd:
+        fd.seek(-1, os.SEEK_END)
+        fd.write(b"\x00")
+    try:
+        load_bitmaps(path)
+        corrupted = False
+    except ValueError:
+        corrupted = True
+    calibration_log = CalibrationLog(path, False)
+    calibration_log.append("a", calibration)
+    calibration_log.append("b", (1, 2, 3, 4, ()))
+    calibration_log.fd.write(b"\x05\x00\x01")  # incomplete record left by a crash
+    calibration_log.close()
+    calibration_log = CalibrationLog(path, True)
+    calibration_log.append("b", (5, 6, 7, 8, (9,)))
+    calibration_log.close()
+    calibration_log = CalibrationLog(path, True)
+    restored = calibration_log.entries
+    calibration_log.close()
+    os.remove(path)
+    if checkpoint.entries != dict((name, (stage, cursor)) for name, stage, cursor in entries) or \
+       restored != {"a": calibration, "b": (5, 6, 7, 8, (9,))} or checkpoint.sync_offsets != {1: 120, 2: 0} or \
+       checkpoint.sync_seen != {1: set(["manul-1", "manul-2"]), 2: set()} or \
+       checkpoint.rng_state != (state[0], tuple(state[1]), state[2]) or virgin_bits != b"\xff" * 16 or \
+       crash_bits != b"\xfe" * 16 or not corrupted or stream != replayed:
+        print("checkpoint failed")
+    else:
+        print("checkpoint succeeded")
+
+def test_storage():
+    storage = Storage(background=True)
+    data = bytearray(b"crash")
+    paths = ["./test_storage_%d" % i for i in range(40)]
+    broken_path = temp_path(paths[0])
+    broken = open(broken_path, "wb")
+    broken.close()
+    storage.unsynced.append((broken, broken_path, paths[0]))  # a file the writer failed to sync before
+    storage.save("./test_storage_missing/crash", data)  # failures must not stop the writer
+    for path in paths:
+        storage.save(path, data)
+    data[0] = 0x41  # saved content must not depend on the buffer
+    storage.flush()
+    contents = [extract_content(path) for path in paths]
+    # another instance renamed the same blob first, its temporary file is gone but the blob is in place
+    publish(temp_path(paths[0]), paths[0])
+    for path in paths:
+        os.remove(path)
+    if contents != [b"crash"] * 40 or temp_path(paths[0]) == temp_path(paths[0]) or not storage.is_new_crash(b"crash") or storage.is_new_crash(b"crash") or \
+       storage.unsynced:
+        print("storage failed")
+    else:
+        print("storage succeeded")
+
+def test_queue_index():
+    path = "./test_queue_index"
+    queue_index = QueueIndex(path, "./blobs")
+    blob_hash = content_hash(b"AAAA")
+    queue_index.add(blob_hash, "seed", "afl", 1234, 5)
+    queue_index.fd.write('{"hash": "trunc')  # incomplete record left by a crash
+    queue_index.fd.close()
+    queue_index = QueueIndex(path, "./blobs")
+    queue_index.add(content_hash(b"BBBB"), blob_hash, "radamsa", 4321, 6)
+    queue_index.fd.close()
+    records = QueueIndex(path, "./blobs").records
+    unread = read_index_records(path, read_index_records(path)[0][1])  # what another instance reads next time
+    os.remove(path)
+    if blob_hash not in queue_index or queue_index.blob_path(blob_hash) != "./blobs/" + blob_hash or \
+       [(record["parent"], record["mutator"]) for record in records] != [("seed", "afl"), (blob_hash, "radamsa")] or \
+       [record["mutator"] for record, offset in unread] != ["radamsa"]:
+        print("queue_index failed")
+    else:
+        print("queue_index succeeded")
+
+def test_packed_corpus():
+    directory, pack_path = "./test_corpus", "./test_corpus.pack"
+    os.mkdir(directory)
+    for name, content in [("b", b"BBBB"), ("a", b"AA"), ("empty", b"")]:
+        with open(directory + "/" + name, "wb") as fd:
+            fd.write(content)
+    pack_directory(directory, pack_path)
+    corpus = PackedCorpus(pack_path)
+    entry = QueueEntry("b", directory + "/b", False, corpus)
+    entry.update_size()
+    data = entry.read()
+    data[0] = 0x41  # mutating the copy must not touch the corpus
+    result = (corpus.names, bytes(entry.view()), entry.size, bytes(corpus.content("empty")))
+    corpus.close()
+    for name in os.listdir(directory):
+        os.remove(directory + "/" + name)
+    unpack_corpus(pack_path, directory)
+    unpacked = sorted(os.listdir(directory))
+    for name in unpacked:
+        os.remove(directory + "/" + name)
+    os.rmdir(directory)
+    os.remove(pack_path)
+    os.remove(pack_path + ".idx")
+    if result != (["a", "b", "empty"], b"BBBB", 4, b"") or unpacked != ["a", "b", "empty"]:
+        print("packed_corpus failed, got %s" % (result,))
+    else:
+        print("packed_corpus succeeded")
+
+def test_stats_log():
+    path = "./test_stats_log"
+    stats_log = StatsLog(path, ["executions", "new_paths"])
+    for i in range(10):
+        stats_log.append(float(i), [i * 100.0, i])
+    stats_log.fd.write(b"\x00" * 5)  # incomplete record left by a crash
+    stats_log.close()
+    stats_log = StatsLog(path, ["executions", "new_paths"])
+    stats_log.append(10.0, [1000.0, 10])
+    stats_log.close()
+    last = read_last_record(path)
+    columns = load_stats_log(path)
+    os.remove(path)
+    if last != (10.0, {"executions": 1000.0, "new_paths": 10.0}) or list(columns["new_paths"]) != list(range(11)):
+        print("stats_log failed")
+    else:
+        print("stats_log succeeded")
+
+def test_effector_map():
+    # only the 6th block changes the path, the first and the last ones are always mutated
+    fuzzer = AFLFuzzer("test_file")
+    data = bytearray(b"A" * 256)
+    fuzzer.start_eff_map(len(data))
+    for pos in range(0, len(data)):
+        fuzzer.pending_flip = (pos, data[pos], False)
+        fuzzer.update_eff_map(1 if 40 <= pos < 48 else 0, 0)
+    fuzzer.finish_eff_map()
+
+    afl_fuzz.eff_map = fuzzer.eff_map
+    positions = set()
+    res = None
+    while True:
+        data, res, modified = mutate_byte_arithmetic(data, res)
+        if not res:
+            break
+        positions.add(modified[0])
+    afl_fuzz.eff_map = None
+
+    if positions != set(range(0, 8)) | set(range(40, 48)) | set(range(248, 256)):
+        print("effector_map failed")
+    else:
+        print("effector_map succeeded")
+
 if __name__ == "__main__":
     test_cycle(bytearray("AAAAAAAAA", "utf-8"))  # regular string
     test_cycle(bytearray("AAAA", "utf-8"))  # short string
@@ -338,6 +662,22 @@ if __name__ == "__main__":
     test_cycle(bytearray("A", "utf-8"))  # the shortest string
     extra_test_havoc_remove_randomly_block()
     extra_test_havoc_add_random_block()
+    test_cull_queue()
+    test_power_schedule()
+    test_effector_map()
+    test_redundant_skip()
+    test_havoc_batch()
+    test_fast_random()
+    test_locate_diffs()
+    test_native_mutator()
+    test_alias_table()
+    test_user_mutator()
+    test_auto_dict()
+    test_checkpoint()
+    test_stats_log()
+    test_storage()
+    test_queue_index()
+    test_packed_corpus()
 
     if is_bytearrays_equal(b"AAAAAA", b"AAAAAA") == False or is_bytearrays_equal(b"AAAAAAA", b"BEBEBEBE") == True:
         print("is_bytearray_equal failed")